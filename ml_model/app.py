@@ -1,47 +1,251 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, File, Field, Data, Epilogue, NeedData
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 import os
+import io
+import csv
 import json
+import threading
+import time
+import zlib
+import numpy as np
 from pathlib import Path
+from utils.attendance_store import AttendanceStore, log_path_for
+from utils.attendance_aggregator import AttendanceAggregator
+from utils.attendance_stats import BUCKETS as STATS_BUCKETS
+from utils.gallery import LiveGallery, cluster_templates, encode_gallery
+from utils.embedding_store import EmbeddingStore
+from utils.face_quality import FaceRejected
+from utils import metrics
+from config import (SIMILARITY_THRESHOLD, ANN_MIN_GALLERY_SIZE, ANN_NPROBE, ANN_RECLUSTER_GROWTH, TEMPLATE_SCORE_TOP,
+                    PROFILER_INTERVAL, PROFILER_MIN_INTERVAL, PROFILER_MAX_INTERVAL, ENROLL_WORKERS)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'X-Gallery-Version'])
 
 # JSON Storage Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
 ATTENDANCE_FILE = os.path.join(DATA_DIR, 'attendance.json')
 EMBEDDINGS_DIR = os.path.join(BASE_DIR, '..', 'web_app', 'embeddings')
+GALLERY_DIR = os.path.join(DATA_DIR, 'gallery')
+GALLERY_INDEX_FILE = os.path.join(DATA_DIR, 'gallery_ivf.npz')
 
-# Ensure directories exist
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+# Largest page GET /api/attendance returns when a limit is requested
+MAX_PAGE_SIZE = 1000
 
-# Initialize attendance file if it doesn't exist
-if not os.path.exists(ATTENDANCE_FILE):
-    with open(ATTENDANCE_FILE, 'w') as f:
-        json.dump({'records': [], 'next_id': 1}, f, indent=2)
+# Most matches POST /api/identify returns per query
+MAX_TOP_K = 20
+
+# Most queries accepted by POST /api/identify/batch
+MAX_IDENTIFY_BATCH = 8192
+
+# Most records and (decompressed) bytes accepted by POST /api/attendance/batch
+MAX_ATTENDANCE_BATCH = 100000
+MAX_ATTENDANCE_BATCH_BYTES = 64 * 1024 * 1024
+
+# Most per-row errors a rejected batch reports
+MAX_BATCH_ERRORS = 100
+
+# Formats and columns of GET /api/attendance/export
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_FIELDS = ['id', 'name', 'timestamp', 'confidence', 'first_seen', 'last_seen', 'sightings', 'created_at']
+
+# Formats of GET /api/gallery
+GALLERY_FORMATS = {'json': 'application/json', 'f32': 'application/octet-stream'}
+
+# Limits of POST /api/enroll/<name>: images per request, bytes per image, templates per person
+MAX_ENROLL_IMAGES = 1000
+MAX_ENROLL_IMAGE_BYTES = 16 * 1024 * 1024
+MAX_ENROLL_TEMPLATES = 16
+
+# Uploaded images queued per enrollment worker; bounds memory held by a large upload
+ENROLL_INFLIGHT_PER_WORKER = 4
+
+# Bytes read from an upload at a time
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Directories are created by the stores (and save_embedding) on first
+# write, so importing the app has no filesystem side effects
+
+# Attendance stores, one per configured file (tests point ATTENDANCE_FILE elsewhere)
+_attendance_stores = {}
+_attendance_stores_lock = threading.Lock()
+
+def get_attendance_store():
+    """Return the append-only store for the configured attendance file"""
+    path = app.config.get('ATTENDANCE_FILE', ATTENDANCE_FILE)
+    with _attendance_stores_lock:
+        store = _attendance_stores.get(path)
+        if store is None:
+            store = AttendanceStore(log_path_for(path), legacy_path=path)
+            _attendance_stores[path] = store
+        return store
+
+# Sighting aggregators, one per attendance store
+_attendance_aggregators = {}
+
+def get_attendance_aggregator():
+    """Return the aggregator that merges repeated sightings into one record per visit"""
+    store = get_attendance_store()
+    with _attendance_stores_lock:
+        aggregator = _attendance_aggregators.get(store.log_path)
+        if aggregator is None:
+            aggregator = AttendanceAggregator(store)
+            _attendance_aggregators[store.log_path] = aggregator
+        return aggregator
+
+def close_attendance_store():
+    """Flush and close the configured file's aggregator and store, e.g. before removing it"""
+    path = app.config.get('ATTENDANCE_FILE', ATTENDANCE_FILE)
+    with _attendance_stores_lock:
+        store = _attendance_stores.pop(path, None)
+        aggregator = _attendance_aggregators.pop(store.log_path, None) if store else None
+    if aggregator is not None:
+        aggregator.close()
+    if store is not None:
+        store.close()
+
+def get_embeddings_dir():
+    """Return the configured embeddings directory"""
+    return app.config.get('EMBEDDINGS_DIR', EMBEDDINGS_DIR)
+
+# Binary embedding stores, one per configured gallery directory
+_embedding_stores = {}
+_embedding_stores_lock = threading.Lock()
+
+def get_embedding_store():
+    """Return the memory-mapped gallery store, importing JSON embeddings on first use"""
+    directory = app.config.get('GALLERY_DIR', GALLERY_DIR)
+    with _embedding_stores_lock:
+        store = _embedding_stores.get(directory)
+        if store is None:
+            store = EmbeddingStore(directory)
+            embeddings_dir = get_embeddings_dir()
+            if not len(store) and os.path.isdir(embeddings_dir):
+                count = store.import_json_dir(embeddings_dir)
+                if count:
+                    print(f"Imported {count} embeddings into {directory}")
+            _embedding_stores[directory] = store
+        return store
+
+# Gallery matchers, one per gallery directory, rebuilt when the store version changes
+_live_galleries = {}
+_gallery_lock = threading.Lock()
+
+def get_gallery():
+    """Return the gallery matcher for the current store version"""
+    store = get_embedding_store()
+    with _gallery_lock:
+        live = _live_galleries.get(store.directory)
+        if live is None:
+            live = LiveGallery(store,
+                               index_file=app.config.get('GALLERY_INDEX_FILE', GALLERY_INDEX_FILE),
+                               ann_min_size=ANN_MIN_GALLERY_SIZE, nprobe=ANN_NPROBE,
+                               template_top=TEMPLATE_SCORE_TOP, recluster_growth=ANN_RECLUSTER_GROWTH)
+            _live_galleries[store.directory] = live
+    return live.current()
+
+# Encoded gallery downloads, cached per (directory, format) until the store version changes
+_gallery_payloads = {}
+
+def get_gallery_payload(fmt):
+    """Return (version, body) for GET /api/gallery, encoding each version once"""
+    store = get_embedding_store()
+    store.refresh()
+    key = (store.directory, fmt)
+    with _gallery_lock:
+        cached = _gallery_payloads.get(key)
+        if cached is not None and cached[0] == store.version:
+            return cached
+    
+    with metrics.timed('gallery_encode'):
+        version, names, matrix = store.vectors()
+        if fmt == 'f32':
+            body = encode_gallery(version, names, matrix)
+        else:
+            body = json.dumps({'version': version, 'dim': store.dim, 'names': names,
+                               'embeddings': matrix.tolist()}, separators=(',', ':'))
+    with _gallery_lock:
+        cached = _gallery_payloads.get(key)
+        if cached is None or cached[0] < version:
+            _gallery_payloads[key] = (version, body)
+    return version, body
+
+# Threads that extract uploaded images, each reusing its own pooled FaceMesh
+_enroll_pool = None
+_enroll_pool_lock = threading.Lock()
+
+def get_enroll_pool():
+    """Return the shared enrollment worker pool, starting it on first use"""
+    global _enroll_pool
+    with _enroll_pool_lock:
+        if _enroll_pool is None:
+            _enroll_pool = ThreadPoolExecutor(max_workers=ENROLL_WORKERS, thread_name_prefix='enroll')
+        return _enroll_pool
+
+def extract_upload(data):
+    """Embedding of the first face in an uploaded image, or None; ValueError if unreadable, FaceRejected if it fails the quality gate"""
+    from utils.extract_embedding import get_embedding_from_bytes
+    
+    embedding = get_embedding_from_bytes(data)
+    return None if embedding is None else np.asarray(embedding, dtype=np.float32)
 
 def load_attendance_data():
-    """Load attendance data from JSON file"""
+    """Load attendance data as a {'records': [...], 'next_id': N} document"""
     try:
-        with open(ATTENDANCE_FILE, 'r') as f:
-            return json.load(f)
+        with metrics.timed('attendance_json_load'):
+            store = get_attendance_store()
+            return {'records': store.records(), 'next_id': store.next_id}
     except Exception as e:
         print(f"Error loading attendance data: {e}")
         return {'records': [], 'next_id': 1}
 
 def save_attendance_data(data):
-    """Save attendance data to JSON file"""
+    """Replace all attendance data with a {'records': [...], 'next_id': N} document"""
     try:
-        with open(ATTENDANCE_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        with metrics.timed('attendance_json_save'):
+            get_attendance_store().replace_all(data.get('records', []), data.get('next_id', 1))
         return True
     except Exception as e:
         print(f"Error saving attendance data: {e}")
         return False
 
+# Instrumentation
+
+http_requests = metrics.registry.counter(
+    'face_http_requests_total', 'HTTP requests handled', labels=('method', 'route', 'status'))
+http_request_seconds = metrics.registry.histogram(
+    'face_http_request_duration_seconds', 'Time to produce a response', labels=('route',))
+
+metrics.registry.gauge('face_gallery_people', 'People enrolled in the gallery',
+                       lambda: len(get_embedding_store()))
+metrics.registry.gauge('face_gallery_version', 'Version of the gallery store',
+                       lambda: get_embedding_store().version)
+metrics.registry.gauge('face_attendance_records', 'Attendance records currently stored',
+                       lambda: len(get_attendance_store()))
+metrics.registry.gauge('face_attendance_log_bytes', 'Size of the attendance log file',
+                       lambda: metrics.file_size(get_attendance_store().log_path))
+metrics.registry.gauge('face_profiler_running', '1 while the sampling profiler is on',
+                       lambda: int(metrics.profiler.running))
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Label by route rule, not path, so ids and names do not explode cardinality
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        http_request_seconds.observe(time.perf_counter() - started, route)
+    http_requests.inc(request.method, route, str(response.status_code))
+    return response
+
 # API Routes
 
 @app.route('/api/attendance', methods=['POST'])
@@ -62,62 +266,268 @@ def log_attendance():
         if not (0 <= confidence <= 1):
             return jsonify({'error': 'Confidence must be between 0 and 1'}), 400
         
-        # Load current data
-        attendance_data = load_attendance_data()
+        # Repeated sightings within a visit update that visit's record
+        try:
+            record, created = get_attendance_aggregator().sighting(name, round(confidence, 4))
+        except OSError as e:
+            print(f"Error saving attendance record: {e}")
+            return jsonify({'error': 'Failed to save attendance record'}), 500
         
-        # Create new record
-        now = datetime.utcnow().isoformat()
-        record = {
-            'id': attendance_data['next_id'],
-            'name': name,
-            'timestamp': now,
-            'confidence': round(confidence, 4),
-            'created_at': now
-        }
+        return jsonify(record), 201 if created else 200
+    
+    except ValueError as e:
+        return jsonify({'error': f'Invalid data format: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def read_batch_body():
+    """The request body, gunzipped if needed and bounded by MAX_ATTENDANCE_BATCH_BYTES"""
+    body = request.get_data()
+    if request.content_encoding == 'gzip' or body[:2] == b'\x1f\x8b':
+        # wbits 16+ reads the gzip header; max_length guards against zip bombs
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = inflater.decompress(body, MAX_ATTENDANCE_BATCH_BYTES + 1)
+        if inflater.unconsumed_tail:
+            body += b'x'
+    if len(body) > MAX_ATTENDANCE_BATCH_BYTES:
+        raise ValueError(f'Batch body exceeds {MAX_ATTENDANCE_BATCH_BYTES} bytes')
+    return body
+
+def parse_attendance_batch(body, mimetype):
+    """Decode a JSON array, {"records": [...]} or NDJSON body into a list of rows"""
+    if mimetype == 'application/x-ndjson':
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get('records')
+    if not isinstance(data, list):
+        raise ValueError('Expected an array of records or {"records": [...]}')
+    return data
+
+def _as_array(values, dtype):
+    """Convert values with one numpy call; on failure find the offending entries one by one"""
+    try:
+        return np.asarray(values, dtype=dtype), np.zeros(len(values), dtype=bool)
+    except (TypeError, ValueError, OverflowError):
+        pass
+    bad = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            np.asarray(value, dtype=dtype)
+        except (TypeError, ValueError, OverflowError):
+            bad[i] = True
+    fill = np.zeros((), dtype=dtype)
+    return np.asarray([fill if b else v for v, b in zip(values, bad)], dtype=dtype), bad
+
+def validate_attendance_batch(rows):
+    """Validate all rows in a few array passes; returns (records, errors)"""
+    count = len(rows)
+    errors = []
+    def reject(mask, message):
+        errors.extend({'index': int(i), 'error': message} for i in np.flatnonzero(mask))
+
+    is_row = np.fromiter((isinstance(r, dict) for r in rows), dtype=bool, count=count)
+    reject(~is_row, 'Record must be an object')
+    rows = [r if ok else {} for r, ok in zip(rows, is_row)]
+
+    names = [r.get('name') for r in rows]
+    names = [n.strip() if isinstance(n, str) else '' for n in names]
+    empty = np.fromiter(map(len, names), dtype=np.int64, count=count) == 0
+    reject(is_row & empty, 'Name must be a non-empty string')
+
+    # Only JSON numbers count (not booleans, strings, arrays or objects);
+    # anything else, or a missing confidence, becomes NaN and fails the range check
+    values = [r.get('confidence') for r in rows]
+    is_number = np.fromiter((isinstance(v, (int, float)) and not isinstance(v, bool) for v in values),
+                            dtype=bool, count=count)
+    confidences, bad = _as_array([v if ok else np.nan for v, ok in zip(values, is_number)], np.float64)
+    if confidences.shape != (count,):
+        raise ValueError('Confidences must be scalars')
+    in_range = np.isfinite(confidences) & (confidences >= 0) & (confidences <= 1)
+    reject(is_row & (bad | ~in_range), 'Confidence must be a number between 0 and 1')
+
+    # Rows without a timestamp are stamped with the ingest time
+    now = datetime.utcnow()
+    stamps = [r.get('timestamp', now.isoformat()) for r in rows]
+    is_text = np.fromiter((isinstance(t, str) for t in stamps), dtype=bool, count=count)
+    times, bad = _as_array([t if ok else now.isoformat() for t, ok in zip(stamps, is_text)],
+                           'datetime64[us]')
+    reject(is_row & (bad | ~is_text), 'Timestamp must be an ISO 8601 date-time')
+
+    if errors:
+        errors.sort(key=lambda e: e['index'])
+        return [], errors
+
+    created_at = now.isoformat()
+    records = [
+        {'name': name, 'timestamp': when.isoformat(), 'confidence': confidence, 'created_at': created_at}
+        for name, when, confidence in zip(names, times.astype(object), np.round(confidences, 4).tolist())
+    ]
+    return records, []
+
+@app.route('/api/attendance/batch', methods=['POST'])
+def log_attendance_batch():
+    """Ingest many buffered attendance records under one contiguous id range"""
+    try:
+        rows = parse_attendance_batch(read_batch_body(), request.mimetype)
+        if not (1 <= len(rows) <= MAX_ATTENDANCE_BATCH):
+            return jsonify({'error': f'Batch must hold between 1 and {MAX_ATTENDANCE_BATCH} records'}), 400
         
-        # Add to records
-        attendance_data['records'].append(record)
-        attendance_data['next_id'] += 1
+        # All or nothing: one bad row rejects the whole batch
+        records, errors = validate_attendance_batch(rows)
+        if errors:
+            return jsonify({
+                'error': f'{len(errors)} invalid record(s)',
+                'errors': errors[:MAX_BATCH_ERRORS]
+            }), 400
         
-        # Save updated data
-        if save_attendance_data(attendance_data):
-            return jsonify(record), 201
-        else:
-            return jsonify({'error': 'Failed to save attendance record'}), 500
+        try:
+            records = get_attendance_store().add_many(records)
+        except OSError as e:
+            print(f"Error saving attendance batch: {e}")
+            return jsonify({'error': 'Failed to save attendance records'}), 500
+        
+        return jsonify({
+            'inserted': len(records),
+            'first_id': records[0]['id'],
+            'last_id': records[-1]['id']
+        }), 201
     
-    except ValueError as e:
+    except (zlib.error, UnicodeDecodeError, TypeError, ValueError) as e:
         return jsonify({'error': f'Invalid data format: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def attendance_filters():
+    """Read the name/date/from/to query filters; raises ValueError for bad dates"""
+    name = request.args.get('name', '').strip()
+    date = request.args.get('date', '').strip()
+    date_from = request.args.get('from', '').strip()
+    date_to = request.args.get('to', '').strip()
+    
+    # A single date is a range of one day
+    if date:
+        date_from = date_to = date
+    
+    # Validate date format
+    for value in (date_from, date_to):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+    
+    return name or None, date_from or None, date_to or None
+
 @app.route('/api/attendance', methods=['GET'])
 def get_attendance():
-    """Fetch attendance records with optional filtering"""
+    """Fetch attendance records with optional filtering and pagination"""
     try:
-        name = request.args.get('name', '').strip()
-        date = request.args.get('date', '').strip()
-        
-        # Load attendance data
-        attendance_data = load_attendance_data()
-        records = attendance_data.get('records', [])
-        
-        # Filter by name
-        if name:
-            records = [r for r in records if name.lower() in r['name'].lower()]
+        try:
+            name, date_from, date_to = attendance_filters()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        cursor = request.args.get('cursor', '').strip() or None
+        limit = request.args.get('limit', '').strip()
         
-        # Filter by date
-        if date:
+        if limit:
             try:
-                # Validate date format
-                datetime.strptime(date, '%Y-%m-%d')
-                records = [r for r in records if r['timestamp'].startswith(date)]
+                limit = int(limit)
             except ValueError:
-                return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+                return jsonify({'error': 'Limit must be an integer'}), 400
+            if not (1 <= limit <= MAX_PAGE_SIZE):
+                return jsonify({'error': f'Limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+        else:
+            limit = None
         
-        # Sort by timestamp descending
-        records = sorted(records, key=lambda x: x['timestamp'], reverse=True)
+        # Query the indexes (newest first)
+        try:
+            records, next_cursor = get_attendance_store().query(
+                name=name,
+                date_from=date_from,
+                date_to=date_to,
+                limit=limit,
+                cursor=cursor
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
-        return jsonify(records), 200
+        response = jsonify(records)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def export_rows(chunks, fmt):
+    """Encode chunks of records as CSV or NDJSON text, one string per chunk"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        yield buffer.getvalue()
+    for chunk in chunks:
+        if fmt == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+        else:
+            yield ''.join(json.dumps(record) + '\n' for record in chunk)
+
+def gzip_stream(parts):
+    """Compress a stream of strings into gzip chunks"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for part in parts:
+        data = compressor.compress(part.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/attendance/export', methods=['GET'])
+def export_attendance():
+    """Stream matching records oldest first as CSV or NDJSON"""
+    try:
+        try:
+            name, date_from, date_to = attendance_filters()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        fmt = request.args.get('format', 'csv').strip().lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f'Format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+        
+        # Records are read a chunk at a time while the response is sent
+        chunks = get_attendance_store().scan(name=name, date_from=date_from, date_to=date_to)
+        body = export_rows(chunks, fmt)
+        headers = {
+            'Content-Disposition': f'attachment; filename=attendance_{datetime.utcnow().date().isoformat()}.{fmt}',
+            'Vary': 'Accept-Encoding'
+        }
+        if 'gzip' in request.accept_encodings:
+            body = gzip_stream(body)
+            headers['Content-Encoding'] = 'gzip'
+        
+        return Response(body, mimetype=EXPORT_FORMATS[fmt], headers=headers), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/attendance/stats', methods=['GET'])
+def attendance_stats():
+    """Headcount and first-in/last-out per time bucket, and days present per person"""
+    try:
+        try:
+            name, date_from, date_to = attendance_filters()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        bucket = request.args.get('bucket', 'day').strip().lower()
+        if bucket not in STATS_BUCKETS:
+            return jsonify({'error': f'Bucket must be one of: {", ".join(STATS_BUCKETS)}'}), 400
+        
+        # Served from rollups kept up to date on every write, not from raw records
+        buckets, persons = get_attendance_store().stats(
+            bucket=bucket, name=name, date_from=date_from, date_to=date_to
+        )
+        
+        return jsonify({'bucket': bucket, 'buckets': buckets, 'persons': persons}), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -126,25 +536,16 @@ def get_attendance():
 def delete_attendance(record_id):
     """Delete a specific attendance record"""
     try:
-        # Load attendance data
-        attendance_data = load_attendance_data()
-        records = attendance_data.get('records', [])
-        
-        # Find and remove record
-        original_length = len(records)
-        records = [r for r in records if r['id'] != record_id]
+        try:
+            deleted = get_attendance_store().delete(record_id)
+        except OSError as e:
+            print(f"Error deleting attendance record: {e}")
+            return jsonify({'error': 'Failed to delete record'}), 500
         
-        if len(records) == original_length:
+        if not deleted:
             return jsonify({'error': 'Record not found'}), 404
         
-        # Update data
-        attendance_data['records'] = records
-        
-        # Save updated data
-        if save_attendance_data(attendance_data):
-            return jsonify({'success': True, 'message': 'Record deleted successfully'}), 200
-        else:
-            return jsonify({'error': 'Failed to delete record'}), 500
+        return jsonify({'success': True, 'message': 'Record deleted successfully'}), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -153,24 +554,93 @@ def delete_attendance(record_id):
 def get_embeddings():
     """List all trained people/embeddings"""
     try:
-        if not os.path.exists(EMBEDDINGS_DIR):
-            return jsonify([]), 200
-        
+        # Served from the gallery index instead of scanning the directory
+        store = get_embedding_store()
         embeddings_list = []
+        for name in store.names():
+            entry = store.entry(name)
+            embeddings_list.append({
+                'name': name,
+                'path': f'embeddings/{name}_embedding.json',
+                'saved_at': entry['saved_at'] if entry else None
+            })
+        
+        return jsonify(embeddings_list), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/gallery', methods=['GET'])
+def get_gallery_snapshot():
+    """Download every enrolled embedding at once, with conditional GET on the version"""
+    try:
+        fmt = request.args.get('format', 'json').strip().lower()
+        if fmt not in GALLERY_FORMATS:
+            return jsonify({'error': f'Format must be one of: {", ".join(GALLERY_FORMATS)}'}), 400
+        
+        version, body = get_gallery_payload(fmt)
+        # Each format is its own representation, so it gets its own tag
+        etag = f'{version}-{fmt}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=GALLERY_FORMATS[fmt])
+        response.set_etag(etag)
+        response.headers['X-Gallery-Version'] = str(version)
+        # Clients may keep the copy but must revalidate before using it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/gallery/changes', methods=['GET'])
+def get_gallery_changes():
+    """Embeddings added, updated and removed since a gallery version, or a snapshot"""
+    try:
+        fmt = request.args.get('format', 'json').strip().lower()
+        if fmt not in GALLERY_FORMATS:
+            return jsonify({'error': f'Format must be one of: {", ".join(GALLERY_FORMATS)}'}), 400
+        try:
+            since = int(request.args.get('since', ''))
+        except ValueError:
+            return jsonify({'error': 'since must be a gallery version (integer)'}), 400
         
-        for filename in os.listdir(EMBEDDINGS_DIR):
-            if filename.endswith('_embedding.json'):
-                person_name = filename.replace('_embedding.json', '')
-                embeddings_list.append({
-                    'name': person_name,
-                    'path': f'embeddings/{filename}'
-                })
+        store = get_embedding_store()
+        version, delta = store.changes(since)
+        if delta is None:
+            # The change log no longer reaches back that far: send everything
+            version, names, matrix = store.vectors()
+            fields = {'since': since, 'snapshot': True}
+        else:
+            names, matrix = delta['names'], delta['matrix']
+            fields = {'since': since, 'snapshot': False, 'added': delta['added'],
+                      'updated': delta['updated'], 'removed': delta['removed']}
         
-        return jsonify(sorted(embeddings_list, key=lambda x: x['name'])), 200
+        if fmt == 'f32':
+            response = Response(encode_gallery(version, names, matrix, **fields), mimetype=GALLERY_FORMATS[fmt])
+        else:
+            response = jsonify(dict(fields, version=version, dim=store.dim, names=names,
+                                    embeddings=matrix.tolist()))
+        response.headers['X-Gallery-Version'] = str(version)
+        response.headers['Cache-Control'] = 'no-store'
+        return response, 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def write_embedding_file(name, embedding_data):
+    """Write <name>_embedding.json for the web app"""
+    embeddings_dir = get_embeddings_dir()
+    os.makedirs(embeddings_dir, exist_ok=True)
+    embedding_file = os.path.join(embeddings_dir, f'{name}_embedding.json')
+    
+    # Write then rename so readers never see a half-written file
+    tmp_file = embedding_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(embedding_data, f, indent=2)
+    os.replace(tmp_file, embedding_file)
+
 @app.route('/api/embeddings/<name>', methods=['POST'])
 def save_embedding(name):
     """Save a new embedding"""
@@ -184,20 +654,27 @@ def save_embedding(name):
         if not name:
             return jsonify({'error': 'Name cannot be empty'}), 400
         
-        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
-        
-        embedding_file = os.path.join(EMBEDDINGS_DIR, f'{name}_embedding.json')
+        embedding = data['embedding']
+        if not isinstance(embedding, list) or not embedding or not all(
+                isinstance(v, (int, float)) and not isinstance(v, bool) for v in embedding):
+            return jsonify({'error': 'Embedding must be a non-empty list of numbers'}), 400
         
         embedding_data = {
             'name': name,
-            'embedding': data['embedding'],
+            'embedding': embedding,
             'saved_at': datetime.utcnow().isoformat()
         }
+        write_embedding_file(name, embedding_data)
         
-        with open(embedding_file, 'w') as f:
-            json.dump(embedding_data, f, indent=2)
+        # Embeddings in the current layout also go into the binary gallery
+        store = get_embedding_store()
+        if len(embedding) == store.dim:
+            store.put(name, embedding, saved_at=embedding_data['saved_at'])
+        else:
+            print(f"Not adding {name} to the gallery: expected {store.dim} values")
         
-        return jsonify({'success': True, 'message': f'Embedding saved for {name}'}), 201
+        return jsonify({'success': True, 'message': f'Embedding saved for {name}',
+                        'version': store.version}), 201
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -210,15 +687,274 @@ def delete_embedding(name):
         if not name:
             return jsonify({'error': 'Name cannot be empty'}), 400
         
-        embedding_file = os.path.join(EMBEDDINGS_DIR, f'{name}_embedding.json')
+        embedding_file = os.path.join(get_embeddings_dir(), f'{name}_embedding.json')
         
-        if not os.path.exists(embedding_file):
+        store = get_embedding_store()
+        in_gallery = store.delete(name)
+        if os.path.exists(embedding_file):
+            os.remove(embedding_file)
+        elif not in_gallery:
             return jsonify({'error': 'Embedding not found'}), 404
         
-        os.remove(embedding_file)
+        return jsonify({'success': True, 'message': f'Embedding deleted for {name}',
+                        'version': store.version}), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def multipart_files(stream, boundary):
+    """Yield (filename, bytes) for each file in a multipart body as soon as it has arrived.
+
+    The body is decoded incrementally from the request stream, so images are
+    handed on while later ones are still uploading and nothing is spooled to
+    temporary files. Form fields without a filename are ignored.
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    filename, parts, size = None, [], 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, File):
+                filename, parts, size = event.filename or 'upload', [], 0
+            elif isinstance(event, Field):
+                filename = None
+            elif isinstance(event, Data) and filename is not None:
+                size += len(event.data)
+                if size > MAX_ENROLL_IMAGE_BYTES:
+                    raise ValueError(f'{filename} is larger than {MAX_ENROLL_IMAGE_BYTES} bytes')
+                parts.append(event.data)
+                if not event.more_data:
+                    yield filename, b''.join(parts)
+                    filename = None
+            event = decoder.next_event()
+        if not chunk:
+            raise ValueError('Upload ended before the closing multipart boundary')
+
+def person_embedding(rows, templates):
+    """Unit-length mean of a person's embeddings, or up to ``templates`` clustered templates"""
+    rows = np.stack(rows)
+    if templates > 1:
+        return cluster_templates(rows, templates)
+    mean = rows.mean(axis=0)
+    return (mean / np.linalg.norm(mean)).astype(np.float32)
+
+def enroll_progress(name, images, templates):
+    """NDJSON lines: one per image as its extraction finishes, then the outcome.
+
+    Images are extracted on the enrollment pool while the upload continues;
+    the gallery is only written, in one update, once every image is done.
+    """
+    store = get_embedding_store()
+    pool = get_enroll_pool()
+    inflight = {}
+    rows = []
+    counts = {'images': 0, 'faces': 0}
+    
+    def line(event):
+        return json.dumps(event, separators=(',', ':')) + '\n'
+    
+    def finished(block):
+        done, _ = wait(inflight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in sorted(done, key=lambda f: inflight[f][0]):
+            index, filename = inflight.pop(future)
+            event = {'event': 'image', 'index': index, 'filename': filename}
+            try:
+                embedding = future.result()
+            except FaceRejected as e:
+                event.update(status='rejected', reason=e.reason)
+            except Exception as e:
+                event.update(status='error', error=str(e))
+            else:
+                if embedding is None:
+                    event['status'] = 'no_face'
+                elif embedding.shape != (store.dim,):
+                    event.update(status='error', error=f'expected {store.dim} values')
+                else:
+                    event['status'] = 'ok'
+                    rows.append((index, embedding))
+                    counts['faces'] += 1
+            yield line(event)
+    
+    try:
+        for index, (filename, data) in enumerate(images):
+            if index >= MAX_ENROLL_IMAGES:
+                raise ValueError(f'At most {MAX_ENROLL_IMAGES} images per request')
+            while len(inflight) >= ENROLL_WORKERS * ENROLL_INFLIGHT_PER_WORKER:
+                yield from finished(block=True)
+            inflight[pool.submit(extract_upload, data)] = (index, filename)
+            counts['images'] += 1
+            yield from finished(block=False)
+        while inflight:
+            yield from finished(block=True)
+        
+        if not counts['images']:
+            raise ValueError('No images in upload')
+        if not rows:
+            raise ValueError(f'No faces found in {counts["images"]} images')
+        
+        # Image order, not completion order, so the same upload gives the same result
+        embedding = person_embedding([row for _, row in sorted(rows, key=lambda r: r[0])], templates)
+        embedding_data = {'name': name, 'saved_at': datetime.utcnow().isoformat()}
+        if embedding.ndim == 2:
+            mean = embedding.mean(axis=0)
+            embedding_data.update(embedding=(mean / np.linalg.norm(mean)).tolist(),
+                                  templates=embedding.tolist(), max_templates=templates)
+        else:
+            embedding_data['embedding'] = embedding.tolist()
+        write_embedding_file(name, embedding_data)
+        store.put(name, embedding, saved_at=embedding_data['saved_at'])
+        
+        yield line({'event': 'done', 'name': name, 'images': counts['images'], 'faces': counts['faces'],
+                    'templates': len(embedding) if embedding.ndim == 2 else 1,
+                    'version': store.version})
+    except Exception as e:
+        yield line({'event': 'error', 'error': str(e), 'images': counts['images'], 'faces': counts['faces']})
+    finally:
+        # Client gone or upload rejected: drop work that has not started
+        for future in inflight:
+            future.cancel()
+
+@app.route('/api/enroll/<name>', methods=['POST'])
+def enroll_person(name):
+    """Enroll a person from uploaded photos, streaming per-image progress as NDJSON"""
+    try:
+        name = name.strip()
+        if not name:
+            return jsonify({'error': 'Name cannot be empty'}), 400
+        
+        mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+        if mimetype != 'multipart/form-data' or not options.get('boundary'):
+            return jsonify({'error': 'Upload images as multipart/form-data'}), 400
+        
+        templates = int(request.args.get('templates', 1))
+        if not (1 <= templates <= MAX_ENROLL_TEMPLATES):
+            return jsonify({'error': f'templates must be between 1 and {MAX_ENROLL_TEMPLATES}'}), 400
+        
+        images = multipart_files(request.stream, options['boundary'])
+        body = stream_with_context(enroll_progress(name, images, templates))
+        return Response(body, mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'}), 200
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid data format: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def match_result(matches, threshold):
+    """Shape a list of (name, score) matches as an identify response"""
+    best_name, best_score = matches[0] if matches else ('Unknown', -1.0)
+    return {
+        'name': best_name if best_score >= threshold else 'Unknown',
+        'confidence': best_score,
+        'matches': [{'name': n, 'score': score} for n, score in matches]
+    }
+
+@app.route('/api/identify', methods=['POST'])
+def identify():
+    """Match an embedding against the enrolled gallery"""
+    try:
+        data = request.get_json()
+        
+        if not data or 'embedding' not in data:
+            return jsonify({'error': 'Missing embedding data'}), 400
+        
+        k = int(data.get('k', 1))
+        threshold = float(data.get('threshold', SIMILARITY_THRESHOLD))
+        if not (1 <= k <= MAX_TOP_K):
+            return jsonify({'error': f'k must be between 1 and {MAX_TOP_K}'}), 400
+        
+        matches = get_gallery().identify(data['embedding'], k=k)
         
-        return jsonify({'success': True, 'message': f'Embedding deleted for {name}'}), 200
+        return jsonify(match_result(matches, threshold)), 200
     
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid data format: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/identify/batch', methods=['POST'])
+def identify_batch():
+    """Match many embeddings against the gallery with one matrix product"""
+    try:
+        gallery = get_gallery()
+        
+        # Raw little-endian float32 rows skip JSON parsing entirely
+        if request.mimetype == 'application/octet-stream':
+            options = request.args
+            body = request.get_data()
+            if len(body) % (4 * gallery.dim):
+                return jsonify({'error': f'Body must hold float32 rows of {gallery.dim} values'}), 400
+            embeddings = np.frombuffer(body, dtype='<f4').reshape(-1, gallery.dim)
+        else:
+            options = request.get_json()
+            if not options or 'embeddings' not in options:
+                return jsonify({'error': 'Missing embeddings data'}), 400
+            embeddings = options['embeddings']
+        
+        k = int(options.get('k', 1))
+        threshold = float(options.get('threshold', SIMILARITY_THRESHOLD))
+        if not (1 <= k <= MAX_TOP_K):
+            return jsonify({'error': f'k must be between 1 and {MAX_TOP_K}'}), 400
+        if not (1 <= len(embeddings) <= MAX_IDENTIFY_BATCH):
+            return jsonify({'error': f'Batch must hold between 1 and {MAX_IDENTIFY_BATCH} embeddings'}), 400
+        
+        results = gallery.identify_batch(embeddings, k=k)
+        
+        return jsonify({'results': [match_result(m, threshold) for m in results]}), 200
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid data format: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Stage latencies, request counts and store sizes in the Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/profiler', methods=['GET'])
+def get_profiler():
+    """Sampling profiler status, or its stacks with ?format=collapsed"""
+    profiler = metrics.profiler
+    try:
+        limit = request.args.get('limit', type=int)
+        if request.args.get('format') == 'collapsed':
+            return Response(profiler.collapsed(limit), mimetype='text/plain')
+        return jsonify({'running': profiler.running, 'interval': profiler.interval,
+                        'samples': profiler.samples, 'started_at': profiler.started_at,
+                        'stacks': profiler.collapsed(limit or 20).splitlines()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/profiler', methods=['POST'])
+def toggle_profiler():
+    """Start or stop the sampling profiler: {"enabled": bool, "interval": s, "reset": bool}"""
+    profiler = metrics.profiler
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data.get('enabled'), bool):
+            return jsonify({'error': 'Missing boolean "enabled"'}), 400
+        interval = float(data.get('interval', PROFILER_INTERVAL))
+        if not (PROFILER_MIN_INTERVAL <= interval <= PROFILER_MAX_INTERVAL):
+            return jsonify({'error': f'Interval must be between {PROFILER_MIN_INTERVAL} '
+                                     f'and {PROFILER_MAX_INTERVAL} seconds'}), 400
+        
+        if data.get('reset'):
+            profiler.reset()
+        if data['enabled']:
+            profiler.start(interval)
+        else:
+            profiler.stop()
+        
+        return jsonify({'running': profiler.running, 'interval': profiler.interval,
+                        'samples': profiler.samples}), 200
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid data format: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,514 @@
+"""
+Benchmarks for extraction, matching, attendance storage and the API.
+
+Every benchmark runs on synthetic data generated from fixed seeds, so runs
+on the same machine are comparable:
+
+    python benchmark.py                                   # default sizes
+    python benchmark.py --sizes 100,1000,10000,100000 --records 10000000
+    python benchmark.py --suites matching,api             # only some suites
+    python benchmark.py --suites startup                  # cold-start budgets only
+    python benchmark.py --save-baseline                   # keep this run as the baseline
+
+Results go to a JSON report. When a baseline report exists, every p50/p99
+latency and throughput figure is compared with it, and the run exits with
+status 1 if any of them is worse by more than ``--tolerance``. Baselines
+are only meaningful on the machine that produced them. Cold starts of the
+API and the register CLI are also held to the fixed COLD_START_BUDGET, and
+the run fails as well when an API call returns or streams an error or a
+route has no benchmark.
+
+Ten million attendance records need several GB of memory.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+
+REPORT_FILE = "benchmark_report.json"
+BASELINE_FILE = "benchmarks/baseline.json"
+SUITES = ("startup", "extraction", "matching", "store", "api")
+
+SEED = 0
+QUERY_BATCH = 256
+ENROLL_IMAGES = 8
+HISTORY_PEOPLE = 500
+HISTORY_START = datetime(2024, 1, 1, 8, 0)
+
+# Relative change tolerated before a figure counts as a regression
+DEFAULT_TOLERANCE = 0.3
+
+# Per-benchmark time budget in seconds
+BUDGET = 1.0
+
+# Median wall time allowed for a fresh interpreter to import the API app and
+# for a register run with nothing to extract, in milliseconds. Neither may
+# load cv2 or mediapipe, which alone take longer than these budgets.
+COLD_START_BUDGET = {"startup.import_app": 1500, "startup.register_noop": 1500}
+
+
+def measure(fn, items=1, budget=BUDGET, min_runs=3, max_runs=10000, setup=None):
+    """Call fn repeatedly for about ``budget`` seconds; latency percentiles and items/second.
+
+    ``setup``, if given, runs untimed before each call and its result is passed to fn.
+    """
+    prepare = setup or (lambda: None)
+    call = fn if setup else (lambda _: fn())
+    call(prepare())  # warm up caches and lazy initialization
+    timings = []
+    deadline = time.perf_counter() + budget
+    while len(timings) < min_runs or (len(timings) < max_runs and time.perf_counter() < deadline):
+        state = prepare()
+        start = time.perf_counter()
+        call(state)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings)
+    return {
+        "runs": len(timings),
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p99_ms": float(np.percentile(timings, 99) * 1000),
+        "throughput": float(items * len(timings) / timings.sum()),
+    }
+
+
+def synthetic_history(count, people=HISTORY_PEOPLE, seed=SEED, chunk_size=100000):
+    """Yield lists of attendance records, about ``people`` check-ins per day over consecutive days"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, chunk_size):
+        n = min(chunk_size, count - start)
+        index = np.arange(start, start + n)
+        persons = rng.integers(people, size=n)
+        minutes = rng.integers(0, 10 * 60, size=n)
+        confidences = np.round(rng.uniform(0.5, 1.0, size=n), 4)
+        yield [
+            {
+                "name": f"Person{p}",
+                "timestamp": (HISTORY_START + timedelta(days=int(i // people), minutes=int(m))).isoformat(),
+                "confidence": float(c),
+            }
+            for i, p, m, c in zip(index, persons, minutes, confidences)
+        ]
+
+
+def synthetic_landmarks(seed=SEED):
+    """FaceMesh-like landmark objects for the embedding layout benchmark"""
+    from utils.embedding_layout import NUM_LANDMARKS
+
+    points = np.random.default_rng(seed).random((NUM_LANDMARKS, 3)).astype(np.float32)
+    return [SimpleNamespace(x=float(x), y=float(y), z=float(z)) for x, y, z in points]
+
+
+def find_images(directory):
+    """Image paths under directory, sorted"""
+    return sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(directory)
+        for name in files if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+
+
+def enroll_upload(image_dir):
+    """(content type, multipart body) with up to ENROLL_IMAGES photos, or seeded noise if none"""
+    files = []
+    for path in find_images(image_dir)[:ENROLL_IMAGES]:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+    if not files:
+        import cv2
+
+        noise = np.random.default_rng(SEED).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        files.append(("noise.png", cv2.imencode(".png", noise)[1].tobytes()))
+
+    boundary = "benchmark-boundary"
+    body = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="images"; filename="{name}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n"
+        for name, data in files
+    ) + f"--{boundary}--\r\n".encode()
+    return f"multipart/form-data; boundary={boundary}", body
+
+
+def missing_extractor():
+    """Why images cannot be extracted here, or None"""
+    # mediapipe is only imported on the first extraction, so probe for it up front
+    if importlib.util.find_spec("mediapipe") is None:
+        return "extractor unavailable: mediapipe is not installed"
+    return None
+
+
+def stream_errors(body):
+    """Failures reported inside a streamed NDJSON enroll response.
+
+    Images that could not be processed and a final error count; a final
+    error only because no image held a usable face does not, since the
+    seeded noise upload never does.
+    """
+    errors = []
+    for line in body.splitlines():
+        event = json.loads(line)
+        if event.get("status") == "error":
+            errors.append(f"{event.get('filename')}: {event.get('error')}")
+        elif event["event"] == "error" and not (event.get("images") and not event.get("faces")):
+            errors.append(event.get("error"))
+    return errors
+
+
+# Suites
+
+def bench_startup(results, args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(directory, "data"))
+        commands = {
+            "startup.import_app": [sys.executable, "-c", "import app"],
+            "startup.register_noop": [sys.executable, "register.py", "--workers", "1",
+                                      "--data-dir", os.path.join(directory, "data"),
+                                      "--output-dir", os.path.join(directory, "output"),
+                                      "--cache-dir", os.path.join(directory, "cache")],
+        }
+        for name, command in commands.items():
+            run = lambda: subprocess.run(command, cwd=here, check=True, stdout=subprocess.DEVNULL)
+            results[name] = dict(measure(run, min_runs=3, max_runs=10),
+                                 budget_ms=COLD_START_BUDGET[name])
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_extraction(results, args):
+    from utils.embedding_layout import landmarks_to_embedding
+
+    landmarks = synthetic_landmarks()
+    results["extraction.landmarks_to_embedding"] = measure(lambda: landmarks_to_embedding(landmarks))
+
+    images = find_images(args.image_dir)
+    if not images:
+        results["extraction.get_embedding"] = {"skipped": f"no images in {args.image_dir}"}
+        return
+    if missing_extractor():
+        results["extraction.get_embedding"] = {"skipped": missing_extractor()}
+        return
+    from utils.extract_embedding import get_embedding
+
+    cycle = iter(images * 1000)
+    results["extraction.get_embedding"] = measure(lambda: get_embedding(next(cycle)),
+                                                  max_runs=len(images) * 1000)
+
+
+def bench_matching(results, args):
+    from utils.ann_index import synthetic_gallery, synthetic_queries
+    from utils.cosine_similarity import cosine_similarity
+    from utils.embedding_layout import EMBEDDING_DIM
+    from utils.gallery import Gallery
+
+    for size in args.sizes:
+        rows = synthetic_gallery(size, EMBEDDING_DIM, seed=SEED)
+        names = [f"Person{i}" for i in range(size)]
+        gallery = Gallery(names, rows, normalized=True)
+        queries = synthetic_queries(rows, QUERY_BATCH, seed=SEED + 1)
+        query = queries[0]
+
+        def cosine_loop():
+            best = max(range(size), key=lambda i: cosine_similarity(query, rows[i]))
+            return names[best]
+
+        results[f"matching.cosine_loop.{size}"] = measure(cosine_loop, min_runs=1)
+        results[f"matching.identify.{size}"] = measure(lambda: gallery.identify(query))
+        results[f"matching.identify_batch.{size}"] = measure(
+            lambda: gallery.identify_batch(queries), items=len(queries), min_runs=1)
+
+
+def bench_store(results, args):
+    from utils.attendance_store import AttendanceStore
+
+    directory = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(directory, "attendance.jsonl")
+        store = AttendanceStore(log_path)
+        start = time.perf_counter()
+        for chunk in synthetic_history(args.records):
+            store.add_many(chunk)
+        elapsed = time.perf_counter() - start
+        results["store.add_many"] = {"runs": 1, "throughput": args.records / elapsed}
+        store.close()
+
+        start = time.perf_counter()
+        store = AttendanceStore(log_path)
+        results["store.open"] = {"runs": 1, "p50_ms": (time.perf_counter() - start) * 1000}
+
+        results["store.query_page"] = measure(lambda: store.query(limit=100))
+        results["store.query_name"] = measure(lambda: store.query(name="Person7", limit=100))
+        results["store.stats_month"] = measure(lambda: store.stats(bucket="month"), min_runs=1)
+        results["store.scan"] = measure(lambda: sum(len(c) for c in store.scan()),
+                                        items=len(store), min_runs=1, max_runs=3)
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def route_requests(app_module, records, people, upload):
+    """{route rule: [(method, url, request kwargs, setup or None)]} for every benchmarked route.
+
+    A setup runs untimed before each request and returns values formatted into the url.
+    """
+    from utils.embedding_layout import EMBEDDING_DIM
+
+    embedding = np.random.default_rng(SEED).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    batch = [{"name": f"Person{i % people}", "confidence": 0.9} for i in range(100)]
+    middle = (HISTORY_START + timedelta(days=records // HISTORY_PEOPLE // 2)).date().isoformat()
+
+    def new_record():
+        record = app_module.get_attendance_store().add({"name": "Bench", "confidence": 0.5,
+                                                        "timestamp": datetime.utcnow().isoformat()})
+        return {"id": record["id"]}
+
+    def new_person():
+        app_module.get_embedding_store().put("Bench", embedding)
+        return {}
+
+    return {
+        "/health": [("GET", "/health", {}, None)],
+        "/metrics": [("GET", "/metrics", {}, None)],
+        "/api/profiler": [
+            ("GET", "/api/profiler", {}, None),
+            ("POST", "/api/profiler", {"json": {"enabled": False}}, None),
+        ],
+        "/api/attendance": [
+            ("POST", "/api/attendance", {"json": {"name": "Person1", "confidence": 0.9}}, None),
+            ("GET", "/api/attendance?limit=100", {}, None),
+            ("GET", f"/api/attendance?name=Person7&date={middle}", {}, None),
+        ],
+        "/api/attendance/batch": [("POST", "/api/attendance/batch", {"json": batch}, None)],
+        "/api/attendance/export": [("GET", f"/api/attendance/export?date={middle}", {}, None)],
+        "/api/attendance/stats": [("GET", "/api/attendance/stats?bucket=week", {}, None)],
+        "/api/attendance/<int:record_id>": [("DELETE", "/api/attendance/{id}", {}, new_record)],
+        "/api/embeddings": [("GET", "/api/embeddings", {}, None)],
+        "/api/embeddings/<name>": [
+            ("POST", "/api/embeddings/Bench", {"json": {"embedding": embedding.tolist()}}, None),
+            ("DELETE", "/api/embeddings/Bench", {}, new_person),
+        ],
+        "/api/gallery": [("GET", "/api/gallery?format=f32", {}, None)],
+        "/api/gallery/changes": [("GET", "/api/gallery/changes?since=0&format=f32", {}, None)],
+        "/api/enroll/<name>": [("POST", "/api/enroll/Bench", {
+            "data": upload[1], "content_type": upload[0],
+        }, None)],
+        "/api/identify": [("POST", "/api/identify", {"json": {"embedding": embedding.tolist(), "k": 5}}, None)],
+        "/api/identify/batch": [("POST", "/api/identify/batch", {
+            "data": np.tile(embedding, (QUERY_BATCH, 1)).astype("<f4").tobytes(),
+            "content_type": "application/octet-stream",
+        }, None)],
+    }
+
+
+def bench_api(results, args):
+    import app as app_module
+    from utils.ann_index import synthetic_gallery
+    from utils.embedding_layout import EMBEDDING_DIM
+
+    app = app_module.app
+    directory = tempfile.mkdtemp()
+    saved_config = dict(app.config)
+    try:
+        app.config.update(
+            TESTING=True,
+            ATTENDANCE_FILE=os.path.join(directory, "attendance.json"),
+            EMBEDDINGS_DIR=os.path.join(directory, "embeddings"),
+            GALLERY_DIR=os.path.join(directory, "gallery"),
+            GALLERY_INDEX_FILE=os.path.join(directory, "gallery_ivf.npz"),
+        )
+        os.makedirs(app.config["EMBEDDINGS_DIR"])
+        gallery_size = min(args.sizes)
+        store = app_module.get_embedding_store()
+        for i, row in enumerate(synthetic_gallery(gallery_size, EMBEDDING_DIM, seed=SEED)):
+            store.put(f"Person{i}", row)
+        attendance = app_module.get_attendance_store()
+        for chunk in synthetic_history(args.api_records):
+            attendance.add_many(chunk)
+
+        client = app.test_client()
+        requests = route_requests(app_module, args.api_records, gallery_size, enroll_upload(args.image_dir))
+        for rule, calls in requests.items():
+            for method, url, kwargs, setup in calls:
+                if rule == "/api/enroll/<name>" and missing_extractor():
+                    results[f"api.{method} {url}"] = {"skipped": missing_extractor()}
+                    continue
+
+                def call(values, method=method, url=url, kwargs=kwargs):
+                    target = url.format(**(values or {}))
+                    response = client.open(target, method=method, **kwargs)
+                    body = response.get_data()
+                    if response.status_code >= 400:
+                        raise RuntimeError(f"{method} {target} returned {response.status_code}")
+                    errors = stream_errors(body.decode()) if response.mimetype == "application/x-ndjson" else []
+                    if errors:
+                        raise RuntimeError(f"{method} {target} streamed {'; '.join(errors)}")
+                try:
+                    results[f"api.{method} {url}"] = measure(call, setup=setup or dict)
+                except RuntimeError as e:
+                    results[f"api.{method} {url}"] = {"failed": str(e)}
+
+        # Fail loudly when a route is added without a benchmark
+        covered = set(requests)
+        missing = sorted(r.rule for r in app.url_map.iter_rules()
+                         if r.endpoint != "static" and r.rule not in covered)
+        if missing:
+            results["api.uncovered_routes"] = {"failed": "no benchmark for " + ", ".join(missing)}
+    finally:
+        app_module.close_attendance_store()
+        app.config.clear()
+        app.config.update(saved_config)
+        shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "extraction": bench_extraction,
+    "matching": bench_matching,
+    "store": bench_store,
+    "api": bench_api,
+}
+
+
+# Reports
+
+def run(args):
+    """Run the selected suites and return the report"""
+    results = {}
+    for suite in args.suites:
+        print(f"Running {suite} benchmarks...")
+        BENCHMARKS[suite](results, args)
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "sizes": args.sizes,
+            "records": args.records,
+            "api_records": args.api_records,
+            "seed": SEED,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a message per figure that is worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, old in baseline["results"].items():
+        new = report["results"].get(name)
+        if not new or any(key in result for result in (new, old) for key in ("skipped", "failed")):
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if metric in old and metric in new and new[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {old[metric]:.3f} -> {new[metric]:.3f}")
+        if "throughput" in old and "throughput" in new and new["throughput"] < old["throughput"] / (1 + tolerance):
+            regressions.append(f"{name}: throughput {old['throughput']:.1f} -> {new['throughput']:.1f}/s")
+    return regressions
+
+
+def failures(report):
+    """Return a message per benchmark that failed or route that has none"""
+    return [f"{name}: {result['failed']}" for name, result in sorted(report["results"].items())
+            if "failed" in result]
+
+
+def over_budget(report):
+    """Return a message per cold start slower than its budget"""
+    return [
+        f"{name}: p50 {result['p50_ms']:.0f} ms > budget {result['budget_ms']} ms"
+        for name, result in sorted(report["results"].items())
+        if "budget_ms" in result and result["p50_ms"] > result["budget_ms"]
+    ]
+
+
+def print_report(report):
+    for name, result in sorted(report["results"].items()):
+        if "skipped" in result or "failed" in result:
+            outcome = "skipped" if "skipped" in result else "failed"
+            print(f"  {name:<60} {outcome}: {result[outcome]}")
+            continue
+        figures = [f"p50 {result['p50_ms']:.3f} ms" if "p50_ms" in result else "",
+                   f"p99 {result['p99_ms']:.3f} ms" if "p99_ms" in result else "",
+                   f"{result['throughput']:.1f}/s" if "throughput" in result else ""]
+        print(f"  {name:<60} " + "  ".join(f for f in figures if f))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction, matching, storage and the API")
+    parser.add_argument("--suites", default=",".join(SUITES),
+                        help=f"comma-separated subset of {', '.join(SUITES)}")
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="gallery sizes for the matching suite, e.g. 100,1000,10000,100000")
+    parser.add_argument("--records", type=int, default=100000,
+                        help="attendance history size for the store suite (up to 10000000)")
+    parser.add_argument("--api-records", type=int, default=10000,
+                        help="attendance history size behind the API suite")
+    parser.add_argument("--image-dir", default="data/", help="images for the extraction suite")
+    parser.add_argument("--output", default=REPORT_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="also write this report as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative slowdown allowed before failing (default: 0.3)")
+    args = parser.parse_args(argv)
+    args.suites = [s for s in args.suites.split(",") if s]
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    report = run(args)
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✔ Report written to {args.output}")
+
+    over = over_budget(report)
+    if over:
+        print(f"❌ {len(over)} cold start(s) over budget:")
+        for line in over:
+            print(f"  {line}")
+    failed = failures(report)
+    if failed:
+        print(f"❌ {len(failed)} benchmark(s) failed:")
+        for line in failed:
+            print(f"  {line}")
+    status = 1 if over or failed else 0
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        shutil.copyfile(args.output, args.baseline)
+        print(f"✔ Baseline saved to {args.baseline}")
+        return status
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return status
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("machine") != report["meta"]["machine"]:
+        print("⚠ Baseline was recorded on a different machine type")
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"✔ No regressions against {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,14 +26,44 @@ MAX_NUM_FACES = 4
 
 # Attendance Configuration
 ATTENDANCE_LOG_INTERVAL = 30  # seconds
+ATTENDANCE_MERGE_WINDOW = 120  # seconds without a sighting that end a visit (one record per visit)
+ATTENDANCE_FLUSH_INTERVAL = 5  # seconds between writes of merged sightings
 SIMILARITY_THRESHOLD = 0.1
 
+# Approximate matching (IVF index) for large galleries
+ANN_MIN_GALLERY_SIZE = 20000  # smaller galleries use exact brute force
+ANN_NPROBE = 8  # clusters searched per query; higher = better recall, slower
+ANN_RECLUSTER_GROWTH = 0.5  # retrain clusters in the background once the gallery grew by this share
+
+# People enrolled with several templates (register.py --templates)
+TEMPLATE_SCORE_TOP = 1  # score = mean of a person's best N template scores; 1 = best template
+
+# Face quality gate (utils/face_quality.py): faces failing a check are not embedded or matched
+QUALITY_GATE_ENABLED = True
+QUALITY_MIN_FACE_SIZE = 64  # pixels, shorter side of the face's landmark box
+QUALITY_MAX_YAW = 35  # degrees of head turn left/right
+QUALITY_MAX_PITCH = 30  # degrees of head tilt up/down
+QUALITY_MAX_ROLL = 30  # degrees of head tilt sideways
+QUALITY_MIN_BRIGHTNESS = 40  # mean gray level of the face, 0-255
+QUALITY_MAX_BRIGHTNESS = 220
+QUALITY_MIN_SHARPNESS = 20  # variance of the Laplacian of the face scaled to 128 px wide
+
+# Server-side video pipeline (utils/stream_pipeline.py)
+STREAM_QUEUE_SIZE = 8  # frames buffered between pipeline stages
+STREAM_IOU_THRESHOLD = 0.3  # box overlap needed to continue a face track
+STREAM_MAX_MISSED = 15  # frames a track survives without a matching face
+STREAM_DRIFT_SIMILARITY = 0.98  # re-identify a track when its embedding drifts below this
+STREAM_UNKNOWN_RETRY = 0.5  # seconds between attempts to identify an unknown face
+
+# Server-side enrollment (POST /api/enroll/<name>)
+ENROLL_WORKERS = min(8, os.cpu_count() or 1)  # threads extracting uploaded images, one FaceMesh each
+
+# Instrumentation (GET /metrics, /api/profiler)
+PROFILER_INTERVAL = 0.01  # seconds between stack samples while the profiler runs
+PROFILER_MAX_INTERVAL = 1.0
+PROFILER_MIN_INTERVAL = 0.001
+
 # API Configuration
 API_HOST = '127.0.0.1'
 API_PORT = 5000
 API_DEBUG = True
-
-# Ensure directories exist
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
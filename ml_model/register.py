@@ -1,49 +1,297 @@
 import os
 import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
-from utils.extract_embedding import get_embedding
 
 DATA_DIR = "data/"
 OUTPUT_DIR = "output/"
+CACHE_DIR = "cache/"
+
+# Images queued per worker; bounds memory while keeping every core busy
+INFLIGHT_PER_WORKER = 4
+
+
+def _init_worker():
+    """Build this worker's long-lived FaceMesh"""
+    import cv2
+    from utils.extract_embedding import get_face_mesh
+
+    # One process per core already; stop OpenCV spawning its own threads
+    cv2.setNumThreads(1)
+    get_face_mesh()
+
+
+def _embed_image(path):
+    """Embedding for one image using this worker's pooled FaceMesh, or None"""
+    from utils.extract_embedding import get_embedding
+
+    emb = get_embedding(path)
+    return None if emb is None else np.asarray(emb, dtype=np.float32)
+
+
+def list_persons(data_dir=DATA_DIR):
+    """Person folders in the data directory, sorted"""
+    return sorted(
+        d for d in os.listdir(data_dir)
+        if not d.startswith(".") and os.path.isdir(os.path.join(data_dir, d))
+    )
+
+
+def list_images(folder):
+    """Image paths in a person's folder, sorted"""
+    return sorted(
+        entry.path for entry in os.scandir(folder)
+        if entry.is_file() and not entry.name.startswith(".")
+    )
+
+
+class _PersonEmbeddings:
+    """Running sum of one person's embeddings, plus the rows themselves when clustering"""
+
+    def __init__(self, templates=1, keys=None):
+        self.templates = templates
+        self.rows = [] if templates > 1 else None
+        self.keys = keys
+        self.total = None
+        self.count = 0
+        self.pending = 0
+        self.listed = False
+
+    def add(self, emb):
+        if emb is None or not len(emb):
+            return
+        if self.total is None:
+            self.total = np.zeros(len(emb), dtype=np.float64)
+        self.total += emb
+        self.count += 1
+        if self.rows is not None:
+            self.rows.append(emb)
+
+    def done(self):
+        return self.listed and self.pending == 0
+
+    def mean(self):
+        if not self.count:
+            return None
+        avg = self.total / self.count
+        return (avg / np.linalg.norm(avg)).astype(np.float32)
+
+    def result(self):
+        """The mean embedding, or a (templates, dim) matrix when clustering"""
+        from utils.gallery import cluster_templates
+
+        if self.rows is None or not self.count:
+            return self.mean()
+        return cluster_templates(np.stack(self.rows), self.templates)
+
+
+def enroll(data_dir=DATA_DIR, workers=None, initializer=_init_worker, embed=_embed_image, cache=None,
+           templates=1):
+    """Yield (person, mean embedding or None, faces used) as each person finishes.
+
+    Images from ``data_dir/<person>/`` are streamed to a pool of ``workers``
+    processes, each keeping one FaceMesh for its lifetime, and per-person
+    means are accumulated as results arrive.
+
+    With ``templates`` > 1 each person instead gets a (k, dim) matrix of up
+    to that many templates, clustered from their per-image embeddings.
+
+    With an EmbeddingCache only images not seen before are extracted, and
+    people whose images are all unchanged since the last run are skipped.
+    """
+    workers = workers or os.cpu_count() or 1
+    means = {}
+
+    def images(person):
+        """(path, cache key) pairs, or None if the person is unchanged"""
+        paths = list_images(os.path.join(data_dir, person))
+        if cache is None:
+            return [(path, None) for path in paths]
+        keys = [cache.key_for(path) for path in paths]
+        if not cache.person_changed(person, keys):
+            return None
+        means[person].keys = keys
+        return list(zip(paths, keys))
+
+    def cached(key):
+        return None if cache is None else cache.get(key)
+
+    def extracted(path, key, result):
+        try:
+            emb = result()
+        except Exception as e:
+            # Not cached, so the image is retried on the next run
+            print(f"❌ Failed on {path}: {e}")
+            return None
+        if cache is not None:
+            cache.put(key, emb)
+        return emb
+
+    def finished(person):
+        acc = means.pop(person)
+        if cache is not None:
+            cache.set_person(person, acc.keys)
+        if acc.count == 0:
+            print(f"❌ No valid faces found for {person}")
+        return person, acc.result(), acc.count
+
+    if workers == 1:
+        ready = []
+
+        def embed_here(path):
+            # Build the FaceMesh only once an image actually needs extracting
+            if not ready:
+                initializer()
+                ready.append(True)
+            return embed(path)
+
+        for person in list_persons(data_dir):
+            means[person] = acc = _PersonEmbeddings(templates)
+            todo = images(person)
+            if todo is None:
+                means.pop(person)
+                continue
+            for path, key in todo:
+                emb = cached(key)
+                acc.add(emb if emb is not None else extracted(path, key, lambda: embed_here(path)))
+            yield finished(person)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as pool:
+        inflight = {}
+
+        def drain(block):
+            if not inflight:
+                return
+            done, _ = wait(inflight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                person, path, key = inflight.pop(future)
+                acc = means[person]
+                acc.pending -= 1
+                acc.add(extracted(path, key, future.result))
+                if acc.done():
+                    yield finished(person)
+
+        for person in list_persons(data_dir):
+            means[person] = acc = _PersonEmbeddings(templates)
+            todo = images(person)
+            if todo is None:
+                means.pop(person)
+                continue
+            for path, key in todo:
+                emb = cached(key)
+                if emb is not None:
+                    acc.add(emb)
+                    continue
+                while len(inflight) >= workers * INFLIGHT_PER_WORKER:
+                    yield from drain(block=True)
+                inflight[pool.submit(embed, path)] = (person, path, key)
+                acc.pending += 1
+            acc.listed = True
+            if acc.done():
+                yield finished(person)
+            yield from drain(block=False)
+
+        while inflight:
+            yield from drain(block=True)
 
 
 def train_person(person_name):
     folder = os.path.join(DATA_DIR, person_name)
-    embeddings = []
+    acc = _PersonEmbeddings()
+    _init_worker()
 
-    for img in os.listdir(folder):
-        if img.startswith("."):
-            continue
-
-        path = os.path.join(folder, img)
-        print(f"Processing {person_name}: {img}")
-        emb = get_embedding(path)
+    for path in list_images(folder):
+        print(f"Processing {person_name}: {os.path.basename(path)}")
+        emb = _embed_image(path)
 
         if emb is not None:
-            embeddings.append(emb)
+            acc.add(emb)
 
-    if not embeddings:
+    if not acc.count:
         print(f"❌ No valid faces found for {person_name}")
         return None
 
-    avg = np.mean(np.array(embeddings), axis=0)
-    avg = avg / np.linalg.norm(avg)
+    return acc.mean().tolist()
+
+
+def _saved_templates(path):
+    """The --templates setting an output file was written with, or None if missing"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f).get("max_templates", 1)
+    except (OSError, ValueError):
+        return None
+
 
-    return avg.tolist()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute mean face embeddings for data/<person>/ folders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes, each with its own FaceMesh (default: CPU count)")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--gallery-dir", default=None,
+                        help="also write to this binary gallery (e.g. ../data/gallery)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="per-image embedding cache; only new or changed images are extracted")
+    parser.add_argument("--no-cache", action="store_true", help="extract every image again")
+    parser.add_argument("--templates", type=int, default=1,
+                        help="keep up to this many clustered templates per person instead of one mean")
+    args = parser.parse_args(argv)
 
+    os.makedirs(args.output_dir, exist_ok=True)
+    store = None
+    if args.gallery_dir:
+        from utils.embedding_store import EmbeddingStore, PUT_BATCH_SIZE
+        store = EmbeddingStore(args.gallery_dir)
+    # Gallery writes are batched: each one rewrites the gallery index
+    pending = []
 
-def main():
-    persons = [d for d in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, d))]
+    persons = list_persons(args.data_dir)
+    cache = None
+    if not args.no_cache:
+        from utils.embedding_cache import EmbeddingCache
+        from utils.extract_embedding import EXTRACTOR_CONFIG
+        cache = EmbeddingCache(args.cache_dir, EXTRACTOR_CONFIG)
+        # People whose output is missing, used another template count or is not
+        # in the gallery yet are recomputed (from cached embeddings where possible)
+        enrolled = set(store.names()) if store is not None else None
+        for person in persons:
+            saved_templates = _saved_templates(os.path.join(args.output_dir, f"{person}_embedding.json"))
+            if saved_templates != args.templates or (enrolled is not None and person not in enrolled):
+                cache.forget_person(person)
+
+    saved = 0
+    for person, emb, count in enroll(args.data_dir, workers=args.workers, cache=cache,
+                                     templates=args.templates):
+        if emb is None:
+            continue
+        out_file = os.path.join(args.output_dir, f"{person}_embedding.json")
+        data = {"name": person, "embedding": emb.tolist()}
+        if args.templates > 1:
+            # Single-vector clients (the browser) still read "embedding"
+            mean = emb.mean(axis=0)
+            data.update(embedding=(mean / np.linalg.norm(mean)).tolist(),
+                        templates=emb.tolist(), max_templates=args.templates)
+        with open(out_file, "w") as f:
+            json.dump(data, f)
+        if store is not None:
+            pending.append((person, emb, None))
+            if len(pending) >= PUT_BATCH_SIZE:
+                store.put_many(pending)
+                pending = []
+        saved += 1
+        detail = f"{count} faces" + (f", {len(emb)} templates" if args.templates > 1 else "")
+        print(f"✔ Saved: {out_file} ({detail})")
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if pending:
+        store.put_many(pending)
 
-    for person in persons:
-        emb = train_person(person)
-        if emb:
-            out_file = os.path.join(OUTPUT_DIR, f"{person}_embedding.json")
-            with open(out_file, "w") as f:
-                json.dump({"name": person, "embedding": emb}, f)
-            print(f"✔ Saved: {out_file}")
+    if cache is not None:
+        cache.save(persons)
+        print(f"✔ {saved} people updated, {len(persons) - saved} unchanged or without faces "
+              f"(cache: {cache.hits} hits, {cache.misses} misses)")
 
 
 if __name__ == "__main__":
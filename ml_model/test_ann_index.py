@@ -0,0 +1,173 @@
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+from utils.ann_index import (ExactIndex, IVFIndex, recall_at_k, recall_report,
+                             synthetic_gallery, synthetic_queries)
+from utils.embedding_store import EmbeddingStore
+from utils.gallery import Gallery, LiveGallery
+
+class ANNIndexTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Build one clustered gallery and index for all tests"""
+        cls.matrix = synthetic_gallery(2000, 64)
+        cls.queries = synthetic_queries(cls.matrix, 50)
+        cls.exact = ExactIndex(cls.matrix)
+        cls.index = IVFIndex.build(cls.matrix, nlist=40, nprobe=4)
+
+    def test_exact_index_matches_gallery(self):
+        """Test that the exact baseline agrees with the gallery matcher"""
+        gallery = Gallery([str(i) for i in range(len(self.matrix))], self.matrix, dim=64)
+        expected = gallery.identify_batch(self.queries, k=5)
+        for (ids, scores), matches in zip(self.exact.search(self.queries, 5), expected):
+            self.assertEqual([str(i) for i in ids], [m[0] for m in matches])
+
+    def test_full_probe_is_exact(self):
+        """Test that probing every list gives perfect recall"""
+        approx = self.index.search(self.queries, 10, nprobe=self.index.nlist)
+        exact = self.exact.search(self.queries, 10)
+        self.assertEqual(recall_at_k(exact, approx, 10), 1.0)
+
+    def test_partial_probe_recall(self):
+        """Test recall with a few probes on clustered data"""
+        approx = self.index.search(self.queries, 10)
+        exact = self.exact.search(self.queries, 10)
+        self.assertGreaterEqual(recall_at_k(exact, approx, 10), 0.9)
+        for ids, scores in approx:
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_recall_report(self):
+        """Test the recall/latency comparison against brute force"""
+        report = recall_report(self.index, self.exact, self.queries, k=5, nprobes=(1, 4, 64))
+        self.assertEqual([row['nprobe'] for row in report['ivf']], [1, 4])
+        self.assertGreaterEqual(report['ivf'][-1]['recall'], report['ivf'][0]['recall'])
+
+    def test_save_and_load(self):
+        """Test the persisted on-disk form and its metadata"""
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        path = os.path.join(test_dir, 'index.npz')
+
+        self.index.save(path, version=np.int64(7))
+        loaded, metadata = IVFIndex.load(path)
+
+        self.assertEqual(int(metadata['version']), 7)
+        self.assertEqual(loaded.nprobe, self.index.nprobe)
+        for (a, _), (b, _) in zip(self.index.search(self.queries, 5), loaded.search(self.queries, 5)):
+            np.testing.assert_array_equal(a, b)
+
+    def test_update(self):
+        """Test that updates drop removed ids, find added rows and leave the original alone"""
+        matrix = np.concatenate([self.matrix, synthetic_gallery(10, 64, seed=5)])
+        added = np.arange(len(self.matrix), len(matrix))
+        removed = np.arange(0, 20)
+        updated = self.index.update(matrix, remove=removed, add=added)
+
+        self.assertEqual(len(updated), len(self.matrix) - len(removed) + len(added))
+        self.assertEqual(len(self.index), len(self.matrix))
+        self.assertFalse(np.isin(removed, updated.ids).any())
+        for ids, _ in updated.search(matrix[added], 1, nprobe=updated.nlist):
+            self.assertIn(ids[0], added)
+        for ids, _ in updated.search(self.matrix[removed], 5, nprobe=updated.nlist):
+            self.assertFalse(np.isin(ids, removed).any())
+        # Re-adding an indexed id moves it instead of duplicating it
+        moved = updated.update(matrix, add=[100])
+        self.assertEqual(int(np.sum(moved.ids == 100)), 1)
+        self.assertEqual(len(moved), len(updated))
+
+    def test_gallery_uses_attached_index(self):
+        """Test identification through an attached approximate index"""
+        names = [str(i) for i in range(len(self.matrix))]
+        gallery = Gallery(names, self.matrix, dim=64)
+        gallery.index = self.index
+        matches = gallery.identify(self.matrix[123], k=3)
+        self.assertEqual(matches[0][0], '123')
+        self.assertAlmostEqual(matches[0][1], 1.0, places=5)
+
+
+class LiveGalleryIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a store holding a small clustered gallery"""
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.index_file = os.path.join(self.test_dir, 'index.npz')
+        self.matrix = synthetic_gallery(300, 32)
+        self.store = EmbeddingStore(os.path.join(self.test_dir, 'gallery'), dim=32)
+        self.store.put_many((str(i), row, None) for i, row in enumerate(self.matrix))
+
+    def live(self):
+        live = LiveGallery(self.store, index_file=self.index_file, ann_min_size=1, nprobe=4)
+        self.addCleanup(live.wait_for_index)
+        return live
+
+    def trained(self, live):
+        """Gallery served once background training has finished"""
+        live.current()
+        live.wait_for_index()
+        return live.current()
+
+    def test_exact_search_until_trained(self):
+        """Test that the first gallery searches exactly while the index trains"""
+        live = self.live()
+        self.assertIsNone(live.current().index)
+        gallery = self.trained(live)
+        self.assertIsNotNone(gallery.index)
+        self.assertEqual(gallery.identify(self.matrix[42])[0][0], '42')
+        self.assertTrue(os.path.exists(self.index_file))
+
+    def test_changes_update_index_without_training(self):
+        """Test that enrollments and deletions are applied to the trained index"""
+        live = self.live()
+        trained = self.trained(live).index
+        newcomer = synthetic_gallery(1, 32, seed=9)[0]
+
+        self.store.put('newcomer', newcomer)
+        self.store.delete('42')
+        self.store.put('7', self.matrix[8])
+        gallery = live.current()
+
+        self.assertIsNone(live._training)
+        self.assertIsNot(gallery.index, trained)
+        self.assertIs(gallery.index.centroids, trained.centroids)
+        self.assertEqual(len(gallery.index), len(self.matrix))
+        self.assertEqual(gallery.identify(newcomer)[0][0], 'newcomer')
+        self.assertNotIn('42', [name for name, _ in gallery.identify(self.matrix[42], k=5)])
+        self.assertEqual({name for name, _ in gallery.identify(self.matrix[8], k=2)}, {'7', '8'})
+
+    def test_growth_and_compaction_retrain(self):
+        """Test that compaction and enough growth train a new index in the background"""
+        live = LiveGallery(self.store, index_file=self.index_file, ann_min_size=1, nprobe=4,
+                           recluster_growth=0.1)
+        self.addCleanup(live.wait_for_index)
+        trained = self.trained(live).index
+
+        self.store.delete('0')
+        self.store.compact()
+        self.assertIsNone(live.current().index)
+        compacted = self.trained(live).index
+        self.assertIsNot(compacted, trained)
+        self.assertEqual(len(compacted), len(self.matrix) - 1)
+
+        extra = synthetic_gallery(40, 32, seed=3)
+        self.store.put_many((f'extra{i}', row, None) for i, row in enumerate(extra))
+        self.assertIs(live.current().index.centroids, compacted.centroids)
+        live.wait_for_index()
+        self.assertEqual(live._trained_size, len(self.matrix) - 1 + len(extra))
+
+    def test_restart_loads_saved_index(self):
+        """Test that a restarted gallery serves the saved index without training"""
+        self.trained(self.live())
+        self.store.put('newcomer', synthetic_gallery(1, 32, seed=9)[0])
+
+        live = self.live()
+        gallery = live.current()
+        self.assertIsNone(live._training)
+        self.assertIsNotNone(gallery.index)
+        self.assertEqual(len(gallery.index), len(self.matrix) + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
 import unittest
+import io
 import json
 import os
 import tempfile
 import shutil
+import numpy as np
 from datetime import datetime
+from unittest import mock
+import app as app_module
 from app import app, load_attendance_data, save_attendance_data, ATTENDANCE_FILE, EMBEDDINGS_DIR
+from utils.embedding_layout import EMBEDDING_DIM
 
 class AttendanceAPITestCase(unittest.TestCase):
     
@@ -27,9 +32,11 @@ class AttendanceAPITestCase(unittest.TestCase):
         # Patch the app's file paths
         app.config['ATTENDANCE_FILE'] = self.test_attendance_file
         app.config['EMBEDDINGS_DIR'] = self.test_embeddings_dir
+        app.config['GALLERY_DIR'] = os.path.join(self.test_dir, 'gallery')
     
     def tearDown(self):
         """Clean up temporary directories"""
+        app_module.close_attendance_store()
         if os.path.exists(self.test_dir):
             shutil.rmtree(self.test_dir)
     
@@ -52,6 +59,25 @@ class AttendanceAPITestCase(unittest.TestCase):
         self.assertIn('id', data)
         self.assertIn('timestamp', data)
     
+    def test_log_attendance_merges_repeated_sightings(self):
+        """Test that repeated sightings update one record instead of adding more"""
+        from app import get_attendance_aggregator
+        
+        first = self.client.post('/api/attendance', json={'name': 'Aditya', 'confidence': 0.9})
+        second = self.client.post('/api/attendance', json={'name': 'Aditya', 'confidence': 0.95})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        
+        data = json.loads(second.data)
+        self.assertEqual(data['id'], json.loads(first.data)['id'])
+        self.assertEqual(data['sightings'], 2)
+        self.assertEqual(data['confidence'], 0.95)
+        
+        get_attendance_aggregator().flush()
+        records = json.loads(self.client.get('/api/attendance').data)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['sightings'], 2)
+    
     def test_log_attendance_missing_fields(self):
         """Test logging attendance with missing fields"""
         response = self.client.post('/api/attendance', 
@@ -68,6 +94,111 @@ class AttendanceAPITestCase(unittest.TestCase):
         
         self.assertEqual(response.status_code, 400)
     
+    def test_log_attendance_batch(self):
+        """Test bulk ingest as a JSON array, NDJSON and gzip"""
+        import gzip
+        rows = [{'name': f'Person{i}', 'confidence': 0.9, 'timestamp': f'2024-01-01T10:00:{i:02d}'}
+                for i in range(3)]
+        
+        response = self.client.post('/api/attendance/batch', json=rows)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data), {'inserted': 3, 'first_id': 1, 'last_id': 3})
+        
+        ndjson = '\n'.join(json.dumps(r) for r in rows).encode()
+        response = self.client.post('/api/attendance/batch', data=gzip.compress(ndjson),
+            headers={'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data)['first_id'], 4)
+        
+        response = self.client.post('/api/attendance/batch', json={'records': [{'name': 'Jane', 'confidence': 0.5}]})
+        self.assertEqual(response.status_code, 201)
+        
+        records = json.loads(self.client.get('/api/attendance?name=person').data)
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[-1]['timestamp'], '2024-01-01T10:00:00')
+    
+    def test_log_attendance_batch_invalid(self):
+        """Test that one invalid row rejects the whole batch"""
+        rows = [
+            {'name': 'Aditya', 'confidence': 0.9},
+            {'name': ' ', 'confidence': 0.9},
+            {'name': 'John', 'confidence': 1.5},
+            {'name': 'Jane', 'confidence': 0.9, 'timestamp': 'yesterday'},
+            'not a record'
+        ]
+        response = self.client.post('/api/attendance/batch', json=rows)
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.data)['errors']
+        self.assertEqual([e['index'] for e in errors], [1, 2, 3, 4])
+        self.assertEqual(json.loads(self.client.get('/api/attendance').data), [])
+        
+        self.assertEqual(self.client.post('/api/attendance/batch', json=[]).status_code, 400)
+        self.assertEqual(self.client.post('/api/attendance/batch', data=b'\x1f\x8bjunk').status_code, 400)
+    
+    def test_log_attendance_batch_confidence_types(self):
+        """Test that only JSON numbers are accepted as confidences"""
+        for confidence in ([0.5], {'value': 0.5}, True, '0.5', None):
+            with self.subTest(confidence=confidence):
+                response = self.client.post('/api/attendance/batch',
+                    json=[{'name': 'Aditya', 'confidence': confidence}])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.data)['errors'][0]['index'], 0)
+        
+        self.assertEqual(json.loads(self.client.get('/api/attendance').data), [])
+        response = self.client.post('/api/attendance/batch', json=[{'name': 'Aditya', 'confidence': 1}])
+        self.assertEqual(response.status_code, 201)
+        # Later sightings merge into the stored record and compare confidences numerically
+        response = self.client.post('/api/attendance', json={'name': 'Aditya', 'confidence': 0.8})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['confidence'], 1)
+    
+    def test_export_attendance(self):
+        """Test streaming export as CSV, NDJSON and gzip"""
+        import csv
+        import gzip
+        rows = [{'name': name, 'confidence': 0.9, 'timestamp': ts} for name, ts in [
+            ('Aditya', '2024-11-25T09:00:00'), ('John', '2024-11-26T09:00:00'), ('Aditya', '2024-11-27T09:00:00')
+        ]]
+        self.client.post('/api/attendance/batch', json=rows)
+        
+        response = self.client.get('/api/attendance/export?from=2024-11-25&to=2024-11-26')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        exported = list(csv.DictReader(response.data.decode().splitlines()))
+        self.assertEqual([(r['id'], r['name']) for r in exported], [('1', 'Aditya'), ('2', 'John')])
+        
+        response = self.client.get('/api/attendance/export?format=ndjson&name=aditya',
+            headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [1, 3])
+        
+        self.assertEqual(self.client.get('/api/attendance/export?format=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/attendance/export?date=26-11-2024').status_code, 400)
+    
+    def test_attendance_stats(self):
+        """Test bucketed headcount and per-person days present"""
+        rows = [{'name': name, 'confidence': 0.9, 'timestamp': ts} for name, ts in [
+            ('Aditya', '2024-11-25T09:00:00'), ('John', '2024-11-25T09:30:00'),
+            ('Aditya', '2024-11-26T08:45:00'), ('Aditya', '2024-11-26T17:00:00')
+        ]]
+        self.client.post('/api/attendance/batch', json=rows)
+        
+        response = self.client.get('/api/attendance/stats?bucket=day')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([(b['start'], b['headcount'], b['records']) for b in data['buckets']],
+                         [('2024-11-25', 2, 2), ('2024-11-26', 1, 2)])
+        self.assertEqual(data['buckets'][1]['last_out'], '2024-11-26T17:00:00')
+        self.assertEqual({p['name']: p['days_present'] for p in data['persons']}, {'Aditya': 2, 'John': 1})
+        
+        data = json.loads(self.client.get('/api/attendance/stats?bucket=month&name=john').data)
+        self.assertEqual(data['buckets'], [{'start': '2024-11-01', 'records': 1, 'headcount': 1,
+                                            'first_in': '2024-11-25T09:30:00', 'last_out': '2024-11-25T09:30:00'}])
+        
+        self.assertEqual(self.client.get('/api/attendance/stats?bucket=hour').status_code, 400)
+    
     def test_get_all_attendance(self):
         """Test fetching all attendance records"""
         # Add test records
@@ -100,6 +231,41 @@ class AttendanceAPITestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(len(data), 1)
     
+    def test_get_attendance_pagination(self):
+        """Test paging through attendance with limit and cursor"""
+        for i in range(3):
+            self.client.post('/api/attendance', json={'name': f'Person{i}', 'confidence': 0.9})
+        
+        response = self.client.get('/api/attendance?limit=2')
+        self.assertEqual(response.status_code, 200)
+        first_page = json.loads(response.data)
+        self.assertEqual(len(first_page), 2)
+        cursor = response.headers['X-Next-Cursor']
+        
+        response = self.client.get(f'/api/attendance?limit=2&cursor={cursor}')
+        second_page = json.loads(response.data)
+        self.assertEqual(len(second_page), 1)
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        self.assertEqual(len({r['id'] for r in first_page + second_page}), 3)
+    
+    def test_get_attendance_date_range(self):
+        """Test filtering attendance by from/to dates"""
+        self.client.post('/api/attendance', json={'name': 'Aditya', 'confidence': 0.95})
+        
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        response = self.client.get(f'/api/attendance?from={today}&to={today}')
+        self.assertEqual(len(json.loads(response.data)), 1)
+        
+        response = self.client.get('/api/attendance?to=2000-01-01')
+        self.assertEqual(len(json.loads(response.data)), 0)
+    
+    def test_get_attendance_invalid_params(self):
+        """Test rejecting invalid dates, limits and cursors"""
+        self.assertEqual(self.client.get('/api/attendance?from=26-11-2024').status_code, 400)
+        self.assertEqual(self.client.get('/api/attendance?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/attendance?limit=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/attendance?limit=5&cursor=bad').status_code, 400)
+    
     def test_delete_attendance(self):
         """Test deleting an attendance record"""
         response = self.client.post('/api/attendance', json={'name': 'Aditya', 'confidence': 0.95})
@@ -138,6 +304,64 @@ class AttendanceAPITestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['success'], True)
     
+    def test_gallery_download(self):
+        """Test downloading the gallery as JSON and float32 with conditional GET"""
+        from utils.gallery import decode_gallery
+        rows = np.random.default_rng(0).normal(size=(2, EMBEDDING_DIM)).astype(np.float32)
+        for name, row in zip(['John', 'Aditya'], rows):
+            self.client.post(f'/api/embeddings/{name}', json={'embedding': row.tolist()})
+        
+        response = self.client.get('/api/gallery')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['names'], ['Aditya', 'John'])
+        self.assertEqual(len(data['embeddings'][0]), EMBEDDING_DIM)
+        
+        response = self.client.get('/api/gallery?format=f32')
+        header, matrix = decode_gallery(response.data)
+        self.assertEqual((header['version'], header['names']), (data['version'], ['Aditya', 'John']))
+        np.testing.assert_allclose(matrix[1], rows[0] / np.linalg.norm(rows[0]), rtol=1e-6)
+        etag = response.headers['ETag']
+        
+        response = self.client.get('/api/gallery?format=f32', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        
+        # Any change bumps the version, so the old tag no longer matches
+        self.client.delete('/api/embeddings/John')
+        response = self.client.get('/api/gallery?format=f32', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode_gallery(response.data)[0]['names'], ['Aditya'])
+        self.assertEqual([e['name'] for e in json.loads(self.client.get('/api/embeddings').data)], ['Aditya'])
+        
+        self.assertEqual(self.client.get('/api/gallery?format=xml').status_code, 400)
+    
+    def test_gallery_changes(self):
+        """Test delta sync since a gallery version"""
+        from utils.gallery import decode_gallery
+        rows = np.random.default_rng(1).normal(size=(3, EMBEDDING_DIM)).astype(np.float32)
+        self.client.post('/api/embeddings/Aditya', json={'embedding': rows[0].tolist()})
+        since = json.loads(self.client.post('/api/embeddings/John', json={'embedding': rows[1].tolist()}).data)['version']
+        
+        self.client.post('/api/embeddings/Jane', json={'embedding': rows[2].tolist()})
+        self.client.delete('/api/embeddings/Aditya')
+        
+        data = json.loads(self.client.get(f'/api/gallery/changes?since={since}').data)
+        self.assertFalse(data['snapshot'])
+        self.assertEqual((data['added'], data['updated'], data['removed']), (['Jane'], [], ['Aditya']))
+        self.assertEqual(data['names'], ['Jane'])
+        self.assertEqual(len(data['embeddings'][0]), EMBEDDING_DIM)
+        
+        header, matrix = decode_gallery(self.client.get(f'/api/gallery/changes?since={since}&format=f32').data)
+        self.assertEqual((header['removed'], header['names'], matrix.shape[0]), (['Aditya'], ['Jane'], 1))
+        
+        # A version the server cannot account for gets a full snapshot
+        data = json.loads(self.client.get('/api/gallery/changes?since=999').data)
+        self.assertTrue(data['snapshot'])
+        self.assertEqual(data['names'], ['Jane', 'John'])
+        
+        self.assertEqual(self.client.get('/api/gallery/changes').status_code, 400)
+    
     def test_save_embedding_missing_data(self):
         """Test saving embedding with missing data"""
         response = self.client.post('/api/embeddings/TestPerson',
@@ -145,6 +369,14 @@ class AttendanceAPITestCase(unittest.TestCase):
         
         self.assertEqual(response.status_code, 400)
     
+    def test_save_embedding_invalid_types(self):
+        """Test that embeddings which are not lists of numbers are rejected and not written"""
+        for embedding in (0.5, None, {'values': [0.1]}, [], [0.1, '0.2'], [0.1, True], [[0.1, 0.2]], '0.1'):
+            with self.subTest(embedding=embedding):
+                response = self.client.post('/api/embeddings/TestPerson', json={'embedding': embedding})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(os.listdir(self.test_embeddings_dir), [])
+    
     def test_delete_embedding(self):
         """Test deleting an embedding"""
         # First save an embedding
@@ -155,5 +387,218 @@ class AttendanceAPITestCase(unittest.TestCase):
         response = self.client.delete('/api/embeddings/TestPerson')
         self.assertEqual(response.status_code, 200)
 
+    def test_identify(self):
+        """Test server-side matching against saved embeddings"""
+        rng = np.random.default_rng(0)
+        rows = rng.standard_normal((3, EMBEDDING_DIM))
+        for name, row in zip(['Aditya', 'John', 'Jane'], rows):
+            self.client.post(f'/api/embeddings/{name}', json={'embedding': row.tolist()})
+        
+        response = self.client.post('/api/identify', json={'embedding': rows[1].tolist(), 'k': 2})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['name'], 'John')
+        self.assertAlmostEqual(data['confidence'], 1.0, places=5)
+        self.assertEqual(len(data['matches']), 2)
+        
+        # Deleting a person takes effect immediately
+        self.client.delete('/api/embeddings/John')
+        response = self.client.post('/api/identify', json={'embedding': rows[1].tolist()})
+        self.assertNotEqual(json.loads(response.data)['matches'][0]['name'], 'John')
+    
+    def test_identify_unknown(self):
+        """Test that scores below the threshold report Unknown"""
+        row = np.zeros(EMBEDDING_DIM)
+        row[0] = 1.0
+        self.client.post('/api/embeddings/Aditya', json={'embedding': row.tolist()})
+        
+        query = np.zeros(EMBEDDING_DIM)
+        query[1] = 1.0
+        response = self.client.post('/api/identify', json={'embedding': query.tolist()})
+        self.assertEqual(json.loads(response.data)['name'], 'Unknown')
+    
+    def test_identify_batch(self):
+        """Test identifying several faces in one request"""
+        rng = np.random.default_rng(1)
+        rows = rng.standard_normal((2, EMBEDDING_DIM))
+        for name, row in zip(['Aditya', 'John'], rows):
+            self.client.post(f'/api/embeddings/{name}', json={'embedding': row.tolist()})
+        
+        response = self.client.post('/api/identify/batch',
+            json={'embeddings': [rows[1].tolist(), rows[0].tolist()], 'k': 2})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual([r['name'] for r in results], ['John', 'Aditya'])
+        self.assertEqual(len(results[0]['matches']), 2)
+        
+        # Same batch as raw float32 rows
+        response = self.client.post('/api/identify/batch?k=2',
+            data=rows[[1, 0]].astype('<f4').tobytes(),
+            content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['name'] for r in json.loads(response.data)['results']], ['John', 'Aditya'])
+    
+    def test_identify_batch_invalid(self):
+        """Test batch identify with malformed input"""
+        self.assertEqual(self.client.post('/api/identify/batch', json={}).status_code, 400)
+        response = self.client.post('/api/identify/batch', json={'embeddings': []})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/identify/batch', data=b'\x00' * 10,
+            content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_identify_invalid(self):
+        """Test identify with missing or malformed embeddings"""
+        self.assertEqual(self.client.post('/api/identify', json={}).status_code, 400)
+        response = self.client.post('/api/identify', json={'embedding': [0.1, 0.2]})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/identify', json={'embedding': [0.0] * EMBEDDING_DIM, 'k': 0})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_metrics(self):
+        """Test that /metrics reports requests, stage latencies and store sizes"""
+        self.client.post('/api/attendance', json={'name': 'Aditya', 'confidence': 0.95})
+        self.client.post('/api/embeddings/Aditya', json={'embedding': [0.1] * EMBEDDING_DIM})
+        self.client.post('/api/identify', json={'embedding': [0.1] * EMBEDDING_DIM})
+        self.client.delete('/api/attendance/999')
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('face_http_requests_total{method="DELETE",route="/api/attendance/<int:record_id>",'
+                      'status="404"}', text)
+        self.assertIn('face_stage_duration_seconds_count{stage="matching"}', text)
+        self.assertIn('face_stage_duration_seconds_bucket{stage="matching",le="+Inf"}', text)
+        self.assertIn('face_gallery_people 1\n', text)
+        self.assertIn('face_attendance_records 1\n', text)
+        self.assertIn('face_attendance_log_bytes ', text)
+    
+    def test_profiler_toggle(self):
+        """Test starting, inspecting and stopping the sampling profiler"""
+        self.assertEqual(self.client.post('/api/profiler', json={}).status_code, 400)
+        response = self.client.post('/api/profiler', json={'enabled': True, 'interval': 10})
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.client.post('/api/profiler', json={'enabled': True, 'interval': 0.001, 'reset': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['running'])
+        try:
+            for _ in range(20):
+                self.client.get('/api/attendance')
+            status = json.loads(self.client.get('/api/profiler').data)
+            self.assertTrue(status['running'])
+            self.assertIsInstance(status['stacks'], list)
+        finally:
+            response = self.client.post('/api/profiler', json={'enabled': False})
+        self.assertFalse(json.loads(response.data)['running'])
+        collapsed = self.client.get('/api/profiler?format=collapsed')
+        self.assertEqual(collapsed.status_code, 200)
+        self.assertEqual(collapsed.mimetype, 'text/plain')
+    
+    def enroll(self, files, query='', extract=None):
+        """POST files to /api/enroll/Aditya, returning the NDJSON events"""
+        def fake_extract(data):
+            # Uploads hold stored vectors instead of photos
+            if data.startswith(b'\x93NUMPY'):
+                return np.load(io.BytesIO(data))
+            if data == b'no face':
+                return None
+            raise ValueError('not a readable image')
+        
+        upload = {'images': [(io.BytesIO(data), filename) for filename, data in files], 'note': 'ignored'}
+        with mock.patch.object(app_module, 'extract_upload', extract or fake_extract):
+            response = self.client.post('/api/enroll/Aditya' + query, data=upload,
+                                        content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    
+    def vector_file(self, vector):
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(vector, dtype=np.float32))
+        return buffer.getvalue()
+    
+    def test_enroll_images(self):
+        """Test per-image progress and one gallery update from the mean of the faces found"""
+        from app import get_embedding_store
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((3, EMBEDDING_DIM)).astype(np.float32)
+        files = [(f'{i}.jpg', self.vector_file(v)) for i, v in enumerate(vectors)]
+        files += [('blurry.jpg', b'no face'), ('notes.txt', b'hello')]
+        
+        events = self.enroll(files)
+        
+        images = sorted(events[:-1], key=lambda e: e['index'])
+        self.assertEqual([e['event'] for e in images], ['image'] * 5)
+        self.assertEqual([e['status'] for e in images], ['ok', 'ok', 'ok', 'no_face', 'error'])
+        self.assertEqual(images[4]['filename'], 'notes.txt')
+        done = events[-1]
+        self.assertEqual((done['event'], done['images'], done['faces'], done['templates']), ('done', 5, 3, 1))
+        
+        store = get_embedding_store()
+        self.assertEqual(done['version'], store.version)
+        expected = vectors.mean(axis=0)
+        np.testing.assert_allclose(store.get('Aditya'), expected / np.linalg.norm(expected), rtol=1e-5)
+        with open(os.path.join(self.test_embeddings_dir, 'Aditya_embedding.json')) as f:
+            self.assertEqual(len(json.load(f)['embedding']), EMBEDDING_DIM)
+    
+    def test_enroll_rejected_faces(self):
+        """Test that faces failing the quality gate are reported with the reason and not used"""
+        from utils.face_quality import FaceRejected
+        vector = np.random.default_rng(2).standard_normal(EMBEDDING_DIM).astype(np.float32)
+        
+        def extract(data):
+            if data == b'blurry':
+                raise FaceRejected('blurry')
+            return np.load(io.BytesIO(data))
+        
+        events = self.enroll([('a.jpg', self.vector_file(vector)), ('b.jpg', b'blurry')], extract=extract)
+        
+        rejected = [e for e in events if e.get('status') == 'rejected']
+        self.assertEqual([(e['filename'], e['reason']) for e in rejected], [('b.jpg', 'blurry')])
+        self.assertEqual((events[-1]['event'], events[-1]['faces']), ('done', 1))
+    
+    def test_enroll_templates(self):
+        """Test that ?templates= keeps several templates for the person"""
+        from app import get_embedding_store
+        vectors = np.random.default_rng(1).standard_normal((4, EMBEDDING_DIM))
+        events = self.enroll([(f'{i}.jpg', self.vector_file(v)) for i, v in enumerate(vectors)],
+                             query='?templates=2')
+        
+        self.assertEqual(events[-1]['templates'], 2)
+        self.assertEqual(get_embedding_store().get('Aditya').shape, (2, EMBEDDING_DIM))
+    
+    def test_enroll_without_faces(self):
+        """Test that an upload without any face reports an error and changes nothing"""
+        from app import get_embedding_store
+        events = self.enroll([('a.jpg', b'no face'), ('b.jpg', b'no face')])
+        
+        self.assertEqual(events[-1]['event'], 'error')
+        self.assertIn('No faces found', events[-1]['error'])
+        self.assertNotIn('Aditya', get_embedding_store())
+        self.assertEqual(self.enroll([])[-1]['event'], 'error')
+    
+    def test_enroll_invalid(self):
+        """Test enrollment requests rejected before any image is read"""
+        response = self.client.post('/api/enroll/Aditya', json={'embedding': [0.1]})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/enroll/Aditya?templates=0', data={'images': (io.BytesIO(b'x'), 'a.jpg')},
+                                    content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_enroll_truncated_upload(self):
+        """Test that an upload cut off mid-stream is reported and not applied"""
+        from app import get_embedding_store
+        body = (b'--xyz\r\nContent-Disposition: form-data; name="images"; filename="a.jpg"\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n' + self.vector_file(np.ones(EMBEDDING_DIM)))
+        with mock.patch.object(app_module, 'extract_upload', lambda data: np.ones(EMBEDDING_DIM)):
+            response = self.client.post('/api/enroll/Aditya', data=body,
+                                        content_type='multipart/form-data; boundary=xyz')
+            events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        
+        self.assertEqual(events[-1]['event'], 'error')
+        self.assertNotIn('Aditya', get_embedding_store())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import json
+import os
+import tempfile
+import shutil
+import gc
+import weakref
+from datetime import datetime, timedelta
+from utils.attendance_store import AttendanceStore
+from utils.attendance_aggregator import AttendanceAggregator
+
+WINDOW = 60
+
+class AttendanceAggregatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a temporary data directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, 'attendance.jsonl')
+        self.now = datetime.utcnow()
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def open_aggregator(self):
+        store = AttendanceStore(self.log_file)
+        self.addCleanup(store.close)
+        aggregator = AttendanceAggregator(store, window=WINDOW, flush_interval=3600)
+        self.addCleanup(aggregator.close)
+        return aggregator
+
+    def read_log(self):
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+    def at(self, seconds):
+        return self.now + timedelta(seconds=seconds)
+
+    def test_closed_instances_are_released(self):
+        """Test that closed stores and aggregators are not kept alive until exit"""
+        store = AttendanceStore(self.log_file)
+        aggregator = AttendanceAggregator(store, window=WINDOW, flush_interval=3600)
+        aggregator.sighting('Aditya', 0.9, self.at(0))
+        aggregator.sighting('Aditya', 0.9, self.at(1))
+        refs = [weakref.ref(store), weakref.ref(aggregator)]
+
+        aggregator.close()
+        store.close()
+        del store, aggregator
+        gc.collect()
+        self.assertEqual([ref() for ref in refs], [None, None])
+        self.assertEqual(self.read_log()[-1]['sightings'], 1)
+
+    def test_sightings_merge_into_one_record(self):
+        """Test that a burst of sightings costs one add and one touch"""
+        aggregator = self.open_aggregator()
+        record, created = aggregator.sighting('Aditya', 0.8, self.at(0))
+        self.assertTrue(created)
+
+        for i in range(1, 1000):
+            merged, created = aggregator.sighting('Aditya', 0.8 + (i % 10) / 100, self.at(i * 0.05))
+            self.assertFalse(created)
+        self.assertEqual(merged['id'], record['id'])
+        self.assertEqual(merged['sightings'], 1000)
+        self.assertEqual(len(self.read_log()), 1)
+
+        self.assertEqual(aggregator.flush(), 1)
+        entries = self.read_log()
+        self.assertEqual([e['op'] for e in entries], ['add', 'touch'])
+
+        stored = aggregator.store.get(record['id'])
+        self.assertEqual(stored['first_seen'], self.at(0).isoformat())
+        self.assertEqual(stored['last_seen'], self.at(999 * 0.05).isoformat())
+        self.assertEqual(stored['confidence'], 0.89)
+        self.assertEqual(stored['sightings'], 1000)
+
+    def test_gap_longer_than_window_starts_new_visit(self):
+        """Test that people seen again after the window get a new record"""
+        aggregator = self.open_aggregator()
+        first, _ = aggregator.sighting('Aditya', 0.9, self.at(0))
+        aggregator.sighting('John', 0.9, self.at(1))
+        second, created = aggregator.sighting('Aditya', 0.9, self.at(WINDOW + 1))
+
+        self.assertTrue(created)
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertEqual(len(aggregator.store), 3)
+
+    def test_new_visit_writes_pending_sightings(self):
+        """Test that sightings of an ended visit are kept when the next one starts before a flush"""
+        aggregator = self.open_aggregator()
+        first, _ = aggregator.sighting('Aditya', 0.8, self.at(0))
+        aggregator.sighting('Aditya', 0.9, self.at(10))
+        aggregator.sighting('Aditya', 0.7, self.at(WINDOW + 20))
+
+        stored = aggregator.store.get(first['id'])
+        self.assertEqual(stored['sightings'], 2)
+        self.assertEqual(stored['confidence'], 0.9)
+        self.assertEqual(stored['last_seen'], self.at(10).isoformat())
+
+    def test_visit_survives_restart(self):
+        """Test that a restarted server continues the open visit from the log"""
+        aggregator = self.open_aggregator()
+        record, _ = aggregator.sighting('Aditya', 0.9, self.at(0))
+        aggregator.sighting('Aditya', 0.95, self.at(1))
+        aggregator.close()
+        aggregator.store.close()
+
+        aggregator = self.open_aggregator()
+        merged, created = aggregator.sighting('aditya', 0.7, self.at(2))
+        aggregator.flush()
+
+        self.assertFalse(created)
+        self.assertEqual(merged['id'], record['id'])
+        stored = aggregator.store.get(record['id'])
+        self.assertEqual(stored['sightings'], 3)
+        self.assertEqual(stored['confidence'], 0.95)
+
+    def test_workers_share_visits(self):
+        """Test that two workers sharing a log merge into the same record"""
+        first = self.open_aggregator()
+        second = self.open_aggregator()
+        record, _ = first.sighting('Aditya', 0.9, self.at(0))
+        merged, created = second.sighting('Aditya', 0.9, self.at(1))
+        first.sighting('Aditya', 0.9, self.at(2))
+        first.flush()
+        second.flush()
+
+        self.assertFalse(created)
+        self.assertEqual(merged['id'], record['id'])
+        self.assertEqual(first.store.get(record['id'])['sightings'], 3)
+        self.assertEqual(len(second.store), 1)
+
+    def test_deleted_visit_starts_new_record(self):
+        """Test that deleting the open record does not swallow later sightings"""
+        aggregator = self.open_aggregator()
+        record, _ = aggregator.sighting('Aditya', 0.9, self.at(0))
+        aggregator.store.delete(record['id'])
+
+        second, created = aggregator.sighting('Aditya', 0.9, self.at(1))
+        self.assertTrue(created)
+        self.assertEqual(aggregator.flush(), 0)
+
+    def test_compaction_folds_touches(self):
+        """Test that compaction keeps merged fields and drops touch entries"""
+        aggregator = self.open_aggregator()
+        record, _ = aggregator.sighting('Aditya', 0.9, self.at(0))
+        aggregator.sighting('Aditya', 0.9, self.at(1))
+        aggregator.flush()
+        aggregator.store.compact()
+
+        self.assertEqual([e['op'] for e in self.read_log()], ['meta', 'add'])
+        self.assertEqual(aggregator.store.get(record['id'])['sightings'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import os
+import random
+import tempfile
+import shutil
+from utils.attendance_stats import AttendanceRollup, bucket_start
+from utils.attendance_store import AttendanceStore
+
+
+def brute_force(records, bucket, name=None, date_from=None, date_to=None):
+    """Rollups computed from scratch over every record"""
+    matching = [
+        r for r in records
+        if (not name or name.lower() in r['name'].lower())
+        and (not date_from or r['timestamp'][:10] >= date_from)
+        and (not date_to or r['timestamp'][:10] <= date_to)
+    ]
+    buckets = {}
+    persons = {}
+    for r in matching:
+        out = r.get('last_seen', r['timestamp'])
+        b = buckets.setdefault(bucket_start(r['timestamp'][:10], bucket),
+                               {'records': 0, 'people': set(), 'ins': [], 'outs': []})
+        p = persons.setdefault(r['name'].lower(), {'records': 0, 'days': set(), 'ins': [], 'outs': []})
+        for entry in (b, p):
+            entry['records'] += 1
+            entry['ins'].append(r['timestamp'])
+            entry['outs'].append(out)
+        b['people'].add(r['name'].lower())
+        p['days'].add(r['timestamp'][:10])
+    return [
+        {'start': k, 'records': b['records'], 'headcount': len(b['people']),
+         'first_in': min(b['ins']), 'last_out': max(b['outs'])}
+        for k, b in sorted(buckets.items())
+    ], [
+        (k, p['records'], len(p['days']), min(p['ins']), max(p['outs']))
+        for k, p in sorted(persons.items())
+    ]
+
+
+class AttendanceRollupTestCase(unittest.TestCase):
+
+    def test_matches_brute_force_under_churn(self):
+        """Test incremental rollups against a full recomputation after adds and removes"""
+        rng = random.Random(0)
+        rollup = AttendanceRollup()
+        live = []
+        for i in range(500):
+            if live and rng.random() < 0.3:
+                rollup.remove(live.pop(rng.randrange(len(live))))
+                continue
+            if live and rng.random() < 0.1:
+                record = rng.choice(live)
+                previous = record.get('last_seen', record['timestamp'])
+                record['last_seen'] = record['timestamp'][:11] + f'{rng.randint(19, 23)}:00:00'
+                rollup.touch(record, previous)
+                continue
+            timestamp = f'2024-{rng.randint(10, 12)}-{rng.randint(10, 28)}T{rng.randint(10, 18)}:00:00'
+            record = {'id': i, 'name': rng.choice(['Aditya', 'aditya', 'John', 'Johnny', 'Jane']),
+                      'timestamp': timestamp}
+            if rng.random() < 0.5:
+                record['last_seen'] = timestamp[:11] + '19:30:00'
+            rollup.add(record)
+            live.append(record)
+
+        for bucket in ('day', 'week', 'month'):
+            for filters in ({}, {'name': 'john'}, {'date_from': '2024-11-03', 'date_to': '2024-11-20'},
+                            {'date_from': '2024-11-01', 'date_to': '2024-11-30'}, {'date_from': '2024-11-27'},
+                            {'date_to': '2024-10-15'}, {'name': 'adi', 'date_from': '2024-12-01'}):
+                buckets, persons = rollup.stats(bucket=bucket, **filters)
+                expected_buckets, expected_persons = brute_force(live, bucket, **filters)
+                self.assertEqual(buckets, expected_buckets)
+                self.assertEqual(
+                    [(p['name'].lower(), p['records'], p['days_present'], p['first_in'], p['last_out'])
+                     for p in persons],
+                    expected_persons
+                )
+
+    def test_bucket_start(self):
+        """Test that weeks start on Monday and months on the first"""
+        self.assertEqual(bucket_start('2024-11-28', 'week'), '2024-11-25')
+        self.assertEqual(bucket_start('2024-11-28', 'month'), '2024-11-01')
+        with self.assertRaises(ValueError):
+            bucket_start('2024-11-28', 'year')
+
+
+class AttendanceStoreStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a store in a temporary directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, 'attendance.jsonl')
+        self.store = AttendanceStore(self.log_file)
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_follows_touches_deletes_and_reload(self):
+        """Test that rollups track touches and deletes and survive a restart"""
+        first = self.store.add({'name': 'Aditya', 'timestamp': '2024-11-25T09:00:00', 'confidence': 0.9})
+        second = self.store.add({'name': 'Aditya', 'timestamp': '2024-11-25T13:00:00', 'confidence': 0.9})
+        self.store.touch(first['id'], '2024-11-25T17:30:00', 0.95, sightings=4)
+        self.store.add({'name': 'John', 'timestamp': '2024-11-26T08:00:00', 'confidence': 0.8})
+        self.store.delete(second['id'])
+
+        buckets, persons = self.store.stats(bucket='day')
+        self.assertEqual(buckets, [
+            {'start': '2024-11-25', 'records': 1, 'headcount': 1,
+             'first_in': '2024-11-25T09:00:00', 'last_out': '2024-11-25T17:30:00'},
+            {'start': '2024-11-26', 'records': 1, 'headcount': 1,
+             'first_in': '2024-11-26T08:00:00', 'last_out': '2024-11-26T08:00:00'},
+        ])
+        self.assertEqual([(p['name'], p['days_present']) for p in persons], [('Aditya', 1), ('John', 1)])
+
+        self.store.close()
+        self.store = AttendanceStore(self.log_file)
+        self.assertEqual(self.store.stats(bucket='week')[0][0]['headcount'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
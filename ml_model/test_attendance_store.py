@@ -0,0 +1,404 @@
+import unittest
+import json
+import os
+import tempfile
+import shutil
+import multiprocessing
+import threading
+from unittest import mock
+from utils import attendance_store
+from utils.attendance_store import AttendanceStore, log_path_for
+
+class AttendanceStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a temporary data directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.legacy_file = os.path.join(self.test_dir, 'attendance.json')
+        self.log_file = log_path_for(self.legacy_file)
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def open_store(self):
+        store = AttendanceStore(self.log_file, legacy_path=self.legacy_file)
+        self.addCleanup(store.close)
+        return store
+
+    def read_log(self):
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+    def test_add_appends_single_entry(self):
+        """Test that adding a record appends one line instead of rewriting"""
+        store = self.open_store()
+        store.add({'name': 'Aditya', 'confidence': 0.9})
+        size = os.path.getsize(self.log_file)
+
+        record = store.add({'name': 'John', 'confidence': 0.8})
+
+        self.assertEqual(record['id'], 2)
+        entries = self.read_log()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[-1], {'op': 'add', 'record': record})
+        self.assertGreater(os.path.getsize(self.log_file), size)
+
+    def test_add_many_commits_one_write(self):
+        """Test that a batch gets contiguous ids and is appended with one write"""
+        store = self.open_store()
+        store.add({'name': 'Aditya'})
+        writes = []
+        append = store._append
+        def counting_append(entries):
+            writes.append(len(entries))
+            return append(entries)
+        store._append = counting_append
+
+        records = store.add_many([{'name': f'person{i}'} for i in range(10000)])
+
+        self.assertEqual(writes, [10000])
+        self.assertEqual([r['id'] for r in records], list(range(2, 10002)))
+        self.assertEqual(len(self.read_log()), 10001)
+        self.assertEqual(store.get(10001)['name'], 'person9999')
+        self.assertEqual(store.add({'name': 'John'})['id'], 10002)
+
+    def test_reopen_restores_records_and_ids(self):
+        """Test that records and id allocation survive a restart"""
+        store = self.open_store()
+        store.add({'name': 'Aditya'})
+        store.add({'name': 'John'})
+        store.delete(2)
+        store.close()
+
+        store = self.open_store()
+        self.assertEqual([r['name'] for r in store.records()], ['Aditya'])
+        # Deleted ids are never reused
+        self.assertEqual(store.add({'name': 'Jane'})['id'], 3)
+
+    def test_delete_missing_record(self):
+        """Test deleting an id that does not exist"""
+        store = self.open_store()
+        self.assertFalse(store.delete(42))
+        self.assertEqual(os.path.getsize(self.log_file), 0)
+
+    def test_migrates_legacy_file_once(self):
+        """Test one-time migration from the {'records', 'next_id'} format"""
+        with open(self.legacy_file, 'w') as f:
+            json.dump({'records': [
+                {'id': 1, 'name': 'Aditya', 'timestamp': '2024-11-26T10:30:00'},
+                {'id': 4, 'name': 'John', 'timestamp': '2024-11-26T10:31:00'}
+            ], 'next_id': 7}, f, indent=2)
+
+        store = self.open_store()
+
+        self.assertEqual([r['id'] for r in store.records()], [1, 4])
+        self.assertEqual(store.add({'name': 'Jane'})['id'], 7)
+        self.assertFalse(os.path.exists(self.legacy_file))
+        self.assertTrue(os.path.exists(self.legacy_file + '.migrated'))
+
+    def test_truncated_last_line_is_discarded(self):
+        """Test recovery from a crash in the middle of an append"""
+        store = self.open_store()
+        store.add({'name': 'Aditya'})
+        store.close()
+        with open(self.log_file, 'ab') as f:
+            f.write(b'{"op": "add", "rec')
+
+        store = self.open_store()
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.add({'name': 'John'})['id'], 2)
+        self.assertEqual(len(self.read_log()), 2)
+
+    def test_compaction_drops_dead_entries(self):
+        """Test that compaction keeps only live records"""
+        store = self.open_store()
+        for i in range(10):
+            store.add({'name': f'Person{i}'})
+        for i in range(1, 9):
+            store.delete(i)
+
+        store.compact()
+
+        entries = self.read_log()
+        self.assertEqual(len(entries[0].pop('log_id')), 16)
+        self.assertEqual(entries[0], {'op': 'meta', 'next_id': 11})
+        self.assertEqual([e['record']['id'] for e in entries[1:]], [9, 10])
+        self.assertEqual(store.add({'name': 'Jane'})['id'], 11)
+
+    def test_compaction_runs_automatically(self):
+        """Test that enough dead entries trigger compaction on write"""
+        original = attendance_store.COMPACT_MIN_DEAD
+        attendance_store.COMPACT_MIN_DEAD = 10
+        self.addCleanup(setattr, attendance_store, 'COMPACT_MIN_DEAD', original)
+
+        store = self.open_store()
+        for _ in range(10):
+            record = store.add({'name': 'Aditya'})
+            store.delete(record['id'])
+
+        self.assertLess(len(self.read_log()), 20)
+        self.assertEqual(len(store), 0)
+
+    def checkpoint_every(self, entries):
+        original = attendance_store.CHECKPOINT_MIN_ENTRIES
+        attendance_store.CHECKPOINT_MIN_ENTRIES = entries
+        self.addCleanup(setattr, attendance_store, 'CHECKPOINT_MIN_ENTRIES', original)
+
+    def snapshot(self, store):
+        return (store.next_id, store.query(limit=100), store.stats(bucket='week'), store.stats(name='person1'))
+
+    def test_open_replays_only_after_checkpoint(self):
+        """Test that opening restores the checkpoint and replays just the newer entries"""
+        self.checkpoint_every(5)
+        store = self.open_store()
+        store.add_many([{'name': f'Person{i % 3}', 'timestamp': f'2024-01-{i + 1:02d}T09:00:00'} for i in range(20)])
+        store.delete(4)
+        store.close()
+        self.open_store().close()
+        self.assertTrue(os.path.exists(self.log_file + attendance_store.CHECKPOINT_SUFFIX))
+
+        store = self.open_store()
+        store.add({'name': 'Person1', 'timestamp': '2024-02-01T09:00:00'})
+        store.close()
+        replayed = []
+        apply = AttendanceStore._apply
+        def counting_apply(store, entry):
+            replayed.append(entry['op'])
+            return apply(store, entry)
+        with mock.patch.object(AttendanceStore, '_apply', counting_apply):
+            store = self.open_store()
+
+        self.assertEqual(replayed, ['add'])
+        restored = self.snapshot(store)
+        store.close()
+        os.remove(self.log_file + attendance_store.CHECKPOINT_SUFFIX)
+        self.assertEqual(restored, self.snapshot(self.open_store()))
+
+    def test_checkpoint_of_older_log_is_ignored(self):
+        """Test that a checkpoint no longer matching the log is not restored"""
+        self.checkpoint_every(5)
+        store = self.open_store()
+        store.add_many([{'name': f'Person{i}'} for i in range(10)])
+        store.close()
+        self.open_store().close()
+        checkpoint = self.log_file + attendance_store.CHECKPOINT_SUFFIX
+        with open(checkpoint, 'rb') as f:
+            stale = f.read()
+
+        store = self.open_store()
+        store.replace_all([{'id': 1, 'name': 'Aditya', 'timestamp': '2024-01-01T09:00:00'}], 2)
+        store.close()
+        with open(checkpoint, 'wb') as f:
+            f.write(stale)
+
+        store = self.open_store()
+        self.assertEqual([r['name'] for r in store.query()[0]], ['Aditya'])
+        self.assertEqual(store.next_id, 2)
+
+    def test_unreadable_checkpoint_is_ignored(self):
+        """Test that a corrupt checkpoint falls back to replaying the whole log"""
+        store = self.open_store()
+        store.add({'name': 'Aditya'})
+        store.close()
+        with open(self.log_file + attendance_store.CHECKPOINT_SUFFIX, 'wb') as f:
+            f.write(b'not a checkpoint')
+
+        with mock.patch('builtins.print') as printed:
+            store = self.open_store()
+
+        self.assertEqual(len(store), 1)
+        self.assertIn('Ignoring unreadable attendance checkpoint', printed.call_args[0][0])
+
+def _hammer_store(log_file, threads, per_thread):
+    """Worker process: add records from several threads at once"""
+    store = AttendanceStore(log_file)
+
+    def run():
+        for i in range(per_thread):
+            store.add({'name': f'Worker{os.getpid()}', 'confidence': 0.9})
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    store.close()
+
+class AttendanceConcurrencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a temporary data directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.test_dir, 'attendance.jsonl')
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def open_store(self):
+        store = AttendanceStore(self.log_file)
+        self.addCleanup(store.close)
+        return store
+
+    def test_concurrent_threads_get_unique_ids(self):
+        """Test that concurrent adds in one process never share an id"""
+        store = self.open_store()
+        results = []
+
+        def run():
+            for _ in range(50):
+                results.append(store.add({'name': 'Aditya'})['id'])
+
+        workers = [threading.Thread(target=run) for _ in range(8)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        self.assertEqual(sorted(results), list(range(1, 401)))
+        self.assertEqual(len(store), 400)
+
+    def test_stores_see_each_others_writes(self):
+        """Test that two workers sharing a log stay consistent"""
+        first = self.open_store()
+        second = self.open_store()
+
+        first.add({'name': 'Aditya', 'timestamp': '2024-11-26T09:00:00'})
+        record = second.add({'name': 'John', 'timestamp': '2024-11-26T09:05:00'})
+        self.assertEqual(record['id'], 2)
+
+        self.assertEqual([r['id'] for r in first.query()[0]], [2, 1])
+        self.assertTrue(first.delete(2))
+        self.assertFalse(second.delete(2))
+        self.assertEqual([r['id'] for r in second.records()], [1])
+
+    def test_compaction_by_another_worker(self):
+        """Test that a worker reloads after another one replaced the log"""
+        first = self.open_store()
+        second = self.open_store()
+        for _ in range(5):
+            first.add({'name': 'Aditya'})
+        first.delete(1)
+        self.assertEqual(len(second), 4)
+
+        first.compact()
+        record = second.add({'name': 'John'})
+
+        self.assertEqual(record['id'], 6)
+        self.assertEqual(len(first), 5)
+
+    def test_multiple_processes_lose_no_ids(self):
+        """Load test: several worker processes appending at once"""
+        processes = [
+            multiprocessing.Process(target=_hammer_store, args=(self.log_file, 4, 25))
+            for _ in range(4)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        store = self.open_store()
+        ids = [r['id'] for r in store.records()]
+        self.assertEqual(sorted(ids), list(range(1, 401)))
+
+class AttendanceQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a store with records over three days"""
+        self.test_dir = tempfile.mkdtemp()
+        self.store = AttendanceStore(os.path.join(self.test_dir, 'attendance.jsonl'))
+        for name, timestamp in [
+            ('Aditya', '2024-11-25T09:00:00'),
+            ('John', '2024-11-25T09:05:00'),
+            ('Aditya', '2024-11-26T09:00:00'),
+            ('Johnny', '2024-11-26T09:10:00'),
+            ('aditya', '2024-11-27T08:55:00'),
+        ]:
+            self.store.add({'name': name, 'timestamp': timestamp})
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def ids(self, **kwargs):
+        records, _ = self.store.query(**kwargs)
+        return [r['id'] for r in records]
+
+    def test_newest_first(self):
+        """Test default ordering by timestamp descending"""
+        self.assertEqual(self.ids(), [5, 4, 3, 2, 1])
+
+    def test_name_filter_is_case_insensitive_substring(self):
+        """Test name filter semantics match the previous linear scan"""
+        self.assertEqual(self.ids(name='ADITYA'), [5, 3, 1])
+        self.assertEqual(self.ids(name='john'), [4, 2])
+
+    def test_single_day(self):
+        """Test filtering by one day bucket"""
+        self.assertEqual(self.ids(date_from='2024-11-26', date_to='2024-11-26'), [4, 3])
+
+    def test_date_range(self):
+        """Test inclusive from/to ranges with and without a name"""
+        self.assertEqual(self.ids(date_from='2024-11-26'), [5, 4, 3])
+        self.assertEqual(self.ids(date_to='2024-11-25'), [2, 1])
+        self.assertEqual(self.ids(name='aditya', date_from='2024-11-25', date_to='2024-11-26'), [3, 1])
+
+    def test_pagination(self):
+        """Test that following cursors visits every record exactly once"""
+        seen = []
+        cursor = None
+        while True:
+            records, cursor = self.store.query(limit=2, cursor=cursor)
+            seen.extend(r['id'] for r in records)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [5, 4, 3, 2, 1])
+
+    def test_scan_oldest_first_in_chunks(self):
+        """Test that scan yields every match oldest first in bounded chunks"""
+        chunks = list(self.store.scan(chunk_size=2))
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+        self.assertEqual([r['id'] for c in chunks for r in c], [1, 2, 3, 4, 5])
+
+        scanned = lambda **kw: [r['id'] for c in self.store.scan(chunk_size=1, **kw) for r in c]
+        self.assertEqual(scanned(name='aditya'), [1, 3, 5])
+        self.assertEqual(scanned(date_from='2024-11-26', date_to='2024-11-27'), [3, 4, 5])
+
+    def test_scan_picks_up_later_records(self):
+        """Test that records added between chunks are included if they sort later"""
+        chunks = self.store.scan(chunk_size=2)
+        first = next(chunks)
+        self.store.add({'name': 'Jane', 'timestamp': '2024-11-24T09:00:00'})
+        self.store.add({'name': 'Jane', 'timestamp': '2024-11-28T09:00:00'})
+        rest = [r['id'] for c in chunks for r in c]
+        self.assertEqual([r['id'] for r in first] + rest, [1, 2, 3, 4, 5, 7])
+
+    def test_indexes_follow_deletes(self):
+        """Test that deleted records disappear from every index"""
+        self.store.delete(3)
+        self.assertEqual(self.ids(name='aditya'), [5, 1])
+        self.assertEqual(self.ids(date_from='2024-11-26', date_to='2024-11-26'), [4])
+        self.assertEqual(self.ids(), [5, 4, 2, 1])
+
+    def test_reads_return_copies(self):
+        """Test that changing returned records leaves the store untouched"""
+        self.store.get(1)['name'] = 'Changed'
+        self.store.latest('aditya')['name'] = 'Changed'
+        self.store.query()[0][0]['name'] = 'Changed'
+        self.store.records()[0]['name'] = 'Changed'
+        self.store.add({'name': 'Jane', 'timestamp': '2024-11-28T09:00:00'})['name'] = 'Changed'
+        self.store.add_many([{'name': 'Jane', 'timestamp': '2024-11-29T09:00:00'}])[0]['name'] = 'Changed'
+        records, _ = self.store.query()
+        self.assertNotIn('Changed', [r['name'] for r in records])
+
+    def test_invalid_cursor(self):
+        """Test that malformed cursors are rejected"""
+        with self.assertRaises(ValueError):
+            self.store.query(limit=2, cursor='garbage')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import json
+import benchmark
+
+
+class CompareTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Baseline with a latency and a throughput figure"""
+        self.baseline = {'results': {
+            'matching.identify.100': {'runs': 10, 'p50_ms': 1.0, 'p99_ms': 2.0, 'throughput': 1000.0},
+            'extraction.get_embedding': {'skipped': 'no images'},
+        }}
+
+    def report(self, **figures):
+        result = dict(self.baseline['results']['matching.identify.100'], **figures)
+        return {'results': {'matching.identify.100': result}}
+
+    def test_within_tolerance(self):
+        """Test that small slowdowns and skipped benchmarks are not regressions"""
+        report = self.report(p50_ms=1.2, throughput=800.0)
+        self.assertEqual(benchmark.compare(report, self.baseline, tolerance=0.3), [])
+
+    def test_regressions(self):
+        """Test that slower latencies and lower throughput are reported"""
+        report = self.report(p99_ms=3.0, throughput=500.0)
+        regressions = benchmark.compare(report, self.baseline, tolerance=0.3)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('p99_ms', regressions[0])
+        self.assertIn('throughput', regressions[1])
+
+
+class FailuresTestCase(unittest.TestCase):
+
+    def test_failed_benchmarks_are_reported(self):
+        """Test that failed benchmarks and uncovered routes are listed, skipped ones are not"""
+        report = {'results': {
+            'api.uncovered_routes': {'failed': 'no benchmark for /api/new'},
+            'api.GET /health': {'runs': 3, 'p50_ms': 1.0, 'p99_ms': 1.0, 'throughput': 1.0},
+            'extraction.get_embedding': {'skipped': 'no images'},
+        }}
+        self.assertEqual(benchmark.failures(report), ['api.uncovered_routes: no benchmark for /api/new'])
+
+    def test_stream_errors(self):
+        """Test that failed images and enrollments count as errors, finding no face does not"""
+        line = lambda **event: json.dumps(event)
+        ok = '\n'.join([line(event='image', index=0, filename='a.jpg', status='ok'),
+                         line(event='done', name='Bench', images=1, faces=1)])
+        no_face = '\n'.join([line(event='image', index=0, filename='a.jpg', status='no_face'),
+                              line(event='error', error='No faces found in 1 images', images=1, faces=0)])
+        failed = '\n'.join([line(event='image', index=0, filename='a.jpg', status='error', error='unreadable'),
+                             line(event='image', index=1, filename='b.jpg', status='ok'),
+                             line(event='done', name='Bench', images=2, faces=1)])
+        cut_off = line(event='error', error='upload cut off', images=1, faces=1)
+
+        self.assertEqual(benchmark.stream_errors(ok), [])
+        self.assertEqual(benchmark.stream_errors(no_face), [])
+        self.assertEqual(benchmark.stream_errors(failed), ['a.jpg: unreadable'])
+        self.assertEqual(benchmark.stream_errors(cut_off), ['upload cut off'])
+
+
+class MeasureTestCase(unittest.TestCase):
+
+    def test_runs_setup_untimed(self):
+        """Test that setup results reach fn and every run is recorded"""
+        seen = []
+        result = benchmark.measure(seen.append, budget=0, min_runs=3, setup=lambda: len(seen))
+        self.assertEqual(result['runs'], 3)
+        self.assertEqual(seen, [0, 1, 2, 3])
+        self.assertGreater(result['throughput'], 0)
+
+    def test_synthetic_history_is_reproducible(self):
+        """Test that the same seed produces the same records"""
+        first = list(benchmark.synthetic_history(250, people=10, chunk_size=100))
+        second = list(benchmark.synthetic_history(250, people=10, chunk_size=100))
+        self.assertEqual([len(c) for c in first], [100, 100, 50])
+        self.assertEqual(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
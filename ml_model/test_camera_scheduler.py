@@ -0,0 +1,85 @@
+import unittest
+import time
+import numpy as np
+from utils.embedding_layout import landmarks_to_embedding
+from utils.gallery import Gallery
+from utils.camera_scheduler import CameraScheduler
+from test_stream_pipeline import face
+
+FRAME = np.zeros((48, 64, 3), dtype=np.uint8)
+
+
+class SlowDetector:
+    """Returns the same face for every frame after a fixed delay"""
+
+    def __init__(self, points, delay):
+        self.points = points
+        self.delay = delay
+
+    def __call__(self, rgb):
+        time.sleep(self.delay)
+        return [self.points]
+
+
+def live_frames(count, fps):
+    """Frames paced like a camera"""
+    for _ in range(count):
+        time.sleep(1.0 / fps)
+        yield FRAME
+
+
+class CameraSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a shared two-person gallery"""
+        self.aditya = face(1)
+        self.gallery = Gallery(['Aditya', 'John'],
+                               [landmarks_to_embedding(self.aditya), landmarks_to_embedding(face(2))])
+        self.logged = []
+
+    def on_attendance(self, camera, name, confidence, timestamp):
+        self.logged.append((camera, name))
+
+    def test_recorded_feeds_are_processed_completely(self):
+        """Test that non-live feeds share the pool without dropping frames"""
+        scheduler = CameraScheduler(self.gallery, workers=2, on_attendance=self.on_attendance,
+                                    detector=SlowDetector(self.aditya, 0.001))
+        for i in range(3):
+            scheduler.add_camera(f'door-{i}', [FRAME] * 30)
+        metrics = scheduler.run()
+
+        for name in ('door-0', 'door-1', 'door-2'):
+            self.assertEqual(metrics[name]['frames_processed'], 30)
+            self.assertEqual(metrics[name]['frames_dropped'], 0)
+            self.assertEqual(metrics[name]['identifications'], 1)
+        # One rate limit across cameras
+        self.assertEqual(len(self.logged), 1)
+        self.assertEqual(self.logged[0][1], 'Aditya')
+
+    def test_overload_drops_frames_fairly(self):
+        """Test that a busy feed drops frames without starving a quiet one"""
+        scheduler = CameraScheduler(self.gallery, workers=1, target_latency=0.02,
+                                    detector=SlowDetector(self.aditya, 0.01))
+        scheduler.add_camera('busy', live_frames(100, 200), live=True)
+        scheduler.add_camera('quiet', live_frames(10, 20), live=True)
+        metrics = scheduler.run()
+
+        busy, quiet = metrics['busy'], metrics['quiet']
+        self.assertGreater(busy['frames_dropped'], 0)
+        self.assertEqual(busy['frames_processed'] + busy['frames_dropped'], busy['frames_read'])
+        self.assertGreaterEqual(quiet['frames_processed'], 8)
+        self.assertIn('p95', quiet['latency_ms'])
+        self.assertEqual(busy['backlog'], 0)
+
+    def test_errors_propagate(self):
+        """Test that a failing worker stops the scheduler and raises"""
+        def broken(rgb):
+            raise RuntimeError('detector crashed')
+
+        scheduler = CameraScheduler(self.gallery, workers=2, detector=broken)
+        scheduler.add_camera('door', [FRAME] * 10)
+        with self.assertRaises(RuntimeError):
+            scheduler.run()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import os
+import time
+import tempfile
+import shutil
+import numpy as np
+from utils.embedding_cache import EmbeddingCache
+
+CONFIG = {'face_mesh': {'refine_landmarks': True}, 'embedding_dim': 4, 'version': 1}
+
+class EmbeddingCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a cache directory and an image file"""
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+        self.image = os.path.join(self.test_dir, 'face.jpg')
+        with open(self.image, 'wb') as f:
+            f.write(b'pixels')
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def test_put_and_get(self):
+        """Test round-tripping embeddings and the no-face marker"""
+        cache = EmbeddingCache(self.cache_dir, CONFIG)
+        key = cache.key_for(self.image)
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, [1.0, 2.0, 3.0, 4.0])
+        np.testing.assert_array_equal(cache.get(key), [1.0, 2.0, 3.0, 4.0])
+
+        cache.put(key, None)
+        self.assertEqual(len(cache.get(key)), 0)
+
+    def test_key_follows_content_and_config(self):
+        """Test that keys change with file content or extractor config, not path"""
+        cache = EmbeddingCache(self.cache_dir, CONFIG)
+        key = cache.key_for(self.image)
+
+        copy = os.path.join(self.test_dir, 'renamed.jpg')
+        shutil.copy(self.image, copy)
+        self.assertEqual(cache.key_for(copy), key)
+
+        other = EmbeddingCache(self.cache_dir, dict(CONFIG, version=2))
+        self.assertNotEqual(other.key_for(self.image), key)
+
+        with open(self.image, 'wb') as f:
+            f.write(b'new pixels')
+        self.assertNotEqual(cache.key_for(self.image), key)
+
+    def test_stat_memo_skips_rehashing(self):
+        """Test that unchanged files are not read again after a save"""
+        cache = EmbeddingCache(self.cache_dir, CONFIG)
+        key = cache.key_for(self.image)
+        cache.save()
+
+        cache = EmbeddingCache(self.cache_dir, CONFIG)
+        os.chmod(self.image, 0)
+        try:
+            self.assertEqual(cache.key_for(self.image), key)
+        finally:
+            os.chmod(self.image, 0o644)
+
+    def test_person_signatures(self):
+        """Test detecting whether a person's images changed"""
+        cache = EmbeddingCache(self.cache_dir, CONFIG)
+        self.assertTrue(cache.person_changed('Aditya', ['a', 'b']))
+        cache.set_person('Aditya', ['a', 'b'])
+        cache.save(persons=['Aditya'])
+
+        cache = EmbeddingCache(self.cache_dir, CONFIG)
+        self.assertFalse(cache.person_changed('Aditya', ['b', 'a']))
+        self.assertTrue(cache.person_changed('Aditya', ['a', 'b', 'c']))
+
+    def test_evicts_least_recently_used(self):
+        """Test that eviction keeps the most recently used entries"""
+        cache = EmbeddingCache(self.cache_dir, CONFIG, max_entries=2)
+        for key in ('old', 'used', 'new'):
+            cache.put(key, [1.0])
+        # Give entries distinct ages, then touch 'old' so 'used' is least recent
+        now = time.time()
+        for age, key in enumerate(('new', 'used', 'old')):
+            path = cache._entry_path(key)
+            os.utime(path, (now - 10 * (age + 1), now - 10 * (age + 1)))
+        cache.get('old')
+
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get('used'))
+        self.assertIsNotNone(cache.get('old'))
+        self.assertIsNotNone(cache.get('new'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import json
+import os
+import re
+import shutil
+import subprocess
+from types import SimpleNamespace
+import numpy as np
+from utils.embedding_layout import (
+    KEYPOINTS, DERIVED_PAIRS, NUM_LANDMARKS, EMBEDDING_DIM, landmarks_to_array,
+    landmarks_to_embedding
+)
+
+SCRIPT_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_app', 'script.js')
+
+
+def reference_embedding(landmarks):
+    """The per-landmark loop get_embedding used before vectorization"""
+    raw = []
+    for lm in landmarks:
+        raw.extend([lm.x, lm.y, lm.z])
+    raw = np.array(raw, dtype=np.float32)
+
+    def dist(i1, i2):
+        p1 = landmarks[i1]
+        p2 = landmarks[i2]
+        return np.sqrt((p1.x - p2.x)**2 + (p1.y - p2.y)**2 + (p1.z - p2.z)**2)
+
+    derived = np.array([dist(KEYPOINTS[a], KEYPOINTS[b]) for a, b in DERIVED_PAIRS], dtype=np.float32)
+    raw_norm = np.linalg.norm(raw)
+    if raw_norm > 0:
+        raw = raw / raw_norm
+    der_norm = np.linalg.norm(derived)
+    if der_norm > 0:
+        derived = derived / der_norm
+    return np.concatenate((raw, derived))
+
+
+def fake_landmarks(seed):
+    """FaceMesh-like landmarks; coordinates are float32 values as in the protobuf"""
+    rng = np.random.default_rng(seed)
+    points = rng.random((NUM_LANDMARKS, 3)).astype(np.float32)
+    points[:, 2] -= 0.5
+    return [SimpleNamespace(x=float(x), y=float(y), z=float(z)) for x, y, z in points]
+
+
+class FakeLandmarkList:
+    """Stands in for mediapipe's NormalizedLandmarkList message"""
+
+    def __init__(self, landmarks):
+        self.landmark = landmarks
+
+
+class EmbeddingLayoutTestCase(unittest.TestCase):
+
+    def test_matches_reference_loop(self):
+        """Test the vectorized path against the original per-landmark loop"""
+        for seed in range(5):
+            landmarks = fake_landmarks(seed)
+            emb = landmarks_to_embedding(landmarks)
+            self.assertEqual(emb.dtype, np.float32)
+            self.assertEqual(emb.shape, (EMBEDDING_DIM,))
+            np.testing.assert_allclose(emb, reference_embedding(landmarks), rtol=1e-6, atol=1e-7)
+
+    def test_array_input_and_output_buffer(self):
+        """Test writing into a preallocated buffer from a (478, 3) array"""
+        landmarks = fake_landmarks(0)
+        points = np.array([[lm.x, lm.y, lm.z] for lm in landmarks], dtype=np.float32)
+        out = np.empty(EMBEDDING_DIM, dtype=np.float32)
+
+        result = landmarks_to_embedding(points, out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, landmarks_to_embedding(landmarks))
+
+    def test_landmark_list_message(self):
+        """Test that a landmark list message reads like its landmarks, whatever else they carry"""
+        landmarks = fake_landmarks(2)
+        expected = landmarks_to_array(landmarks)
+        landmarks[10].visibility = 0.5
+        landmarks[11].presence = 0.25
+        np.testing.assert_array_equal(landmarks_to_array(FakeLandmarkList(landmarks)), expected)
+
+    def test_rejects_wrong_landmark_count(self):
+        """Test that non-refined (468-point) landmarks are rejected"""
+        with self.assertRaises(ValueError):
+            landmarks_to_embedding(np.zeros((468, 3), dtype=np.float32))
+
+    @unittest.skipUnless(shutil.which('node'), 'node is not installed')
+    def test_matches_script_js(self):
+        """Test against extractEmbedding in web_app/script.js"""
+        with open(SCRIPT_JS, 'r') as f:
+            source = f.read()
+        function = re.search(r'^function extractEmbedding\(.*?^}$', source, re.S | re.M).group(0)
+
+        landmarks = fake_landmarks(1)
+        program = (
+            function
+            + '\nconst landmarks = ' + json.dumps([vars(lm) for lm in landmarks]) + ';'
+            + '\nprocess.stdout.write(JSON.stringify(Array.from(extractEmbedding(landmarks))));'
+        )
+        output = subprocess.run(['node', '-e', program], capture_output=True, text=True,
+                                check=True, timeout=30).stdout
+
+        expected = np.array(json.loads(output), dtype=np.float32)
+        np.testing.assert_allclose(landmarks_to_embedding(landmarks), expected, rtol=1e-6, atol=1e-7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import unittest
+import json
+import os
+import tempfile
+import shutil
+import numpy as np
+from utils import embedding_store
+from utils.embedding_store import EmbeddingStore
+from utils.gallery import Gallery
+
+DIM = 16
+
+class EmbeddingStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a temporary gallery directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.gallery_dir = os.path.join(self.test_dir, 'gallery')
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def vector(self):
+        return self.rng.standard_normal(DIM).astype(np.float32)
+
+    def test_put_and_get(self):
+        """Test that stored embeddings come back unit-length"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        vector = self.vector()
+        store.put('Aditya', vector)
+
+        np.testing.assert_allclose(store.get('Aditya'), vector / np.linalg.norm(vector), rtol=1e-6)
+        self.assertIsNone(store.get('John'))
+        self.assertEqual(store.names(), ['Aditya'])
+
+    def test_vectors_are_a_sorted_copy(self):
+        """Test that vectors() skips holes and does not change with later writes"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        for name in ['John', 'Aditya', 'Jane']:
+            store.put(name, self.vector())
+        store.delete('Jane')
+
+        version, names, matrix = store.vectors()
+        self.assertEqual(version, store.version)
+        self.assertEqual(names, ['Aditya', 'John'])
+        np.testing.assert_array_equal(matrix[1], store.get('John'))
+
+        store.put('John', self.vector())
+        self.assertFalse(np.array_equal(matrix[1], store.get('John')))
+
+    def test_changes_since_version(self):
+        """Test that changes() reports each name's net change since a version"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        store.put('Aditya', self.vector())
+        store.put('John', self.vector())
+        since = store.version
+
+        store.put('John', self.vector())
+        store.put('Jane', self.vector())
+        store.delete('Aditya')
+        store.put('Temp', self.vector())
+        store.delete('Temp')
+
+        version, delta = store.changes(since)
+        self.assertEqual(version, store.version)
+        self.assertEqual((delta['added'], delta['updated'], delta['removed']), (['Jane'], ['John'], ['Aditya']))
+        self.assertEqual(delta['names'], ['Jane', 'John'])
+        np.testing.assert_array_equal(delta['matrix'][1], store.get('John'))
+
+        # Visible to another process, and empty once caught up
+        other = EmbeddingStore(self.gallery_dir, dim=DIM)
+        self.assertEqual(other.changes(since)[1]['removed'], ['Aditya'])
+        self.assertEqual(other.changes(version)[1]['names'], [])
+        self.assertIsNone(other.changes(version + 1)[1])
+
+    def test_changes_fall_back_to_snapshot(self):
+        """Test that versions older than the trimmed change log need a snapshot"""
+        original = embedding_store.CHANGE_LOG_SIZE
+        embedding_store.CHANGE_LOG_SIZE = 3
+        self.addCleanup(setattr, embedding_store, 'CHANGE_LOG_SIZE', original)
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        for i in range(5):
+            store.put(f'Person{i}', self.vector())
+
+        self.assertIsNone(store.changes(1)[1])
+        self.assertEqual(store.changes(2)[1]['added'], ['Person2', 'Person3', 'Person4'])
+
+    def test_templates_occupy_consecutive_rows(self):
+        """Test storing several templates per person and resizing their block"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        store.put('Aditya', self.vector())
+        templates = self.rng.standard_normal((3, DIM)).astype(np.float32)
+        store.put('John', templates)
+        store.put('Jane', self.vector())
+
+        self.assertEqual(store.get('John').shape, (3, DIM))
+        version, row_names, matrix = store.snapshot()
+        self.assertEqual(row_names, ['Aditya', 'John', 'John', 'John', 'Jane'])
+        self.assertEqual(store.vectors()[1], ['Aditya', 'Jane', 'John', 'John', 'John'])
+
+        # A different template count moves the person to new rows
+        store.put('John', templates[:2])
+        self.assertEqual(store.snapshot()[1], ['Aditya', None, None, None, 'Jane', 'John', 'John'])
+        store.compact()
+        self.assertEqual(store.snapshot()[1], ['Aditya', 'Jane', 'John', 'John'])
+        np.testing.assert_allclose(store.get('John'),
+                                   templates[:2] / np.linalg.norm(templates[:2], axis=1, keepdims=True),
+                                   rtol=1e-6)
+        self.assertEqual(EmbeddingStore(self.gallery_dir, dim=DIM).get('John').shape, (2, DIM))
+
+    def test_reopen_and_grow(self):
+        """Test persistence across restarts, past the initial capacity"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        vectors = {f'Person{i}': self.vector() for i in range(embedding_store.MIN_CAPACITY + 5)}
+        for name, vector in vectors.items():
+            store.put(name, vector)
+
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        self.assertEqual(len(store), len(vectors))
+        for name, vector in vectors.items():
+            np.testing.assert_allclose(store.get(name), vector / np.linalg.norm(vector), rtol=1e-6)
+
+    def test_update_in_place(self):
+        """Test that re-saving a person overwrites their row"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        store.put('Aditya', self.vector())
+        row = store.entry('Aditya')['row']
+        vector = self.vector()
+        store.put('Aditya', vector)
+
+        self.assertEqual(store.entry('Aditya')['row'], row)
+        np.testing.assert_allclose(store.get('Aditya'), vector / np.linalg.norm(vector), rtol=1e-6)
+
+    def test_delete_leaves_hole_that_never_matches(self):
+        """Test that deleted people stop matching and rows are not reused"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        first, second = self.vector(), self.vector()
+        store.put('Aditya', first)
+        store.put('John', second)
+        before = Gallery.from_store(store)
+
+        self.assertTrue(store.delete('Aditya'))
+        self.assertFalse(store.delete('Aditya'))
+        store.put('Jane', self.vector())
+
+        gallery = Gallery.from_store(store)
+        self.assertEqual(len(gallery), 2)
+        self.assertNotIn('Aditya', [m[0] for m in gallery.identify(first, k=5)])
+        # A snapshot taken earlier still sees the old rows under the old names
+        self.assertEqual(before.identify(first)[0][0], 'Aditya')
+
+    def test_compaction(self):
+        """Test reclaiming holes without disturbing earlier snapshots"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        vectors = [self.vector() for _ in range(10)]
+        for i, vector in enumerate(vectors):
+            store.put(f'Person{i}', vector)
+        for i in range(0, 10, 2):
+            store.delete(f'Person{i}')
+        before = Gallery.from_store(store)
+
+        store.compact()
+
+        gallery = Gallery.from_store(store)
+        self.assertEqual(gallery.names, [f'Person{i}' for i in range(1, 10, 2)])
+        self.assertEqual(gallery.identify(vectors[3])[0][0], 'Person3')
+        self.assertEqual(before.identify(vectors[3])[0][0], 'Person3')
+        self.assertEqual(len([f for f in os.listdir(self.gallery_dir) if f.endswith('.f32')]), 1)
+
+    def test_gallery_maps_rows_without_copying(self):
+        """Test that the matcher scores the memory-mapped rows directly"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        store.put('Aditya', self.vector())
+        gallery = Gallery.from_store(store)
+        self.assertTrue(np.shares_memory(gallery.matrix, store.snapshot()[2]))
+        self.assertEqual(gallery.version, store.version)
+
+    def test_other_process_changes_are_visible(self):
+        """Test that two stores on one directory see each other's writes"""
+        first = EmbeddingStore(self.gallery_dir, dim=DIM)
+        second = EmbeddingStore(self.gallery_dir, dim=DIM)
+        vector = self.vector()
+
+        first.put('Aditya', vector)
+        self.assertIn('Aditya', second)
+        np.testing.assert_allclose(second.get('Aditya'), first.get('Aditya'))
+
+        second.put('John', self.vector())
+        second.delete('Aditya')
+        second.compact()
+        self.assertEqual(first.names(), ['John'])
+        self.assertEqual(first.version, second.version)
+
+    def test_import_json_dir(self):
+        """Test importing existing per-person JSON files"""
+        json_dir = os.path.join(self.test_dir, 'embeddings')
+        os.makedirs(json_dir)
+        for name, embedding in [('Aditya', self.vector().tolist()),
+                                ('John', self.vector().tolist()),
+                                ('Legacy', [0.1] * (DIM - 1))]:
+            with open(os.path.join(json_dir, f'{name}_embedding.json'), 'w') as f:
+                json.dump({'name': name, 'embedding': embedding}, f)
+
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        version = store.version
+        self.assertEqual(store.import_json_dir(json_dir), 2)
+        self.assertEqual(store.version, version + 1)
+        self.assertEqual(store.names(), ['Aditya', 'John'])
+        self.assertEqual(store.import_json_dir(json_dir), 0)
+
+    def test_put_many_writes_index_once(self):
+        """Test that a batch is one version and one index write, reported per name"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        store.put('Aditya', self.vector())
+        since = store.version
+        templates = np.stack([self.vector(), self.vector()])
+        writes = []
+        write_index = store._write_index
+        store._write_index = lambda: (writes.append(1), write_index())
+
+        # Enough people to grow the matrix in the middle of the batch
+        store.put_many([('Aditya', self.vector(), None), ('John', templates, '2024-01-01T00:00:00')] +
+                       [(f'Person{i}', self.vector(), None) for i in range(embedding_store.MIN_CAPACITY)])
+
+        self.assertEqual((store.version, len(writes)), (since + 1, 1))
+        version, delta = store.changes(since)
+        self.assertEqual(delta['updated'], ['Aditya'])
+        self.assertEqual(len(delta['added']), embedding_store.MIN_CAPACITY + 1)
+        self.assertEqual(store.entry('John')['saved_at'], '2024-01-01T00:00:00')
+        np.testing.assert_allclose(EmbeddingStore(self.gallery_dir, dim=DIM).get('John'),
+                                   templates / np.linalg.norm(templates, axis=1, keepdims=True), rtol=1e-6)
+
+        with self.assertRaises(ValueError):
+            store.put_many([('Jane', self.vector(), None), ('Bad', [0.1], None)])
+        self.assertNotIn('Jane', store)
+        self.assertEqual(store.version, since + 1)
+
+    def test_rejects_wrong_dimension(self):
+        """Test that embeddings in another layout are rejected"""
+        store = EmbeddingStore(self.gallery_dir, dim=DIM)
+        with self.assertRaises(ValueError):
+            store.put('Aditya', [0.1, 0.2])
+
+if __name__ == '__main__':
+    unittest.main()
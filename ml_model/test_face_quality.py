@@ -0,0 +1,115 @@
+import unittest
+import math
+import cv2
+import numpy as np
+from utils.embedding_layout import NUM_LANDMARKS, KEYPOINTS
+from utils.face_quality import QualityGate, FaceRejected, head_pose, face_box, checks
+
+SIZE = 256
+
+
+def landmarks(box=(0.25, 0.25, 0.75, 0.75), yaw=0.0, pitch=0.0, roll=0.0, seed=0):
+    """Flat face filling ``box`` (normalized), rotated by the given angles in degrees"""
+    x0, y0, x1, y1 = box
+    rng = np.random.default_rng(seed)
+    points = np.zeros((NUM_LANDMARKS, 3), dtype=np.float64)
+    points[:, 0] = rng.uniform(x0, x1, NUM_LANDMARKS)
+    points[:, 1] = rng.uniform(y0, y1, NUM_LANDMARKS)
+    width, height = x1 - x0, y1 - y0
+    points[KEYPOINTS['leftEye']] = (x0 + 0.2 * width, y0 + 0.35 * height, 0)
+    points[KEYPOINTS['rightEye']] = (x0 + 0.8 * width, y0 + 0.35 * height, 0)
+    points[KEYPOINTS['chin']] = (x0 + 0.5 * width, y1, 0)
+
+    center = np.array([(x0 + x1) / 2, (y0 + y1) / 2, 0])
+    a, b, c = (math.radians(v) for v in (yaw, pitch, roll))
+    about_y = np.array([[math.cos(a), 0, math.sin(a)], [0, 1, 0], [-math.sin(a), 0, math.cos(a)]])
+    about_x = np.array([[1, 0, 0], [0, math.cos(b), -math.sin(b)], [0, math.sin(b), math.cos(b)]])
+    about_z = np.array([[math.cos(c), -math.sin(c), 0], [math.sin(c), math.cos(c), 0], [0, 0, 1]])
+    rotated = (points - center) @ (about_z @ about_x @ about_y).T + center
+    return rotated.astype(np.float32)
+
+
+def checkerboard(value=(40, 200), tile=8):
+    """BGR image of a sharp checkerboard"""
+    y, x = np.indices((SIZE, SIZE)) // tile
+    gray = np.where((x + y) % 2, value[1], value[0]).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+class FaceQualityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = QualityGate(min_face_size=64, max_yaw=35, max_pitch=30, max_roll=30,
+                                min_brightness=40, max_brightness=220, min_sharpness=20)
+        self.image = checkerboard()
+
+    def test_head_pose(self):
+        """Test yaw, pitch and roll recovered from the eye corners and chin"""
+        np.testing.assert_allclose(head_pose(landmarks()), (0, 0, 0), atol=1e-3)
+        self.assertAlmostEqual(abs(head_pose(landmarks(yaw=40))[0]), 40, places=1)
+        self.assertAlmostEqual(abs(head_pose(landmarks(pitch=25))[1]), 25, places=1)
+        self.assertAlmostEqual(abs(head_pose(landmarks(roll=15))[2]), 15, places=1)
+        self.assertLess(abs(head_pose(landmarks(roll=15))[0]), 1e-3)
+
+    def test_face_box(self):
+        """Test the landmark box is in pixels and clipped to the image"""
+        self.assertEqual(face_box(landmarks(), SIZE, SIZE), (64, 64, 192, 192))
+        x0, _, _, y1 = face_box(landmarks((-0.2, 0.5, 0.3, 1.2)), SIZE, SIZE)
+        self.assertEqual((x0, y1), (0, SIZE))
+
+    def test_good_face_passes(self):
+        """Test that a large, frontal, well lit and sharp face passes"""
+        self.assertIsNone(self.gate.check(self.image, landmarks()))
+        self.gate.require(self.image, landmarks())
+
+    def test_rejection_reasons(self):
+        """Test each check with only its own condition failing"""
+        small = landmarks((0.4, 0.4, 0.6, 0.6))
+        self.assertEqual(self.gate.check(self.image, small), 'too_small')
+        self.assertEqual(self.gate.check(self.image, landmarks(yaw=50)), 'off_pose')
+        self.assertEqual(self.gate.check(self.image, landmarks(pitch=-45)), 'off_pose')
+        self.assertEqual(self.gate.check(self.image, landmarks(roll=40)), 'off_pose')
+        self.assertEqual(self.gate.check(checkerboard((0, 30)), landmarks()), 'too_dark')
+        self.assertEqual(self.gate.check(checkerboard((230, 255)), landmarks()), 'too_bright')
+        blurred = cv2.GaussianBlur(self.image, (0, 0), 8)
+        self.assertEqual(self.gate.check(blurred, landmarks()), 'blurry')
+
+        with self.assertRaises(FaceRejected) as raised:
+            self.gate.require(blurred, landmarks())
+        self.assertEqual(raised.exception.reason, 'blurry')
+        self.assertIsInstance(raised.exception, ValueError)
+
+    def test_sharpness_ignores_face_size(self):
+        """Test that the same texture measures alike on faces of different sizes"""
+        big = self.gate.measure(checkerboard(tile=16), landmarks((0.0, 0.0, 1.0, 1.0)))
+        small = self.gate.measure(checkerboard(tile=8), landmarks((0.25, 0.25, 0.75, 0.75)))
+        self.assertAlmostEqual(big['sharpness'] / small['sharpness'], 1.0, delta=0.2)
+
+    def test_disabled_checks(self):
+        """Test that thresholds of None turn their checks off"""
+        gate = QualityGate(None, None, None, None, None, None, None)
+        blurred = cv2.GaussianBlur(checkerboard((0, 20)), (0, 0), 8)
+        self.assertIsNone(gate.check(blurred, landmarks((0.45, 0.45, 0.55, 0.55), yaw=60)))
+        # An empty box is never a usable face
+        self.assertEqual(gate.check(self.image, landmarks((1.1, 1.1, 1.3, 1.3))), 'too_small')
+
+    def test_rgb_order(self):
+        """Test that the channel order of color images is honored"""
+        image = np.zeros((SIZE, SIZE, 3), dtype=np.uint8)
+        image[..., 0] = 255
+        bgr = self.gate.measure(image, landmarks())['brightness']
+        rgb = self.gate.measure(image, landmarks(), order='rgb')['brightness']
+        self.assertAlmostEqual(bgr, 255 * 0.114, delta=1)
+        self.assertAlmostEqual(rgb, 255 * 0.299, delta=1)
+
+    def test_results_counted(self):
+        """Test that every check is counted by result"""
+        ok, blurry = checks.value('ok'), checks.value('blurry')
+        self.gate.check(self.image, landmarks())
+        self.gate.check(cv2.GaussianBlur(self.image, (0, 0), 8), landmarks())
+        self.assertEqual(checks.value('ok'), ok + 1)
+        self.assertEqual(checks.value('blurry'), blurry + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import json
+import os
+import tempfile
+import shutil
+import numpy as np
+from utils.cosine_similarity import cosine_similarity
+from utils.embedding_layout import EMBEDDING_DIM
+from utils import gallery as gallery_module
+from utils.gallery import Gallery, cluster_templates
+
+class GalleryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Build a random gallery"""
+        self.rng = np.random.default_rng(0)
+        self.names = [f'Person{i}' for i in range(50)]
+        self.rows = self.rng.standard_normal((50, EMBEDDING_DIM)).astype(np.float32)
+        self.gallery = Gallery(self.names, self.rows)
+
+    def test_matrix_is_contiguous_normalized_float32(self):
+        """Test the gallery layout used for the single matrix product"""
+        self.assertEqual(self.gallery.matrix.dtype, np.float32)
+        self.assertTrue(self.gallery.matrix.flags['C_CONTIGUOUS'])
+        np.testing.assert_allclose(np.linalg.norm(self.gallery.matrix, axis=1), 1.0, rtol=1e-5)
+
+    def test_identify_matches_cosine_similarity(self):
+        """Test top-k against the per-pair cosine_similarity baseline"""
+        query = self.rows[7] + 0.1 * self.rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+
+        expected = sorted(
+            ((name, cosine_similarity(query, row)) for name, row in zip(self.names, self.rows)),
+            key=lambda x: -x[1]
+        )[:3]
+        matches = self.gallery.identify(query, k=3)
+
+        self.assertEqual([m[0] for m in matches], [e[0] for e in expected])
+        for (_, score), (_, expected_score) in zip(matches, expected):
+            self.assertAlmostEqual(score, expected_score, places=5)
+        self.assertEqual(matches[0][0], 'Person7')
+
+    def test_identify_k_larger_than_gallery(self):
+        """Test asking for more matches than enrolled people"""
+        matches = Gallery(self.names[:2], self.rows[:2]).identify(self.rows[1], k=5)
+        self.assertEqual([m[0] for m in matches], ['Person1', 'Person0'])
+
+    def test_identify_empty_gallery(self):
+        """Test matching against an empty gallery"""
+        self.assertEqual(Gallery([], []).identify(self.rows[0], k=3), [])
+
+    def test_identify_wrong_dimension(self):
+        """Test that embeddings with another layout are rejected"""
+        with self.assertRaises(ValueError):
+            self.gallery.identify([0.1, 0.2, 0.3])
+
+    def test_identify_batch_matches_single_queries(self):
+        """Test that a batch gives the same answers as one query at a time"""
+        queries = self.rows[[3, 9, 3]] + 0.2 * self.rng.standard_normal((3, EMBEDDING_DIM)).astype(np.float32)
+
+        batch = self.gallery.identify_batch(queries, k=4)
+
+        self.assertEqual(len(batch), 3)
+        for query, matches in zip(queries, batch):
+            single = self.gallery.identify(query, k=4)
+            self.assertEqual([m[0] for m in matches], [m[0] for m in single])
+            np.testing.assert_allclose([m[1] for m in matches], [m[1] for m in single], rtol=1e-5)
+        self.assertEqual([m[0][0] for m in batch], ['Person3', 'Person9', 'Person3'])
+
+    def test_identify_batch_chunks(self):
+        """Test batches larger than one matrix product chunk"""
+        original = gallery_module.QUERY_CHUNK_SIZE
+        gallery_module.QUERY_CHUNK_SIZE = 7
+        self.addCleanup(setattr, gallery_module, 'QUERY_CHUNK_SIZE', original)
+
+        batch = self.gallery.identify_batch(self.rows, k=1)
+
+        self.assertEqual([m[0][0] for m in batch], self.names)
+
+    def test_identify_batch_wrong_shape(self):
+        """Test that a batch with the wrong width is rejected"""
+        with self.assertRaises(ValueError):
+            self.gallery.identify_batch(np.zeros((2, 5)))
+
+    def test_cluster_templates(self):
+        """Test that templates are unit-length cluster centers, or the rows themselves when few"""
+        looks = self.rng.standard_normal((3, EMBEDDING_DIM))
+        rows = np.repeat(looks, 10, axis=0) + 0.01 * self.rng.standard_normal((30, EMBEDDING_DIM))
+        templates = cluster_templates(rows, 3)
+        self.assertEqual(templates.shape, (3, EMBEDDING_DIM))
+        np.testing.assert_allclose(np.linalg.norm(templates, axis=1), 1.0, rtol=1e-5)
+        best = (templates @ (looks / np.linalg.norm(looks, axis=1, keepdims=True)).T).max(axis=0)
+        self.assertTrue(np.all(best > 0.99))
+        self.assertEqual(cluster_templates(rows[:2], 3).shape, (2, EMBEDDING_DIM))
+
+    def test_templates_score_best_or_top_mean(self):
+        """Test segmented max and top-mean over a person's template rows"""
+        people = ['Aditya'] * 3 + [None] + ['John'] * 2 + ['Jane']
+        rows = self.rng.standard_normal((len(people), EMBEDDING_DIM)).astype(np.float32)
+        queries = self.rng.standard_normal((5, EMBEDDING_DIM)).astype(np.float32)
+        queries[0] = rows[1]
+
+        def cosines(query, indices):
+            return sorted((cosine_similarity(query, rows[i]) for i in indices), reverse=True)
+
+        segments = {'Aditya': [0, 1, 2], 'John': [4, 5], 'Jane': [6]}
+        for top in (1, 2):
+            gallery = Gallery(people, rows, template_top=top)
+            self.assertEqual(len(gallery), 3)
+            results = gallery.identify_batch(queries, k=3)
+            for query, result in zip(queries, results):
+                expected = {name: np.mean(cosines(query, idx)[:top]) for name, idx in segments.items()}
+                self.assertEqual(dict(result).keys(), expected.keys())
+                for name, score in result:
+                    self.assertAlmostEqual(score, expected[name], places=5)
+                self.assertEqual([n for n, _ in result], sorted(expected, key=expected.get, reverse=True))
+        self.assertEqual(Gallery(people, rows).identify(queries[0])[0][0], 'Aditya')
+
+        with self.assertRaises(ValueError):
+            Gallery(['Aditya', 'John', 'Aditya'], rows[:3])
+
+    def test_templates_with_index(self):
+        """Test that index hits are collapsed to one result per person"""
+        from utils.ann_index import ExactIndex
+        people = ['Aditya'] * 3 + ['John'] * 2 + ['Jane']
+        rows = self.rng.standard_normal((len(people), EMBEDDING_DIM)).astype(np.float32)
+        gallery = Gallery(people, rows)
+        expected = gallery.identify_batch(rows, k=2)
+        gallery.index = ExactIndex(gallery.matrix)
+        for got, want in zip(gallery.identify_batch(rows, k=2), expected):
+            self.assertEqual([n for n, _ in got], [n for n, _ in want])
+            np.testing.assert_allclose([s for _, s in got], [s for _, s in want], rtol=1e-5)
+
+    def test_from_dir_skips_incompatible_files(self):
+        """Test loading a directory of per-person JSON files"""
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        for name, embedding in [('Aditya', self.rows[0].tolist()),
+                                ('John', self.rows[1].tolist()),
+                                ('Legacy', [0.1] * 1434)]:
+            with open(os.path.join(test_dir, f'{name}_embedding.json'), 'w') as f:
+                json.dump({'name': name, 'embedding': embedding}, f)
+        with open(os.path.join(test_dir, 'Broken_embedding.json'), 'w') as f:
+            f.write('{not json')
+
+        gallery = Gallery.from_dir(test_dir)
+
+        self.assertEqual(gallery.names, ['Aditya', 'John'])
+        self.assertEqual(gallery.identify(self.rows[1])[0][0], 'John')
+
+if __name__ == '__main__':
+    unittest.main()
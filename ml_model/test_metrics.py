@@ -0,0 +1,87 @@
+import unittest
+import threading
+import time
+from utils.metrics import Registry, SamplingProfiler
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create an empty registry"""
+        self.registry = Registry()
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that observations land in every bucket whose bound they do not exceed"""
+        histogram = self.registry.histogram('latency_seconds', 'Latency', labels=('stage',),
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, 'load')
+        with histogram.time('save'):
+            pass
+
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[:2], ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram'])
+        self.assertIn('latency_seconds_bucket{stage="load",le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{stage="load",le="1.0"} 3', lines)
+        self.assertIn('latency_seconds_bucket{stage="load",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum{stage="load"} 2.65', lines)
+        self.assertIn('latency_seconds_count{stage="load"} 4', lines)
+        self.assertEqual(histogram.count('save'), 1)
+
+    def test_counter_and_gauges(self):
+        """Test label escaping, and that failing or empty gauges are omitted"""
+        counter = self.registry.counter('requests_total', 'Requests', labels=('route',))
+        counter.inc('/a"b')
+        counter.inc('/a"b', amount=2)
+        self.registry.gauge('size_bytes', 'Size', lambda: 42)
+        self.registry.gauge('missing', 'Missing', lambda: None)
+        self.registry.gauge('broken', 'Broken', lambda: 1 / 0)
+
+        text = self.registry.render()
+        self.assertIn('requests_total{route="/a\\"b"} 3\n', text)
+        self.assertIn('size_bytes 42\n', text)
+        self.assertNotIn('\nmissing ', text)
+        self.assertNotIn('\nbroken ', text)
+
+    def test_register_twice_keeps_metric(self):
+        """Test that registering a metric name again returns the existing one"""
+        first = self.registry.counter('requests_total', 'Requests')
+        first.inc()
+        self.assertIs(self.registry.counter('requests_total', 'Requests'), first)
+
+
+class SamplingProfilerTestCase(unittest.TestCase):
+
+    def test_samples_other_threads(self):
+        """Test that a busy thread's function shows up in the collapsed stacks"""
+        stop = threading.Event()
+
+        def busy_loop():
+            while not stop.is_set():
+                sum(range(1000))
+
+        worker = threading.Thread(target=busy_loop)
+        worker.start()
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        try:
+            deadline = time.time() + 5
+            while profiler.samples < 20 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            profiler.stop()
+            stop.set()
+            worker.join()
+
+        self.assertFalse(profiler.running)
+        self.assertGreaterEqual(profiler.samples, 20)
+        self.assertIn('busy_loop', profiler.collapsed())
+        for line in profiler.collapsed(limit=3).splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+        profiler.reset()
+        self.assertEqual(profiler.collapsed(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
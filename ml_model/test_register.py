@@ -0,0 +1,152 @@
+import unittest
+import os
+import tempfile
+import shutil
+from functools import partial
+from unittest import mock
+import numpy as np
+import register
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_store import EmbeddingStore
+
+# Paths passed to fake_embed and fake_init calls in this process
+embedded = []
+initialized = []
+
+
+def fake_init():
+    """Stand-in for the FaceMesh worker initializer"""
+    initialized.append(True)
+
+
+def fake_embed(path):
+    """Read a stored vector instead of running FaceMesh"""
+    embedded.append(path)
+    if not path.endswith('.npy'):
+        return None
+    return np.load(path)
+
+
+class RegisterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create data/<person>/ folders of stored vectors"""
+        self.test_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.vectors = {}
+        for person, count in [('Aditya', 5), ('John', 3), ('Jane', 0)]:
+            folder = os.path.join(self.test_dir, person)
+            os.makedirs(folder)
+            self.vectors[person] = rng.standard_normal((count, 8)).astype(np.float32)
+            for i, vector in enumerate(self.vectors[person]):
+                np.save(os.path.join(folder, f'{i}.npy'), vector)
+            # Images without a detectable face are skipped
+            with open(os.path.join(folder, 'blurry.jpg'), 'w') as f:
+                f.write('x')
+            with open(os.path.join(folder, '.DS_Store'), 'w') as f:
+                f.write('x')
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def check(self, workers):
+        results = {person: (emb, count) for person, emb, count in
+                   register.enroll(self.test_dir, workers=workers,
+                                   initializer=fake_init, embed=fake_embed)}
+
+        self.assertEqual(set(results), {'Aditya', 'John', 'Jane'})
+        self.assertEqual(results['Jane'], (None, 0))
+        for person in ('Aditya', 'John'):
+            emb, count = results[person]
+            expected = self.vectors[person].mean(axis=0)
+            self.assertEqual(count, len(self.vectors[person]))
+            np.testing.assert_allclose(emb, expected / np.linalg.norm(expected), rtol=1e-5)
+
+    def test_enroll_in_process(self):
+        """Test per-person means with a single worker"""
+        self.check(workers=1)
+
+    def test_enroll_process_pool(self):
+        """Test per-person means aggregated from a process pool"""
+        self.check(workers=2)
+
+    def test_enroll_incremental(self):
+        """Test that a re-run only extracts new images and affected people"""
+        cache_dir = os.path.join(self.test_dir, '.cache')
+        enroll = lambda: list(register.enroll(self.test_dir, workers=1, initializer=fake_init,
+                                              embed=fake_embed, cache=cache))
+
+        cache = EmbeddingCache(cache_dir, {'version': 1})
+        del embedded[:]
+        self.assertEqual(len(enroll()), 3)
+        # Identical files are extracted once
+        self.assertEqual(len(embedded), 9)
+        cache.save()
+
+        extra = np.ones(8, dtype=np.float32)
+        np.save(os.path.join(self.test_dir, 'John', 'new.npy'), extra)
+        cache = EmbeddingCache(cache_dir, {'version': 1})
+        del embedded[:]
+        results = enroll()
+
+        self.assertEqual([r[0] for r in results], ['John'])
+        self.assertEqual(embedded, [os.path.join(self.test_dir, 'John', 'new.npy')])
+        expected = np.vstack([self.vectors['John'], extra]).mean(axis=0)
+        np.testing.assert_allclose(results[0][1], expected / np.linalg.norm(expected), rtol=1e-5)
+        self.assertEqual(cache.hits, 4)
+        cache.save()
+
+        # Nothing new: no image is extracted, so no FaceMesh is built either
+        cache = EmbeddingCache(cache_dir, {'version': 1})
+        del initialized[:]
+        self.assertEqual(enroll(), [])
+        self.assertEqual(initialized, [])
+
+    def test_gallery_dir_after_cached_run(self):
+        """Test that --gallery-dir enrolls people an earlier run already cached"""
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir)
+        gallery_dir = os.path.join(out_dir, 'gallery')
+        fake_enroll = partial(register.enroll, initializer=fake_init, embed=fake_embed)
+        small_store = partial(EmbeddingStore, dim=8)
+
+        def run(*extra):
+            with mock.patch.object(register, 'enroll', fake_enroll), \
+                    mock.patch('utils.embedding_store.EmbeddingStore', small_store):
+                register.main(['--workers', '1', '--data-dir', self.test_dir,
+                               '--output-dir', os.path.join(out_dir, 'output'),
+                               '--cache-dir', os.path.join(out_dir, 'cache'), *extra])
+
+        run()
+        del embedded[:]
+        run('--gallery-dir', gallery_dir)
+
+        self.assertEqual(small_store(gallery_dir).names(), ['Aditya', 'John'])
+        # Everyone came from the cache
+        self.assertEqual([path for path in embedded if path.endswith('.npy')], [])
+
+    def test_enroll_templates(self):
+        """Test that --templates clusters each person's embeddings"""
+        folder = os.path.join(self.test_dir, 'Multi')
+        os.makedirs(folder)
+        # Two distinct looks: five noisy copies of each
+        rng = np.random.default_rng(1)
+        looks = rng.standard_normal((2, 8)).astype(np.float32)
+        for i in range(10):
+            np.save(os.path.join(folder, f'look{i}.npy'), looks[i % 2] + 0.01 * rng.standard_normal(8))
+
+        results = {person: (emb, count) for person, emb, count in
+                   register.enroll(self.test_dir, workers=1, initializer=fake_init,
+                                   embed=fake_embed, templates=3)}
+
+        templates, count = results['Multi']
+        self.assertEqual((templates.shape, count), ((3, 8), 10))
+        np.testing.assert_allclose(np.linalg.norm(templates, axis=1), 1.0, rtol=1e-5)
+        for look in looks:
+            self.assertGreater((templates @ (look / np.linalg.norm(look))).max(), 0.99)
+        self.assertEqual(results['Aditya'][0].shape, (3, 8))
+        self.assertEqual(results['Jane'], (None, 0))
+
+if __name__ == '__main__':
+    unittest.main()
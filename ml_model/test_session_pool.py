@@ -0,0 +1,62 @@
+import unittest
+import threading
+from utils.session_pool import SessionPool
+
+
+class FakeSession:
+    """Stands in for a FaceMesh graph"""
+
+    def __init__(self, **options):
+        self.options = options
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def factory(**options):
+            session = FakeSession(**options)
+            self.created.append(session)
+            return session
+
+        self.pool = SessionPool(factory)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_reuses_session_per_thread(self):
+        """Test that repeated calls share one session"""
+        first = self.pool.get(max_num_faces=1)
+        self.assertIs(self.pool.get(max_num_faces=1), first)
+        self.assertIsNot(self.pool.get(max_num_faces=4), first)
+        self.assertEqual(len(self.created), 2)
+
+    def test_one_session_per_thread(self):
+        """Test that threads never share a session"""
+        main = self.pool.get()
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(self.pool.get()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(seen[0], main)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_close_all(self):
+        """Test that shutdown closes sessions and later calls rebuild them"""
+        first = self.pool.get()
+        self.pool.close_all()
+
+        self.assertTrue(first.closed)
+        self.assertEqual(len(self.pool), 0)
+        second = self.pool.get()
+        self.assertIsNot(second, first)
+        self.assertFalse(second.closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter: report heavy modules loaded and directories created by the imports
+PROBE = '''
+import json, os, sys
+created = []
+os.makedirs = lambda *args, **kwargs: created.append(args[0])
+for module in sys.argv[1:]:
+    __import__(module)
+print(json.dumps({"heavy": sorted(m for m in ("cv2", "mediapipe") if m in sys.modules),
+                  "created": created}))
+'''
+
+
+def probe(*modules):
+    output = subprocess.run([sys.executable, '-c', PROBE, *modules], cwd=HERE, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+class ColdStartTestCase(unittest.TestCase):
+
+    def test_app_import_is_light(self):
+        """Test that importing the API loads neither cv2 nor mediapipe and creates no directories"""
+        self.assertEqual(probe('config', 'app'), {'heavy': [], 'created': []})
+
+    def test_cli_imports_are_light(self):
+        """Test that register and the extractor's configuration import without cv2 or mediapipe"""
+        result = probe('register', 'utils.extract_embedding', 'utils.detect_face', 'utils.camera_scheduler')
+        self.assertEqual(result['heavy'], [])
+
+if __name__ == '__main__':
+    unittest.main()
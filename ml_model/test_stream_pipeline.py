@@ -0,0 +1,189 @@
+import unittest
+import os
+import tempfile
+import shutil
+import time
+import cv2
+import numpy as np
+from unittest import mock
+from utils import stream_pipeline
+from utils.embedding_layout import NUM_LANDMARKS, landmarks_to_embedding
+from utils.gallery import Gallery
+from utils.attendance_aggregator import AttendanceAggregator
+from utils.attendance_store import AttendanceStore
+from utils.stream_pipeline import StreamPipeline, IoUTracker, iou_matrix, store_logger
+
+
+def face(seed, offset=(0.0, 0.0)):
+    """Random landmarks inside a box, shifted by ``offset``"""
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0.3, 0.5, (NUM_LANDMARKS, 3)).astype(np.float32)
+    points[:, 0] += offset[0]
+    points[:, 1] += offset[1]
+    return points
+
+
+class FakeDetector:
+    """Returns scripted faces, one list per frame"""
+
+    def __init__(self, script, delay=0.0):
+        self.script = script
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, rgb):
+        if self.delay:
+            time.sleep(self.delay)
+        faces = self.script(self.calls)
+        self.calls += 1
+        return faces
+
+
+class StreamPipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a two-person gallery and a temporary directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.aditya = face(1)
+        self.john = face(2)[::-1].copy()
+        self.gallery = Gallery(['Aditya', 'John'],
+                               [landmarks_to_embedding(self.aditya), landmarks_to_embedding(self.john)])
+        self.logged = []
+
+    def tearDown(self):
+        """Clean up temporary directory"""
+        shutil.rmtree(self.test_dir)
+
+    def on_attendance(self, name, confidence, timestamp):
+        self.logged.append(name)
+
+    def write_video(self, frames):
+        path = os.path.join(self.test_dir, 'door.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+        for i in range(frames):
+            writer.write(np.full((48, 64, 3), i % 255, dtype=np.uint8))
+        writer.release()
+        return path
+
+    def test_store_logger_merges_sightings(self):
+        """Test that logged sightings go through the aggregator, one record per visit"""
+        store = AttendanceStore(os.path.join(self.test_dir, 'attendance.jsonl'))
+        self.addCleanup(store.close)
+        aggregator = AttendanceAggregator(store, window=60, flush_interval=3600)
+        self.addCleanup(aggregator.close)
+        log = store_logger(aggregator)
+
+        start = time.time()
+        for i in range(5):
+            log('Aditya', np.float32(0.8 + i / 100), start + i)
+        log('Aditya', 0.9, start + 600)
+        aggregator.flush()
+
+        records, _ = store.query()
+        self.assertEqual([r['sightings'] for r in records], [1, 5])
+        self.assertEqual(records[1]['confidence'], 0.84)
+
+    def test_iou_tracker(self):
+        """Test that overlapping boxes keep their track and new faces get new ones"""
+        tracker = IoUTracker(max_missed=1)
+        first = tracker.update(np.array([[0.1, 0.1, 0.3, 0.3]]), 0.0)
+        second = tracker.update(np.array([[0.12, 0.1, 0.32, 0.3], [0.6, 0.6, 0.8, 0.8]]), 0.1)
+
+        self.assertIs(second[0], first[0])
+        self.assertNotEqual(second[1].id, first[0].id)
+        tracker.update(np.zeros((0, 4)), 0.2)
+        tracker.update(np.zeros((0, 4)), 0.3)
+        self.assertEqual(tracker.tracks, [])
+        np.testing.assert_allclose(iou_matrix(np.array([[0, 0, 1, 1.]]), np.array([[0, 0, 1, 0.5]])), [[0.5]])
+
+    def test_video_file_identifies_track_once(self):
+        """Test that a steady face is identified and logged once, no frames dropped"""
+        path = self.write_video(30)
+        rng = np.random.default_rng(0)
+        detector = FakeDetector(lambda i: [self.aditya + rng.normal(0, 1e-4, self.aditya.shape).astype(np.float32)])
+
+        stats = StreamPipeline(path, self.gallery, detector=detector,
+                               on_attendance=self.on_attendance).run()
+
+        self.assertEqual(stats['frames_read'], 30)
+        self.assertEqual(stats['frames_processed'], 30)
+        self.assertEqual(stats['frames_dropped'], 0)
+        self.assertEqual(stats['identifications'], 1)
+        self.assertEqual(self.logged, ['Aditya'])
+
+    def test_owned_detector_is_closed(self):
+        """Test that a pipeline without a detector opens one with max_num_faces and closes it"""
+        opened = []
+
+        class OwnedDetector(FakeDetector):
+            def __init__(self, max_num_faces):
+                super().__init__(lambda i: [])
+                self.max_num_faces = max_num_faces
+                self.closed = False
+                opened.append(self)
+
+            def close(self):
+                self.closed = True
+
+        with mock.patch.object(stream_pipeline, 'FaceMeshDetector', OwnedDetector):
+            pipeline = StreamPipeline(self.write_video(5), self.gallery, max_num_faces=3)
+            pipeline.run()
+
+        self.assertEqual([(d.max_num_faces, d.closed, d.calls) for d in opened], [(3, True, 5)])
+        self.assertIsNone(pipeline.detector)
+
+    def test_drift_triggers_reidentification(self):
+        """Test that a different face inside the same track is identified again"""
+        detector = FakeDetector(lambda i: [self.aditya if i < 10 else self.john])
+        frames = [np.zeros((48, 64, 3), dtype=np.uint8)] * 20
+        pipeline = StreamPipeline(frames, self.gallery, detector=detector, live=False,
+                                  on_attendance=self.on_attendance, drift_similarity=0.999)
+        stats = pipeline.run()
+
+        self.assertEqual(stats['identifications'], 2)
+        self.assertEqual(self.logged, ['Aditya', 'John'])
+
+    def test_frame_stride(self):
+        """Test processing every Nth frame"""
+        path = self.write_video(30)
+        detector = FakeDetector(lambda i: [])
+        stats = StreamPipeline(path, self.gallery, detector=detector, frame_stride=3).run()
+        self.assertEqual(stats['frames_processed'], 10)
+
+    def test_live_source_drops_frames_under_load(self):
+        """Test that a slow detector makes a live source drop, not queue, frames"""
+        frames = [np.zeros((48, 64, 3), dtype=np.uint8)] * 60
+        detector = FakeDetector(lambda i: [self.aditya], delay=0.005)
+        stats = StreamPipeline(frames, self.gallery, detector=detector, live=True, queue_size=2).run()
+
+        self.assertGreater(stats['frames_dropped'], 0)
+        self.assertEqual(stats['frames_processed'] + stats['frames_dropped'], 60)
+
+    def test_stage_errors_propagate(self):
+        """Test that a failing stage stops the pipeline and raises"""
+        def broken(i):
+            raise RuntimeError('detector crashed')
+
+        frames = [np.zeros((48, 64, 3), dtype=np.uint8)] * 50
+        pipeline = StreamPipeline(frames, self.gallery, detector=FakeDetector(broken), live=False)
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+    def test_quality_gate_drops_faces(self):
+        """Test that faces failing the quality gate are neither tracked nor identified"""
+        class SizeGate:
+            def check(self, image, points, order='bgr'):
+                return 'too_small' if np.ptp(points[:, 0]) < 0.15 else None
+
+        small = (self.john - self.john.mean(axis=0)) * 0.5 + self.john.mean(axis=0)
+        detector = FakeDetector(lambda i: [self.aditya, small])
+        frames = [np.zeros((48, 64, 3), dtype=np.uint8)] * 10
+        stats = StreamPipeline(frames, self.gallery, detector=detector, live=False,
+                               on_attendance=self.on_attendance, quality_gate=SizeGate()).run()
+
+        self.assertEqual(stats['rejected'], 10)
+        self.assertEqual(stats['faces'], 10)
+        self.assertEqual(self.logged, ['Aditya'])
+
+if __name__ == '__main__':
+    unittest.main()
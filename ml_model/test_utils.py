@@ -125,6 +125,18 @@ class EmbeddingExtractionTestCase(unittest.TestCase):
         
         # Should be identical
         np.testing.assert_array_almost_equal(emb1, emb2)
+    
+    def test_decode_image_in_memory(self):
+        """Test that encoded image bytes decode without touching the filesystem"""
+        import cv2
+        from utils.extract_embedding import decode_image
+        
+        image = np.random.default_rng(0).integers(0, 256, (24, 32, 3), dtype=np.uint8)
+        ok, encoded = cv2.imencode('.png', image)
+        self.assertTrue(ok)
+        np.testing.assert_array_equal(decode_image(encoded.tobytes()), image)
+        with self.assertRaises(ValueError):
+            decode_image(b'not an image')
 
 class DuplicatePreventionTestCase(unittest.TestCase):
     
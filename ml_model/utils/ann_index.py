@@ -0,0 +1,328 @@
+"""
+Approximate nearest-neighbour search for large galleries.
+
+IVFIndex clusters the normalized gallery rows with spherical k-means and
+stores them grouped by cluster. A query is scored against the centroids
+first and then only against the rows of its ``nprobe`` closest clusters, so
+the cost per query drops from O(N) to about O(nprobe * N / nlist). Raising
+``nprobe`` trades latency for recall; ``nprobe == nlist`` is exact.
+
+update() returns a new index with some rows dropped and others assigned to
+their nearest existing centroid, sharing every list it did not touch, so
+enrolling or deleting a person does not re-run k-means. The clusters drift
+as the gallery grows; callers re-build now and then (see LiveGallery).
+
+ExactIndex is the brute-force baseline with the same interface, and
+recall_report compares the two.
+
+Usage:
+    python -m utils.ann_index --size 50000 --queries 200
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from utils.gallery import normalize_rows
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+# Rows per cluster used to train the centroids
+TRAIN_ROWS_PER_LIST = 32
+
+
+def _cluster_sums(rows, assign, nlist):
+    """Per-cluster sums of rows and cluster sizes"""
+    order = np.argsort(assign, kind='stable')
+    counts = np.bincount(assign, minlength=nlist)
+    sums = np.zeros((nlist, rows.shape[1]), dtype=np.float32)
+    nonempty = np.nonzero(counts)[0]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+    sums[nonempty] = np.add.reduceat(rows[order], starts, axis=0)
+    return sums, counts
+
+
+def _select_top(scores, ids, k):
+    """Best ``k`` (ids, scores) from candidate arrays, best first"""
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[top], ids[top]
+    order = np.argsort(-scores, kind='stable')
+    return ids[order], scores[order]
+
+
+def spherical_kmeans(rows, k, iterations=KMEANS_ITERATIONS, rng=None):
+    """Unit-length centroids of ``k`` clusters of unit-length ``rows`` by cosine similarity"""
+    rng = rng if rng is not None else np.random.default_rng(0)
+    centroids = rows[rng.choice(len(rows), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = np.argmax(rows @ centroids.T, axis=1)
+        sums, counts = _cluster_sums(rows, assign, k)
+        # Re-seed empty clusters with random rows
+        empty = counts == 0
+        sums[empty] = rows[rng.choice(len(rows), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class ExactIndex:
+    """Brute-force search over every row (the exact baseline)"""
+
+    def __init__(self, matrix):
+        self.matrix = normalize_rows(matrix)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def search(self, queries, k):
+        """Return lists of (ids, scores) arrays per query, best first"""
+        scores = normalize_rows(queries) @ self.matrix.T
+        ids = np.arange(len(self.matrix))
+        return [_select_top(row, ids, k) for row in scores]
+
+
+class IVFIndex:
+    """Inverted-file index over spherical k-means clusters"""
+
+    def __init__(self, centroids, vectors, ids, offsets, nprobe=DEFAULT_NPROBE):
+        # One (ids, vectors) pair per list; views into the arrays passed in
+        bounds = offsets[1:-1]
+        self._init(centroids, np.split(ids, bounds), np.split(vectors, bounds), nprobe)
+
+    def _init(self, centroids, list_ids, list_vectors, nprobe):
+        self.centroids = centroids
+        self.list_ids = list_ids
+        self.list_vectors = list_vectors
+        self.nprobe = nprobe
+        self._size = sum(len(ids) for ids in list_ids)
+        self._list_of = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def ids(self):
+        return np.concatenate(self.list_ids)
+
+    @property
+    def vectors(self):
+        return np.concatenate(self.list_vectors)
+
+    @property
+    def offsets(self):
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(ids) for ids in self.list_ids])
+        return offsets
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def build(cls, matrix, nlist=None, nprobe=DEFAULT_NPROBE,
+              iterations=KMEANS_ITERATIONS, seed=0):
+        """Cluster ``matrix`` rows into ``nlist`` lists (default ~sqrt(N))"""
+        matrix = normalize_rows(matrix)
+        n = len(matrix)
+        if nlist is None:
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * TRAIN_ROWS_PER_LIST)
+        sample = matrix[rng.choice(n, sample_size, replace=False)]
+        centroids = spherical_kmeans(sample, nlist, iterations=iterations, rng=rng)
+
+        assign = cls._assign(matrix, centroids)
+        ids = np.argsort(assign, kind='stable')
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+
+        return cls(centroids, matrix[ids], ids, offsets, nprobe=min(nprobe, nlist))
+
+    @staticmethod
+    def _assign(rows, centroids):
+        """Nearest centroid of each normalized row"""
+        return np.concatenate([
+            np.argmax(rows[start:start + 4096] @ centroids.T, axis=1)
+            for start in range(0, len(rows), 4096)
+        ] or [np.zeros(0, dtype=np.int64)])
+
+    def list_of(self):
+        """Array mapping each id to its list, -1 for ids not in the index"""
+        if self._list_of is None:
+            size = max((int(ids.max()) + 1 for ids in self.list_ids if len(ids)), default=0)
+            where = np.full(size, -1, dtype=np.int64)
+            for c, ids in enumerate(self.list_ids):
+                where[ids] = c
+            self._list_of = where
+        return self._list_of
+
+    def update(self, matrix, remove=(), add=()):
+        """New index without the ``remove`` ids and with rows ``add`` of ``matrix`` (re)assigned.
+
+        The centroids are kept and only the lists that change are copied;
+        this index is left as it was, so searches running on it are not
+        disturbed. An id in ``add`` that is already indexed is moved.
+        """
+        remove = np.asarray(remove, dtype=np.int64)
+        add = np.asarray(add, dtype=np.int64)
+        list_ids, list_vectors = list(self.list_ids), list(self.list_vectors)
+        where = self.list_of()
+
+        gone = np.union1d(remove, add)
+        gone = gone[gone < len(where)]
+        gone = gone[where[gone] >= 0]
+        for c in np.unique(where[gone]):
+            keep = ~np.isin(list_ids[c], gone)
+            list_ids[c], list_vectors[c] = list_ids[c][keep], list_vectors[c][keep]
+        size = max(len(where), int(add.max()) + 1 if len(add) else 0)
+        where = np.concatenate([where, np.full(size - len(where), -1, dtype=np.int64)])
+        where[gone] = -1
+
+        if len(add):
+            rows = normalize_rows(matrix[add])
+            assign = self._assign(rows, self.centroids)
+            for c in np.unique(assign):
+                chosen = assign == c
+                list_ids[c] = np.concatenate([list_ids[c], add[chosen]])
+                list_vectors[c] = np.concatenate([list_vectors[c], rows[chosen]])
+            where[add] = assign
+
+        index = IVFIndex.__new__(IVFIndex)
+        index._init(self.centroids, list_ids, list_vectors, self.nprobe)
+        index._list_of = where
+        return index
+
+    def search(self, queries, k, nprobe=None):
+        """Return lists of (ids, scores) arrays per query, best first"""
+        queries = normalize_rows(queries)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        nq = len(queries)
+
+        centroid_scores = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), centroid_scores.shape)
+
+        # Each (query, probe) pair owns k candidate slots
+        cand_scores = np.full((nq, nprobe * k), -np.inf, dtype=np.float32)
+        cand_ids = np.full((nq, nprobe * k), -1, dtype=np.int64)
+
+        # Visit each probed cluster once and score all of its queries with one
+        # matrix product; rows are grouped by cluster so the slice is contiguous
+        pair_lists = probes.ravel()
+        order = np.argsort(pair_lists, kind='stable')
+        bounds = np.flatnonzero(np.diff(pair_lists[order])) + 1
+        for group in np.split(order, bounds):
+            c = pair_lists[group[0]]
+            ids = self.list_ids[c]
+            size = len(ids)
+            if not size:
+                continue
+            qs, slots = np.divmod(group, nprobe)
+            block = self.list_vectors[c] @ queries[qs].T
+            kk = min(k, size)
+            if kk < size:
+                top = np.argpartition(-block, kk - 1, axis=0)[:kk]
+            else:
+                top = np.broadcast_to(np.arange(size)[:, np.newaxis], block.shape)
+            columns = slots[np.newaxis, :] * k + np.arange(kk)[:, np.newaxis]
+            cand_scores[qs, columns] = np.take_along_axis(block, top, axis=0)
+            cand_ids[qs, columns] = ids[top]
+
+        results = []
+        for scores, ids in zip(cand_scores, cand_ids):
+            valid = ids >= 0
+            results.append(_select_top(scores[valid], ids[valid], k))
+        return results
+
+    def save(self, path, **metadata):
+        """Persist the index (and optional metadata arrays) to an .npz file, atomically"""
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, vectors=self.vectors, ids=self.ids,
+                 offsets=self.offsets, nprobe=np.int64(self.nprobe), **metadata)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save, returning (index, metadata)"""
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(data['centroids'], data['vectors'], data['ids'],
+                        data['offsets'], nprobe=int(data['nprobe']))
+            metadata = {key: data[key] for key in data.files
+                        if key not in ('centroids', 'vectors', 'ids', 'offsets', 'nprobe')}
+        return index, metadata
+
+
+def recall_at_k(exact, approx, k):
+    """Mean share of the exact top-k ids that the approximate search found"""
+    hits = [len(set(e[0][:k].tolist()) & set(a[0][:k].tolist())) for e, a in zip(exact, approx)]
+    return float(np.mean(hits)) / k if hits else 1.0
+
+
+def recall_report(index, exact_index, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    """Recall@k and latency of an IVF index at several nprobe settings"""
+    start = time.perf_counter()
+    exact = exact_index.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = {'k': k, 'size': len(exact_index), 'nlist': index.nlist,
+              'exact_ms_per_query': exact_ms, 'ivf': []}
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        start = time.perf_counter()
+        approx = index.search(queries, k, nprobe=nprobe)
+        elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+        report['ivf'].append({'nprobe': nprobe, 'recall': recall_at_k(exact, approx, k),
+                              'ms_per_query': elapsed})
+    return report
+
+
+def synthetic_gallery(size, dim, clusters=None, noise=0.3, seed=0):
+    """Clustered random embeddings, closer to real faces than uniform noise"""
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, size // 50)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    rows = centers[rng.integers(clusters, size=size)]
+    return normalize_rows(rows + noise * rng.standard_normal((size, dim)).astype(np.float32))
+
+
+def synthetic_queries(gallery, count, noise=0.3, seed=1):
+    """Perturbed copies of random gallery rows (``noise`` is the perturbation norm)"""
+    rng = np.random.default_rng(seed)
+    queries = gallery[rng.choice(len(gallery), count)]
+    scale = noise / np.sqrt(gallery.shape[1])
+    return queries + scale * rng.standard_normal(queries.shape).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall/latency report for the IVF index')
+    parser.add_argument('--size', type=int, default=50000, help='gallery size')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--noise', type=float, default=0.3, help='query perturbation norm')
+    args = parser.parse_args()
+
+    from utils.embedding_layout import EMBEDDING_DIM
+
+    gallery = synthetic_gallery(args.size, EMBEDDING_DIM)
+    queries = synthetic_queries(gallery, args.queries, noise=args.noise)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(gallery, nlist=args.nlist)
+    print(f"Built IVF index: {args.size} rows, {index.nlist} lists in {time.perf_counter() - start:.1f}s")
+
+    report = recall_report(index, ExactIndex(gallery), queries, k=args.k)
+    print(f"exact: {report['exact_ms_per_query']:.3f} ms/query")
+    for row in report['ivf']:
+        print(f"nprobe={row['nprobe']:>3}: recall@{args.k}={row['recall']:.3f} "
+              f"{row['ms_per_query']:.3f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Server-side debouncing of attendance sightings.
+
+Clients report a person every time they recognize them, from every tab,
+reload and camera. Instead of storing each report, the aggregator folds
+sightings of the same person into one record per visit. A visit ends once
+the person has not been seen for ``window`` seconds. Each record keeps
+``first_seen`` (also its ``timestamp``), ``last_seen``, the highest
+``confidence`` and the number of ``sightings``.
+
+The first sighting of a visit is written immediately so the record exists
+and has an id. Later sightings only update an in-memory entry per person.
+Dirty entries are written every ``flush_interval`` seconds as one touch
+per person, so a busy door costs one append every few seconds instead of
+one per report.
+
+Nothing besides the attendance log is persisted: after a restart the open
+visits are rebuilt from each person's latest record, and at most the last
+``flush_interval`` seconds of sighting counts can be lost on a crash.
+"""
+
+import atexit
+import os
+import threading
+from datetime import datetime, timedelta
+from config import ATTENDANCE_MERGE_WINDOW, ATTENDANCE_FLUSH_INTERVAL
+from utils.attendance_store import normalize_name
+
+
+def _parse(timestamp):
+    return datetime.fromisoformat(timestamp)
+
+
+class _Visit:
+    """A person's open record and the sightings not yet written"""
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.record = record
+        self.last_seen = _parse(record.get('last_seen', record['timestamp']))
+        self.confidence = record['confidence']
+        self.pending = 0
+
+
+class AttendanceAggregator:
+    """Coalesces sightings of a person into one attendance record per visit"""
+
+    def __init__(self, store, window=ATTENDANCE_MERGE_WINDOW, flush_interval=ATTENDANCE_FLUSH_INTERVAL):
+        self.store = store
+        self.window = timedelta(seconds=window)
+        self.flush_interval = flush_interval
+        self._visits = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._flusher_pid = None
+        self._stop = threading.Event()
+        atexit.register(self.close)
+
+    def sighting(self, name, confidence, when=None):
+        """Record a sighting; returns (record, created) where created is True for a new visit"""
+        when = when or datetime.utcnow()
+        key = normalize_name(name)
+        with self._lock:
+            self._start_flusher()
+            visit = self._visits.get(key)
+            if visit is None or self.store.get(visit.id) is None:
+                # Not seen by this process yet (or deleted): resume from the log
+                latest = self.store.latest(name)
+                visit = _Visit(latest) if latest is not None else None
+
+            if visit is None or when - visit.last_seen > self.window:
+                if visit is not None and visit.pending:
+                    # The ended visit is replaced below, so write what it still holds
+                    self.store.touch(visit.id, visit.last_seen.isoformat(), visit.confidence, visit.pending)
+                iso = when.isoformat()
+                record = self.store.add({
+                    'name': name,
+                    'timestamp': iso,
+                    'confidence': confidence,
+                    'created_at': datetime.utcnow().isoformat(),
+                    'first_seen': iso,
+                    'last_seen': iso,
+                    'sightings': 1
+                })
+                self._visits[key] = _Visit(record)
+                return dict(record), True
+
+            visit.last_seen = max(visit.last_seen, when)
+            visit.confidence = max(visit.confidence, confidence)
+            visit.pending += 1
+            self._visits[key] = visit
+            return self._view(visit), False
+
+    def _view(self, visit):
+        """The record as it will look once pending sightings are flushed"""
+        record = self.store.get(visit.id) or dict(visit.record)
+        record['last_seen'] = max(record.get('last_seen', record['timestamp']), visit.last_seen.isoformat())
+        record['confidence'] = max(record['confidence'], visit.confidence)
+        record['sightings'] = record.get('sightings', 1) + visit.pending
+        return record
+
+    def flush(self):
+        """Write pending sightings, one touch per person; returns how many were written"""
+        with self._lock:
+            dirty = [visit for visit in self._visits.values() if visit.pending]
+            touches = [(v.id, v.last_seen.isoformat(), v.confidence, v.pending) for v in dirty]
+            for visit in dirty:
+                visit.pending = 0
+            # Visits that ended are resumed from the log if the person returns
+            cutoff = datetime.utcnow() - self.window
+            self._visits = {k: v for k, v in self._visits.items() if v.last_seen >= cutoff}
+        if touches:
+            self.store.touch_many(touches)
+        return len(touches)
+
+    def _start_flusher(self):
+        # Started lazily, and again in a forked child which inherits no threads
+        if self._flusher is None or self._flusher_pid != os.getpid():
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._run_flusher,
+                                             name='attendance-flusher', daemon=True)
+            self._flusher_pid = os.getpid()
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing attendance sightings: {e}")
+
+    def close(self):
+        """Stop the periodic flush and write what is pending"""
+        atexit.unregister(self.close)
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing attendance sightings: {e}")
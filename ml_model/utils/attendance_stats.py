@@ -0,0 +1,359 @@
+"""
+Incremental attendance rollups.
+
+The attendance store feeds every record it indexes, unindexes or touches
+into an AttendanceRollup. The rollup keeps one cell per person per day
+holding that person's sorted check-in times (``timestamp``) and check-out
+times (``last_seen``). Records added by other processes reach it too,
+because the store applies their log entries through the same path.
+
+On top of the cells it keeps running totals per day, week and month
+(records, a count of records per person for the headcount, first check-in
+and last check-out) and per person per month, updated in O(1) by the same
+hooks. A delete that removes a bucket's first check-in or last check-out
+marks it stale, and the next query recomputes it from its cells.
+
+An unfiltered dashboard query reads whole buckets from those totals, so it
+costs O(buckets + people x months in range) however many records there
+are; only the two buckets cut by the date range are summed from day
+totals. Queries filtered by name read that person's cells:
+
+    rollup.stats(bucket='week', date_from='2024-11-01', date_to='2024-11-30')
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def _key(name):
+    # Same key as the store's name index
+    return name.strip().lower()
+
+
+def _day(record):
+    return record.get('timestamp', '')[:10]
+
+
+def _last_out(record):
+    return record.get('last_seen', record.get('timestamp', ''))
+
+
+def bucket_start(day, bucket):
+    """First day (YYYY-MM-DD) of the day, week (Monday) or month containing day"""
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        d = date.fromisoformat(day)
+        return (d - timedelta(days=d.weekday())).isoformat()
+    if bucket == 'month':
+        return day[:8] + '01'
+    raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+
+
+def bucket_end(start, bucket):
+    """Last day (YYYY-MM-DD) of the bucket beginning on start"""
+    if bucket == 'day':
+        return start
+    d = date.fromisoformat(start)
+    if bucket == 'week':
+        return (d + timedelta(days=6)).isoformat()
+    if bucket == 'month':
+        following = (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return (following - timedelta(days=1)).isoformat()
+    raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+
+
+def _start(day, bucket):
+    """bucket_start for stored records; a malformed day is kept as its own bucket"""
+    try:
+        return bucket_start(day, bucket)
+    except ValueError:
+        return day
+
+
+def _end(start, bucket):
+    """bucket_end for a bucket of stored records; a malformed day ends where it starts"""
+    try:
+        return bucket_end(start, bucket)
+    except ValueError:
+        return start
+
+
+def _covers(start, end, date_from, date_to):
+    """Whether the days from start to end all lie between date_from and date_to"""
+    return (not date_from or start >= date_from) and (not date_to or end <= date_to)
+
+
+def _window(keys, date_from, date_to):
+    """The slice of sorted day keys between date_from and date_to, inclusive"""
+    start = bisect_left(keys, date_from) if date_from else 0
+    stop = bisect_right(keys, date_to) if date_to else len(keys)
+    return keys[start:stop]
+
+
+class _Cell:
+    """One person's records on one day, and the totals of that person's month"""
+
+    __slots__ = ('name', 'ins', 'outs', 'month')
+
+    def __init__(self, name, month):
+        self.name = name
+        self.ins = []
+        self.outs = []
+        self.month = month
+
+
+class _Totals:
+    """Records of one bucket: how many, how many per member (person or day), first in and last out"""
+
+    __slots__ = ('records', 'members', 'first_in', 'last_out', 'stale')
+
+    def __init__(self):
+        self.records = 0
+        self.members = {}
+        self.first_in = None
+        self.last_out = None
+        # first_in/last_out may be wrong until recomputed from the cells
+        self.stale = False
+
+    def add(self, member, first_in, last_out):
+        self.records += 1
+        self.members[member] = self.members.get(member, 0) + 1
+        if self.first_in is None or first_in < self.first_in:
+            self.first_in = first_in
+        if self.last_out is None or last_out > self.last_out:
+            self.last_out = last_out
+
+    def remove(self, member, first_in, last_out):
+        """Take a record out; returns True once the bucket is empty"""
+        self.records -= 1
+        if self.members[member] == 1:
+            del self.members[member]
+        else:
+            self.members[member] -= 1
+        if first_in == self.first_in or last_out == self.last_out:
+            self.stale = True
+        return not self.records
+
+    def move_out(self, previous_last_out, last_out):
+        if last_out >= self.last_out:
+            self.last_out = last_out
+        elif previous_last_out == self.last_out:
+            self.stale = True
+
+
+def _get_totals(table, starts, start):
+    totals = table.get(start)
+    if totals is None:
+        totals = table[start] = _Totals()
+        insort(starts, start)
+    return totals
+
+
+def _forget(table, starts, start):
+    del table[start]
+    del starts[bisect_left(starts, start)]
+
+
+def _recompute(totals, cells):
+    totals.first_in = min((cell.ins[0] for cell in cells), default=None)
+    totals.last_out = max((cell.outs[-1] for cell in cells), default=None)
+    totals.stale = False
+
+
+def _merge(entry, records, first_in, last_out):
+    entry['records'] += records
+    entry['first_in'] = min(entry['first_in'], first_in) if entry['first_in'] else first_in
+    entry['last_out'] = max(entry['last_out'], last_out)
+
+
+class AttendanceRollup:
+    """Per-day, per-person attendance aggregates maintained as records change"""
+
+    def __init__(self):
+        self._days = {}
+        self._person_days = {}
+        # bucket -> {bucket start: _Totals over people}, and the sorted starts
+        self._periods = {bucket: {} for bucket in BUCKETS}
+        self._starts = {bucket: [] for bucket in BUCKETS}
+        # person key -> {month start: _Totals over days}, and the sorted months
+        self._person_months = {}
+        self._months_of = {}
+        # day -> the _Totals of its bucket for each of BUCKETS. A day (like a
+        # cell) only exists while it has records, so the totals it points at
+        # are never empty and never dropped from under it.
+        self._day_totals = {}
+
+    def _totals(self, record):
+        """(day, person key, check-in, check-out) of a record"""
+        return _day(record), _key(record['name']), record.get('timestamp', ''), _last_out(record)
+
+    def add(self, record):
+        day, key, first_in, last_out = self._totals(record)
+        cells = self._days.get(day)
+        if cells is None:
+            cells = self._days[day] = {}
+            self._day_totals[day] = tuple(_get_totals(self._periods[bucket], self._starts[bucket],
+                                                      _start(day, bucket)) for bucket in BUCKETS)
+        cell = cells.get(key)
+        if cell is None:
+            month = _get_totals(self._person_months.setdefault(key, {}), self._months_of.setdefault(key, []),
+                                _start(day, 'month'))
+            cell = cells[key] = _Cell(record['name'], month)
+            insort(self._person_days.setdefault(key, []), day)
+        insort(cell.ins, first_in)
+        insort(cell.outs, last_out)
+
+        for totals in self._day_totals[day]:
+            totals.add(key, first_in, last_out)
+        cell.month.add(day, first_in, last_out)
+
+    def remove(self, record):
+        day, key, first_in, last_out = self._totals(record)
+        for bucket, totals in zip(BUCKETS, self._day_totals[day]):
+            if totals.remove(key, first_in, last_out):
+                _forget(self._periods[bucket], self._starts[bucket], _start(day, bucket))
+        cells = self._days[day]
+        cell = cells[key]
+        if cell.month.remove(day, first_in, last_out):
+            _forget(self._person_months[key], self._months_of[key], _start(day, 'month'))
+            if not self._months_of[key]:
+                del self._person_months[key]
+                del self._months_of[key]
+
+        del cell.ins[bisect_left(cell.ins, first_in)]
+        del cell.outs[bisect_left(cell.outs, last_out)]
+        if cell.ins:
+            return
+
+        del cells[key]
+        days = self._person_days[key]
+        del days[bisect_left(days, day)]
+        if not days:
+            del self._person_days[key]
+        if not cells:
+            del self._days[day]
+            del self._day_totals[day]
+
+    def touch(self, record, previous_last_out):
+        """Move a record's check-out time after a touch extended it"""
+        day, key, _, last_out = self._totals(record)
+        cell = self._days[day][key]
+        del cell.outs[bisect_left(cell.outs, previous_last_out)]
+        insort(cell.outs, last_out)
+        for totals in self._day_totals[day]:
+            totals.move_out(previous_last_out, last_out)
+        cell.month.move_out(previous_last_out, last_out)
+
+    def stats(self, bucket='day', name=None, date_from=None, date_to=None):
+        """Return (buckets, persons) for records matching the store's query filters.
+
+        Each bucket has its ``start`` day, number of ``records``, distinct
+        people (``headcount``) and the earliest ``first_in`` and latest
+        ``last_out``. Each person has ``days_present``, ``records`` and
+        their own ``first_in``/``last_out`` over the whole range.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        if name:
+            return self._stats_from_cells(bucket, name, date_from, date_to)
+        return self._bucket_stats(bucket, date_from, date_to), self._person_stats(date_from, date_to)
+
+    def _period(self, bucket, start):
+        """Totals of one bucket, recomputed from its cells if a delete left them stale"""
+        totals = self._periods[bucket][start]
+        if totals.stale:
+            days = _window(self._starts['day'], start, _end(start, bucket))
+            _recompute(totals, [cell for day in days for cell in self._days[day].values()])
+        return totals
+
+    def _person_month(self, key, month):
+        totals = self._person_months[key][month]
+        if totals.stale:
+            _recompute(totals, [self._days[day][key] for day in totals.members])
+        return totals
+
+    def _bucket_stats(self, bucket, date_from, date_to):
+        first = bucket_start(date_from, bucket) if date_from else None
+        results = []
+        for start in _window(self._starts[bucket], first, date_to):
+            entry = {'start': start, 'records': 0, 'headcount': 0, 'first_in': '', 'last_out': ''}
+            end = _end(start, bucket)
+            if _covers(start, end, date_from, date_to):
+                totals = self._period(bucket, start)
+                _merge(entry, totals.records, totals.first_in, totals.last_out)
+                entry['headcount'] = len(totals.members)
+            else:
+                # Cut by the range: add up the day totals inside it
+                people = set()
+                for day in _window(self._starts['day'], max(start, date_from or start), min(end, date_to or end)):
+                    totals = self._period('day', day)
+                    _merge(entry, totals.records, totals.first_in, totals.last_out)
+                    people.update(totals.members)
+                entry['headcount'] = len(people)
+            if entry['records']:
+                results.append(entry)
+        return results
+
+    def _person_stats(self, date_from, date_to):
+        first = bucket_start(date_from, 'month') if date_from else None
+        months = _window(self._starts['month'], first, date_to)
+        ends = {month: _end(month, 'month') for month in months}
+        # Everyone with a record in a month overlapping the range
+        keys = set()
+        for month in months:
+            keys.update(self._periods['month'][month].members)
+
+        results = []
+        for key in sorted(keys):
+            entry = {'days_present': 0, 'records': 0, 'first_in': '', 'last_out': ''}
+            person_days = self._person_days[key]
+            for month in _window(self._months_of[key], first, date_to):
+                end = ends[month]
+                if _covers(month, end, date_from, date_to):
+                    totals = self._person_month(key, month)
+                    _merge(entry, totals.records, totals.first_in, totals.last_out)
+                    entry['days_present'] += len(totals.members)
+                    continue
+                for day in _window(person_days, max(month, date_from or month), min(end, date_to or end)):
+                    cell = self._days[day][key]
+                    _merge(entry, len(cell.ins), cell.ins[0], cell.outs[-1])
+                    entry['days_present'] += 1
+            if not entry['records']:
+                continue
+            # Named as on their first day in the range
+            day = person_days[bisect_left(person_days, date_from) if date_from else 0]
+            results.append({'name': self._days[day][key].name, **entry})
+        return results
+
+    def _stats_from_cells(self, bucket, name, date_from, date_to):
+        """Rollups over the cells of the people whose name contains ``name``"""
+        needle = _key(name)
+        buckets = {}
+        persons = {}
+        for key in [key for key in self._person_days if needle in key]:
+            for day in _window(self._person_days[key], date_from, date_to):
+                cell = self._days[day][key]
+                first_in, last_out, count = cell.ins[0], cell.outs[-1], len(cell.ins)
+                for totals, group in ((buckets, bucket_start(day, bucket)), (persons, key)):
+                    entry = totals.get(group)
+                    if entry is None:
+                        entry = totals[group] = {'records': 0, 'first_in': first_in, 'last_out': last_out,
+                                                 'people': set(), 'days': 0, 'name': cell.name}
+                    entry['records'] += count
+                    entry['first_in'] = min(entry['first_in'], first_in)
+                    entry['last_out'] = max(entry['last_out'], last_out)
+                    entry['people'].add(key)
+                    entry['days'] += 1
+
+        return [
+            {'start': start, 'records': b['records'], 'headcount': len(b['people']),
+             'first_in': b['first_in'], 'last_out': b['last_out']}
+            for start, b in sorted(buckets.items())
+        ], [
+            {'name': p['name'], 'days_present': p['days'], 'records': p['records'],
+             'first_in': p['first_in'], 'last_out': p['last_out']}
+            for _, p in sorted(persons.items())
+        ]
@@ -0,0 +1,706 @@
+"""
+Append-only attendance storage.
+
+Attendance records live in a line-delimited JSON log. Every mutation is
+appended as a single entry, so logging a check-in costs the same no matter
+how much history has accumulated:
+
+    {"op": "meta", "next_id": 42, "log_id": "5f0c..."}
+    {"op": "add", "record": {"id": 41, "name": "Aditya", ...}}
+    {"op": "del", "id": 17}
+    {"op": "touch", "id": 41, "last_seen": "...", "confidence": 0.97, "sightings": 12}
+
+A touch folds further sightings into an existing record: ``last_seen`` and
+``confidence`` keep the maximum and ``sightings`` is added, so touches from
+different processes commute.
+
+The log is rewritten (compacted) when dead entries make up a large share
+of it. A store opened next to a legacy ``{'records': [], 'next_id': N}``
+file migrates it once on first use.
+
+Replaying a long log and rebuilding its indexes takes tens of microseconds
+per entry, so the in-memory state (records, indexes and rollups) is also
+pickled to ``<log>.checkpoint`` together with the log offset it reflects.
+Opening restores the checkpoint and replays only the log after it. The
+checkpoint is rewritten after compaction and when opening had to replay
+many entries past it, so appends never pay for it. A checkpoint is only
+used for the log it was written from: it records the log's first line (a
+compacted log starts with a meta entry holding a random ``log_id``) and the
+bytes before its offset. Otherwise, or if it cannot be read, the whole log
+is replayed.
+
+Secondary indexes (by normalized name, by day and by time) are kept in
+memory alongside the records so that filtered, paginated queries cost
+O(log n + page) instead of a scan over the whole history. Per-day and
+per-person rollups (see attendance_stats) are maintained the same way.
+
+Mutations are serialized by a single writer thread per process that drains
+a queue and commits everything queued so far in one append. Across processes
+the writer holds an exclusive lock on ``<log>.lock`` while it catches up with
+entries appended by other processes, allocates ids and appends. Readers in
+every process tail the log before answering, so several API workers can
+share one log safely.
+"""
+
+import atexit
+import gc
+import heapq
+import json
+import os
+import pickle
+import queue
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+from concurrent.futures import Future
+from itertools import islice
+from utils.attendance_stats import AttendanceRollup
+from utils.file_lock import FileLock, file_id
+from utils import metrics
+
+# fsync after this many appended entries or this many seconds, whichever first
+FSYNC_BATCH_SIZE = 64
+FSYNC_INTERVAL = 1.0
+
+# Compact once this many entries are dead and they make up this share of the log
+COMPACT_MIN_DEAD = 1000
+COMPACT_DEAD_RATIO = 0.5
+
+# Most queued mutations committed by one append
+WRITE_BATCH_SIZE = 512
+
+# Records collected per lock acquisition by scan()
+SCAN_CHUNK_SIZE = 1000
+
+# On open and after compaction, checkpoint the in-memory state if this many
+# entries were replayed after the last checkpoint and they make up this share
+# of the entries it holds
+CHECKPOINT_MIN_ENTRIES = 10000
+CHECKPOINT_RATIO = 0.1
+
+# Bumped whenever the pickled state changes shape; older checkpoints are ignored
+CHECKPOINT_VERSION = 1
+# Log bytes before the checkpoint offset that must still match
+CHECKPOINT_TAIL_BYTES = 256
+
+LOG_SUFFIX = '.jsonl'
+MIGRATED_SUFFIX = '.migrated'
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+def log_path_for(legacy_path):
+    """Return the log file path that replaces a legacy attendance JSON file"""
+    return os.path.splitext(legacy_path)[0] + LOG_SUFFIX
+
+
+def _encode(entry):
+    return (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def normalize_name(name):
+    """Key used by the name index and name filters"""
+    return name.strip().lower()
+
+
+def encode_cursor(key):
+    """Turn a (timestamp, id) sort key into an opaque pagination cursor"""
+    return f'{key[0]}_{key[1]}'
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raising ValueError for malformed cursors"""
+    timestamp, sep, record_id = cursor.rpartition('_')
+    if not sep or not timestamp:
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return (timestamp, int(record_id))
+
+
+def _sort_key(record):
+    return (record.get('timestamp', ''), record['id'])
+
+
+def _fold(record, touch):
+    """Merge a touch entry's sightings into a record in place"""
+    record['last_seen'] = max(record.get('last_seen', record['timestamp']), touch['last_seen'])
+    record['confidence'] = max(record['confidence'], touch['confidence'])
+    record['sightings'] = record.get('sightings', 1) + touch['sightings']
+
+
+def _next_day(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _without_gc(fn, *args, **kwargs):
+    """Call fn with the cyclic GC paused; (un)pickling millions of objects otherwise triggers it over and over"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class AttendanceStore:
+    """Attendance records backed by an append-only JSON lines log"""
+
+    def __init__(self, log_path, legacy_path=None,
+                 fsync_batch_size=FSYNC_BATCH_SIZE, fsync_interval=FSYNC_INTERVAL):
+        self.log_path = log_path
+        self.legacy_path = legacy_path
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+
+        self.next_id = 1
+        self._records = {}
+        self._timeline = []
+        self._by_name = {}
+        self._by_day = {}
+        self._rollup = AttendanceRollup()
+        self._entries = 0
+        self._dead = 0
+        self._checkpoint_entries = 0
+        self._offset = 0
+        self._file_id = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(log_path + '.lock')
+        self._fh = None
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_pid = None
+        self._closed = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+
+        with self._file_lock:
+            if not os.path.exists(log_path) and legacy_path and os.path.exists(legacy_path):
+                self._migrate_legacy()
+            if not os.path.exists(log_path):
+                open(log_path, 'ab').close()
+            self._load(repair=True)
+            self._maybe_checkpoint()
+        atexit.register(self.close)
+
+    # Loading
+
+    def _migrate_legacy(self):
+        """Convert a legacy single-document JSON file into a log, once"""
+        try:
+            with open(self.legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            print(f"Error migrating attendance data: {e}")
+            return
+
+        records = legacy.get('records', [])
+        next_id = legacy.get('next_id', 1)
+        if records:
+            next_id = max(next_id, max(r['id'] for r in records) + 1)
+
+        self._write_snapshot(records, next_id)
+        os.replace(self.legacy_path, self.legacy_path + MIGRATED_SUFFIX)
+        print(f"Migrated {len(records)} attendance records to {self.log_path}")
+
+    def _load(self, repair=False):
+        """Rebuild in-memory state from the checkpoint, if it matches, and the log after it"""
+        with metrics.timed('attendance_load'):
+            self._reset()
+            with open(self.log_path, 'rb') as f:
+                self._file_id = file_id(f)
+                start = self._restore_checkpoint(f)
+                f.seek(start)
+                data = f.read()
+
+            # A crash mid-append can leave a partial last line behind. Only
+            # repair while holding the file lock, otherwise it may be in flight.
+            end = data.rfind(b'\n') + 1
+            if repair and end < len(data):
+                print(f"Discarding truncated entry at end of {self.log_path}")
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(start + end)
+
+            self._apply_lines(data[:end])
+            self._offset = start + end
+
+    def _restore_checkpoint(self, f):
+        """Restore the state checkpointed from log file ``f``; returns the offset to replay from"""
+        path = self.log_path + CHECKPOINT_SUFFIX
+        try:
+            with open(path, 'rb') as checkpoint:
+                header = pickle.load(checkpoint)
+                if header['version'] != CHECKPOINT_VERSION:
+                    return 0
+                f.seek(0)
+                head = f.readline()
+                f.seek(max(0, header['offset'] - len(header['tail'])))
+                if head != header['head'] or f.read(len(header['tail'])) != header['tail']:
+                    return 0
+                state = _without_gc(pickle.load, checkpoint)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Ignoring unreadable attendance checkpoint {path}: {e}")
+            return 0
+
+        (self.next_id, self._records, self._timeline, self._by_name, self._by_day,
+         self._rollup, self._entries, self._dead) = state
+        self._checkpoint_entries = self._entries
+        return header['offset']
+
+    def _maybe_checkpoint(self):
+        """Checkpoint the state if enough entries were replayed; caller holds the file lock and is caught up"""
+        fresh = self._entries - self._checkpoint_entries
+        if fresh < CHECKPOINT_MIN_ENTRIES or fresh < self._checkpoint_entries * CHECKPOINT_RATIO:
+            return
+        self._checkpoint_entries = self._entries
+
+        path = self.log_path + CHECKPOINT_SUFFIX
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with metrics.timed('attendance_checkpoint'):
+                with open(self.log_path, 'rb') as f:
+                    head = f.readline()
+                    f.seek(max(0, self._offset - CHECKPOINT_TAIL_BYTES))
+                    tail = f.read(self._offset - f.tell())
+                header = {'version': CHECKPOINT_VERSION, 'head': head, 'offset': self._offset, 'tail': tail}
+                state = (self.next_id, self._records, self._timeline, self._by_name, self._by_day,
+                         self._rollup, self._entries, self._dead)
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    _without_gc(pickle.dump, state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not write attendance checkpoint {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _refresh(self):
+        """Catch up with entries other processes appended since the last look"""
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+
+        if (st.st_dev, st.st_ino) != self._file_id:
+            # Another process compacted (replaced) the log
+            self._load()
+            return
+
+        size = st.st_size
+        if size <= self._offset:
+            return
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        end = data.rfind(b'\n') + 1
+        self._apply_lines(data[:end])
+        self._offset += end
+
+    def refresh(self):
+        """Make entries written by other processes visible to this one"""
+        with self._lock:
+            self._refresh()
+
+    def _apply_lines(self, data):
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError) as e:
+                print(f"Skipping unreadable attendance log entry: {e}")
+                self._entries += 1
+                self._dead += 1
+
+    def _apply(self, entry):
+        """Apply a single log entry to the in-memory state"""
+        op = entry['op']
+        self._entries += 1
+
+        if op == 'add':
+            record = entry['record']
+            if record['id'] in self._records:
+                self._unindex(self._records[record['id']])
+            self._records[record['id']] = record
+            self._index(record)
+            self.next_id = max(self.next_id, record['id'] + 1)
+        elif op == 'del':
+            # The delete entry and the add it cancels are both dead now
+            record = self._records.pop(entry['id'], None)
+            if record is not None:
+                self._unindex(record)
+                self._dead += 1
+            self._dead += 1
+        elif op == 'touch':
+            # Folded into the record, so a compacted log does not need it
+            record = self._records.get(entry['id'])
+            if record is not None:
+                previous = record.get('last_seen', record['timestamp'])
+                _fold(record, entry)
+                self._rollup.touch(record, previous)
+            self._dead += 1
+        elif op == 'meta':
+            self.next_id = max(self.next_id, entry['next_id'])
+            self._dead += 1
+        else:
+            raise ValueError(f"unknown op {op!r}")
+
+    # Indexes
+
+    def _index(self, record):
+        key = _sort_key(record)
+        insort(self._timeline, key)
+        insort(self._by_name.setdefault(normalize_name(record['name']), []), key)
+        insort(self._by_day.setdefault(key[0][:10], []), key)
+        self._rollup.add(record)
+
+    def _unindex(self, record):
+        key = _sort_key(record)
+        for index, bucket in ((self._by_name, normalize_name(record['name'])),
+                              (self._by_day, key[0][:10])):
+            keys = index[bucket]
+            del keys[bisect_left(keys, key)]
+            if not keys:
+                del index[bucket]
+        del self._timeline[bisect_left(self._timeline, key)]
+        self._rollup.remove(record)
+
+    # Reads
+
+    def records(self):
+        """Return copies of all live records in insertion order"""
+        with self._lock:
+            self._refresh()
+            return [dict(record) for record in self._records.values()]
+
+    def get(self, record_id):
+        """Return a copy of a single record or None"""
+        with self._lock:
+            self._refresh()
+            record = self._records.get(record_id)
+            return dict(record) if record is not None else None
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    def latest(self, name):
+        """Return the newest record for a name (case-insensitive), or None"""
+        with self._lock:
+            self._refresh()
+            keys = self._by_name.get(normalize_name(name))
+            return dict(self._records[keys[-1][1]]) if keys else None
+
+    def query(self, name=None, date_from=None, date_to=None, limit=None, cursor=None):
+        """Return (records, next_cursor) newest first; records are copies.
+
+        ``name`` matches case-insensitively anywhere in the person's name,
+        ``date_from``/``date_to`` are inclusive YYYY-MM-DD bounds and
+        ``cursor`` continues after the last record of a previous page.
+        """
+        low = (date_from,) if date_from else None
+        high = (_next_day(date_to),) if date_to else None
+        if cursor:
+            after = decode_cursor(cursor)
+            high = min(high, after) if high else after
+
+        with self._lock:
+            self._refresh()
+            sources = self._sources(name, date_from, date_to)
+
+            def newest_first(keys):
+                start = bisect_left(keys, low) if low else 0
+                stop = bisect_left(keys, high) if high else len(keys)
+                return (keys[i] for i in range(stop - 1, start - 1, -1))
+
+            merged = heapq.merge(*(newest_first(keys) for keys in sources), reverse=True)
+            if limit is None:
+                keys = list(merged)
+                return [dict(self._records[k[1]]) for k in keys], None
+
+            keys = list(islice(merged, limit + 1))
+            next_cursor = encode_cursor(keys[limit - 1]) if len(keys) > limit else None
+            return [dict(self._records[k[1]]) for k in keys[:limit]], next_cursor
+
+    def scan(self, name=None, date_from=None, date_to=None, chunk_size=SCAN_CHUNK_SIZE):
+        """Yield records matching the query() filters oldest first, in lists of up to chunk_size.
+
+        The lock is held only while one chunk is collected, so a long export
+        does not block writers. Each chunk resumes after the last key of the
+        previous one; records added meanwhile are included if they sort later.
+        """
+        low = (date_from,) if date_from else None
+        high = (_next_day(date_to),) if date_to else None
+        after = None
+
+        def oldest_first(keys):
+            if after:
+                start = bisect_right(keys, after)
+            else:
+                start = bisect_left(keys, low) if low else 0
+            stop = bisect_left(keys, high) if high else len(keys)
+            return (keys[i] for i in range(start, stop))
+
+        while True:
+            with self._lock:
+                self._refresh()
+                sources = self._sources(name, date_from, date_to)
+                keys = list(islice(heapq.merge(*(oldest_first(k) for k in sources)), chunk_size))
+                # Copies, since touches update records in place
+                chunk = [dict(self._records[k[1]]) for k in keys]
+            if chunk:
+                yield chunk
+            if len(keys) < chunk_size:
+                return
+            after = keys[-1]
+
+    def stats(self, bucket='day', name=None, date_from=None, date_to=None):
+        """Return (buckets, persons) rollups for the query() filters; see AttendanceRollup.stats"""
+        with self._lock:
+            self._refresh()
+            return self._rollup.stats(bucket=bucket, name=name, date_from=date_from, date_to=date_to)
+
+    def _sources(self, name, date_from, date_to):
+        """The sorted key lists a query has to merge; caller holds the lock"""
+        if name:
+            needle = normalize_name(name)
+            return [keys for key, keys in self._by_name.items() if needle in key]
+        if date_from and date_from == date_to:
+            return [self._by_day.get(date_from, [])]
+        return [self._timeline]
+
+    # Writes
+
+    def add(self, fields):
+        """Assign the next id to a new record, append it and return it"""
+        return self._submit('add', fields)
+
+    def add_many(self, records):
+        """Add records under one contiguous id range in a single append; returns them"""
+        if not records:
+            return []
+        return self._submit('add_many', records)
+
+    def delete(self, record_id):
+        """Delete a record by id, returning False if it does not exist"""
+        return self._submit('delete', record_id)
+
+    def touch(self, record_id, last_seen, confidence, sightings=1):
+        """Fold more sightings into a record, returning False if it does not exist"""
+        return self.touch_many([(record_id, last_seen, confidence, sightings)])[0]
+
+    def touch_many(self, touches):
+        """Apply (id, last_seen, confidence, sightings) touches in one append"""
+        futures = [self._enqueue('touch', {'op': 'touch', 'id': record_id, 'last_seen': last_seen,
+                                           'confidence': confidence, 'sightings': sightings})
+                   for record_id, last_seen, confidence, sightings in touches]
+        return [future.result() for future in futures]
+
+    def replace_all(self, records, next_id):
+        """Replace the whole dataset, e.g. when restoring from a backup"""
+        return self._submit('replace', (records, next_id))
+
+    def compact(self):
+        """Rewrite the log without deleted records and superseded entries"""
+        return self._submit('compact', None)
+
+    def sync(self):
+        """Force pending appends to disk"""
+        with self._lock:
+            if self._fh is not None:
+                self._sync()
+
+    def close(self):
+        """Commit queued mutations, stop the writer and sync the log"""
+        atexit.unregister(self.close)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            writer = self._writer if self._writer_pid == os.getpid() else None
+        if writer is not None and writer.is_alive():
+            self._queue.put(None)
+            writer.join()
+        with self._lock:
+            if self._fh is not None:
+                self._sync()
+                self._fh.close()
+                self._fh = None
+
+    def _submit(self, kind, arg):
+        """Queue a mutation for the writer thread and wait for its result"""
+        return self._enqueue(kind, arg).result()
+
+    def _enqueue(self, kind, arg):
+        """Queue a mutation for the writer thread, returning its Future"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('attendance store is closed')
+            # Start lazily, and again in a forked child which inherits no threads
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._writer = threading.Thread(target=self._run_writer,
+                                                name='attendance-writer', daemon=True)
+                self._writer_pid = os.getpid()
+                self._writer.start()
+            self._queue.put((kind, arg, future))
+        return future
+
+    # Writer thread
+
+    def _run_writer(self):
+        while True:
+            try:
+                op = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                # Idle: flush whatever the last batch left unsynced
+                with self._lock:
+                    if self._fh is not None:
+                        self._sync()
+                continue
+
+            ops = []
+            while op is not None:
+                ops.append(op)
+                if len(ops) >= WRITE_BATCH_SIZE:
+                    break
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if ops:
+                self._commit(ops)
+            if op is None:
+                return
+
+    def _commit(self, ops):
+        """Commit a batch of queued mutations under the cross-process lock"""
+        try:
+            with self._file_lock, self._lock:
+                self._refresh()
+                pending = []
+                next_id = self.next_id
+                deleting = set()
+                for kind, arg, future in ops:
+                    if kind == 'add':
+                        record = {'id': next_id}
+                        record.update(arg)
+                        next_id += 1
+                        pending.append(({'op': 'add', 'record': record}, future, dict(record)))
+                    elif kind == 'add_many':
+                        records = []
+                        for fields in arg:
+                            record = {'id': next_id}
+                            record.update(fields)
+                            next_id += 1
+                            records.append(record)
+                            pending.append(({'op': 'add', 'record': record}, None, None))
+                        pending.append((None, future, [dict(record) for record in records]))
+                    elif kind == 'delete':
+                        if arg in self._records and arg not in deleting:
+                            deleting.add(arg)
+                            pending.append(({'op': 'del', 'id': arg}, future, True))
+                        else:
+                            pending.append((None, future, False))
+                    elif kind == 'touch':
+                        if arg['id'] in self._records and arg['id'] not in deleting:
+                            pending.append((arg, future, True))
+                        else:
+                            pending.append((None, future, False))
+                    else:
+                        self._append_pending(pending)
+                        if kind == 'replace':
+                            self._rewrite(*arg)
+                        else:
+                            self._rewrite(list(self._records.values()), self.next_id)
+                        future.set_result(None)
+                        next_id = self.next_id
+                        deleting.clear()
+                self._append_pending(pending)
+                self._maybe_compact()
+        except Exception as e:
+            for _, _, future in ops:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _append_pending(self, pending):
+        entries = [entry for entry, _, _ in pending if entry is not None]
+        if entries:
+            self._append(entries)
+            for entry in entries:
+                self._apply(entry)
+        for _, future, result in pending:
+            if future is not None:
+                future.set_result(result)
+        pending.clear()
+
+    def _append(self, entries):
+        """Append entries in one write; caller holds the file lock and is caught up"""
+        if self._fh is None or file_id(self._fh) != self._file_id:
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = open(self.log_path, 'ab')
+
+        with metrics.timed('attendance_append'):
+            self._fh.write(b''.join(_encode(e) for e in entries))
+            self._fh.flush()
+        self._offset = self._fh.tell()
+        self._unsynced += len(entries)
+
+        now = time.monotonic()
+        if self._unsynced >= self.fsync_batch_size or now - self._last_sync >= self.fsync_interval:
+            self._sync(now)
+
+    def _sync(self, now=None):
+        if self._unsynced:
+            os.fsync(self._fh.fileno())
+            self._unsynced = 0
+        self._last_sync = now if now is not None else time.monotonic()
+
+    # Compaction
+
+    def _reset(self):
+        self.next_id = 1
+        self._records = {}
+        self._timeline = []
+        self._by_name = {}
+        self._by_day = {}
+        self._rollup = AttendanceRollup()
+        self._entries = 0
+        self._dead = 0
+        self._checkpoint_entries = 0
+        self._offset = 0
+
+    def _write_snapshot(self, records, next_id):
+        """Atomically write a compacted log holding exactly ``records``"""
+        tmp_path = self.log_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            # A fresh log_id tells this log apart from earlier compactions in checkpoints
+            f.write(_encode({'op': 'meta', 'next_id': next_id, 'log_id': os.urandom(8).hex()}))
+            for record in records:
+                f.write(_encode({'op': 'add', 'record': record}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+
+    def _rewrite(self, records, next_id):
+        """Replace the log with a snapshot and reload; caller holds the file lock"""
+        if self._fh is not None:
+            self._sync()
+            self._fh.close()
+            self._fh = None
+        self._write_snapshot(records, next_id)
+        self._load()
+        self._maybe_checkpoint()
+
+    def _maybe_compact(self):
+        if self._dead >= COMPACT_MIN_DEAD and self._dead >= self._entries * COMPACT_DEAD_RATIO:
+            self._rewrite(list(self._records.values()), self.next_id)
@@ -0,0 +1,375 @@
+"""
+Many camera feeds on one fixed pool of recognition workers.
+
+Every camera gets a reader thread that keeps at most ``max_backlog`` frames
+buffered. A fixed number of worker threads run detection and embedding,
+taking cameras in round-robin order so a busy door cannot starve a quiet
+one. Each camera has at most one frame in a worker at a time, which keeps
+its frames (and its face tracker) in order. A single matcher thread scores
+the faces from all cameras against the shared gallery with one matrix
+product per batch and writes attendance.
+
+Under overload frames are dropped per camera instead of queueing. Live
+readers replace their oldest buffered frame, and a camera whose latency
+exceeds ``target_latency`` skips straight to its newest frame.
+
+FaceMesh runs in still-image mode from each worker's session pool, so N
+cameras share ``workers`` model instances rather than owning one each;
+tracking across frames is done by each camera's IoU tracker.
+
+Usage:
+    python -m utils.camera_scheduler rtsp://door-1/stream rtsp://door-2/stream \
+        --workers 4 --attendance-file ../data/attendance.json
+"""
+
+import argparse
+import threading
+import time
+from collections import deque
+import numpy as np
+from config import MAX_NUM_FACES, FACE_DETECTION_CONFIDENCE, ATTENDANCE_LOG_INTERVAL, TEMPLATE_SCORE_TOP
+from utils.stream_pipeline import StreamPipeline, FrameJob, AttendanceLogger, landmarks_to_array
+
+# Frames buffered per camera before the oldest is dropped
+DEFAULT_MAX_BACKLOG = 2
+# Seconds from capture to match above which a camera skips to its newest frame
+DEFAULT_TARGET_LATENCY = 0.5
+# Most frames scored together by the matcher
+MATCH_BATCH_SIZE = 64
+# Latency samples kept per camera for percentiles
+LATENCY_WINDOW = 200
+
+
+class PooledDetector:
+    """Still-image FaceMesh taken from the calling worker thread's session pool"""
+
+    def __init__(self, max_num_faces=MAX_NUM_FACES, min_detection_confidence=FACE_DETECTION_CONFIDENCE):
+        self.options = {
+            'static_image_mode': True,
+            'refine_landmarks': True,
+            'max_num_faces': max_num_faces,
+            'min_detection_confidence': min_detection_confidence
+        }
+
+    def __call__(self, rgb):
+        from utils.extract_embedding import get_face_mesh
+
+        results = get_face_mesh(**self.options).process(rgb)
+        return [landmarks_to_array(face) for face in results.multi_face_landmarks or []]
+
+
+class Camera:
+    """One feed: its frame buffer, tracker (inside ``pipeline``) and metrics"""
+
+    def __init__(self, name, pipeline, max_backlog):
+        self.name = name
+        self.pipeline = pipeline
+        self.buffer = deque()
+        self.max_backlog = max_backlog
+        self.busy = False
+        self.done = False
+        self.dropped = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency = 0.0
+        self.started = None
+
+    def record_latency(self, seconds):
+        self.latencies.append(seconds)
+        # Exponential moving average drives adaptive dropping
+        self.latency = seconds if len(self.latencies) == 1 else 0.8 * self.latency + 0.2 * seconds
+
+    def metrics(self):
+        stats = self.pipeline.stats
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            'frames_read': stats['frames_read'],
+            'frames_processed': stats['frames_processed'],
+            'frames_dropped': self.dropped,
+            'backlog': len(self.buffer),
+            'rejected': stats['rejected'],
+            'identifications': stats['identifications'],
+            'logged': stats['logged'],
+            'fps': stats['frames_processed'] / elapsed if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'p50': float(np.percentile(latencies, 50)) * 1000,
+                'p95': float(np.percentile(latencies, 95)) * 1000,
+                'max': float(latencies.max()) * 1000
+            }
+        }
+
+
+class CameraScheduler:
+    """Fair scheduling of N cameras onto a fixed recognition worker pool.
+
+    ``gallery`` is a Gallery or a callable returning the current one, shared
+    by all cameras. ``on_attendance(camera, name, confidence, timestamp)``
+    receives identified people, rate-limited per person across all cameras.
+    ``quality_gate`` (a QualityGate or None) filters faces on every camera.
+    """
+
+    def __init__(self, gallery, workers=4, detector=None, on_attendance=None,
+                 max_backlog=DEFAULT_MAX_BACKLOG, target_latency=DEFAULT_TARGET_LATENCY,
+                 log_interval=ATTENDANCE_LOG_INTERVAL, match_batch_size=MATCH_BATCH_SIZE,
+                 quality_gate=None):
+        self.gallery = gallery if callable(gallery) else (lambda: gallery)
+        self.workers = workers
+        self.detector = detector or PooledDetector()
+        self.on_attendance = on_attendance
+        self.max_backlog = max_backlog
+        self.target_latency = target_latency
+        self.log_interval = log_interval
+        self.match_batch_size = match_batch_size
+        self.quality_gate = quality_gate
+
+        self.cameras = []
+        self.error = None
+        self._cond = threading.Condition()
+        self._next = 0
+        self._stop = threading.Event()
+        self._matches = deque()
+        self._workers_left = 0
+        self._threads = []
+
+    def add_camera(self, name, source, live=None, **pipeline_options):
+        """Register a feed (path, camera index, URL or iterable of frames)"""
+        pipeline_options.setdefault('quality_gate', self.quality_gate)
+        pipeline = StreamPipeline(source, self.gallery, detector=self.detector, live=live,
+                                  **pipeline_options)
+        camera = Camera(name, pipeline, self.max_backlog)
+        self.cameras.append(camera)
+        return camera
+
+    # Readers
+
+    def _read(self, camera):
+        try:
+            for timestamp, frame in camera.pipeline.frames():
+                job = FrameJob(camera.pipeline.stats['frames_read'], timestamp, frame)
+                job.captured = time.monotonic()
+                with self._cond:
+                    camera.pipeline.stats['frames_read'] += 1
+                    if camera.pipeline.live:
+                        if len(camera.buffer) >= camera.max_backlog:
+                            camera.buffer.popleft()
+                            camera.dropped += 1
+                    else:
+                        while len(camera.buffer) >= camera.max_backlog and not self._stop.is_set():
+                            self._cond.wait()
+                    camera.buffer.append(job)
+                    self._cond.notify_all()
+                if self._stop.is_set():
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with self._cond:
+                camera.done = True
+                self._cond.notify_all()
+
+    # Workers
+
+    def _take(self):
+        """Next (camera, job) in round-robin order, or None when all feeds ended"""
+        with self._cond:
+            while True:
+                if self._stop.is_set():
+                    return None
+                count = len(self.cameras)
+                for step in range(count):
+                    camera = self.cameras[(self._next + step) % count]
+                    if camera.busy or not camera.buffer:
+                        continue
+                    self._next = (self._next + step + 1) % count
+                    camera.busy = True
+                    if camera.latency > self.target_latency and len(camera.buffer) > 1:
+                        # Overloaded: skip stale frames and catch up
+                        camera.dropped += len(camera.buffer) - 1
+                        job = camera.buffer.pop()
+                        camera.buffer.clear()
+                    else:
+                        job = camera.buffer.popleft()
+                    self._cond.notify_all()
+                    return camera, job
+                if all(c.done and not c.buffer and not c.busy for c in self.cameras):
+                    return None
+                self._cond.wait()
+
+    def _work(self):
+        try:
+            while True:
+                taken = self._take()
+                if taken is None:
+                    break
+                camera, job = taken
+                ok = False
+                try:
+                    camera.pipeline.detect(job)
+                    camera.pipeline.embed(job)
+                    ok = True
+                finally:
+                    with self._cond:
+                        camera.busy = False
+                        if ok:
+                            self._matches.append((camera, job))
+                        self._cond.notify_all()
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with self._cond:
+                self._workers_left -= 1
+                self._cond.notify_all()
+
+    # Matcher
+
+    def _match(self):
+        while True:
+            with self._cond:
+                while not self._matches and self._workers_left and not self._stop.is_set():
+                    self._cond.wait()
+                if not self._matches:
+                    return
+                batch = [self._matches.popleft()
+                         for _ in range(min(self.match_batch_size, len(self._matches)))]
+            try:
+                self._match_batch(batch)
+            except Exception as e:
+                self._fail(e)
+                return
+
+    def _match_batch(self, batch):
+        pending = [(camera, job) for camera, job in batch if job.to_match]
+        if pending:
+            queries = np.concatenate([job.embeddings[job.to_match] for _, job in pending])
+            results = self.gallery().identify_batch(queries, k=1)
+            start = 0
+            for camera, job in pending:
+                end = start + len(job.to_match)
+                camera.pipeline.apply_matches(job, results[start:end])
+                start = end
+
+        now = time.monotonic()
+        for camera, job in batch:
+            camera.pipeline.log(job)
+            camera.record_latency(now - job.captured)
+
+    # Control
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stop()
+
+    def _attendance_for(self, camera):
+        def log(name, confidence, timestamp):
+            if self.on_attendance:
+                self.on_attendance(camera.name, name, confidence, timestamp)
+        return log
+
+    def start(self):
+        """Start reader, worker and matcher threads"""
+        # One rate limit across cameras: walking past two doors logs once
+        last_logged = {}
+        for camera in self.cameras:
+            camera.pipeline.attendance = AttendanceLogger(self._attendance_for(camera),
+                                                          self.log_interval, last=last_logged)
+            camera.started = time.monotonic()
+
+        self._workers_left = self.workers
+        self._threads = [threading.Thread(target=self._read, args=(c,), daemon=True) for c in self.cameras]
+        self._threads += [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._match, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        """Stop reading and let in-flight frames finish"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait for all feeds to end (or stop()); re-raises a stage failure"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if self.error is not None:
+            raise self.error
+
+    def run(self, duration=None):
+        """Run until every feed ends (or ``duration`` seconds); returns metrics()"""
+        self.start()
+        if duration is not None:
+            self._stop.wait(duration)
+            self.stop()
+        self.join()
+        return self.metrics()
+
+    def metrics(self):
+        """Per-camera throughput, backlog, drops and latency percentiles"""
+        with self._cond:
+            return {camera.name: camera.metrics() for camera in self.cameras}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recognize faces on several cameras with one worker pool')
+    parser.add_argument('sources', nargs='+', help='video files, camera indexes or rtsp:// URLs')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--gallery-dir', default='../data/gallery')
+    parser.add_argument('--attendance-file', default=None)
+    parser.add_argument('--max-backlog', type=int, default=DEFAULT_MAX_BACKLOG)
+    parser.add_argument('--target-latency', type=float, default=DEFAULT_TARGET_LATENCY)
+    parser.add_argument('--report-every', type=float, default=10.0, help='seconds between metric reports')
+    parser.add_argument('--no-quality-gate', action='store_true',
+                        help='track and match every detected face, however small, blurry or turned')
+    args = parser.parse_args()
+
+    from utils.embedding_store import EmbeddingStore
+    from utils.face_quality import default_gate
+    from utils.gallery import LiveGallery
+    from utils.stream_pipeline import store_logger
+
+    embeddings = EmbeddingStore(args.gallery_dir)
+    gallery = LiveGallery(embeddings, template_top=TEMPLATE_SCORE_TOP)
+    store = None
+    log = None
+    if args.attendance_file:
+        from utils.attendance_aggregator import AttendanceAggregator
+        from utils.attendance_store import AttendanceStore, log_path_for
+        store = AttendanceStore(log_path_for(args.attendance_file), legacy_path=args.attendance_file)
+        aggregator = AttendanceAggregator(store)
+        log = store_logger(aggregator)
+
+    def on_attendance(camera, name, confidence, timestamp):
+        print(f"✔ [{camera}] {name} ({confidence:.3f})")
+        if log:
+            log(name, confidence, timestamp)
+
+    scheduler = CameraScheduler(gallery.current, workers=args.workers, on_attendance=on_attendance,
+                                max_backlog=args.max_backlog, target_latency=args.target_latency,
+                                quality_gate=None if args.no_quality_gate else default_gate())
+    for i, source in enumerate(args.sources):
+        scheduler.add_camera(f'camera-{i + 1}', int(source) if source.isdigit() else source)
+
+    scheduler.start()
+    try:
+        while scheduler.is_running():
+            time.sleep(args.report_every)
+            for name, m in scheduler.metrics().items():
+                print(f"{name}: {m['fps']:.1f} fps, backlog {m['backlog']}, dropped {m['frames_dropped']}, "
+                      f"rejected {m['rejected']}, "
+                      f"p95 latency {m['latency_ms']['p95']:.0f} ms")
+    except KeyboardInterrupt:
+        scheduler.stop()
+    finally:
+        scheduler.join()
+        if store is not None:
+            aggregator.close()
+            store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,26 @@
-import cv2
-import mediapipe as mp
 import numpy as np
+from utils.embedding_layout import landmarks_to_array
+from utils.extract_embedding import get_face_mesh
 
-mp_face_mesh = mp.solutions.face_mesh
+def get_landmark_embedding(image_path, face_mesh=None):
+    import cv2
 
-def get_landmark_embedding(image_path):
     img = cv2.imread(image_path)
+    if img is None:
+        return None
     rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-    with mp_face_mesh.FaceMesh(
-        static_image_mode=True,
-        max_num_faces=1,
-        refine_landmarks=True,
-        min_detection_confidence=0.5
-    ) as face_mesh:
+    # Reuse this thread's FaceMesh instead of building a graph per image
+    if face_mesh is None:
+        face_mesh = get_face_mesh()
 
-        result = face_mesh.process(rgb)
+    result = face_mesh.process(rgb)
 
-        if not result.multi_face_landmarks:
-            return None
+    if not result.multi_face_landmarks:
+        return None
 
-        face = result.multi_face_landmarks[0]
+    face = result.multi_face_landmarks[0]
 
-        embedding = []
-        for lm in face.landmark:
-            embedding.extend([lm.x, lm.y, lm.z])
-
-        embedding = np.array(embedding)
-        embedding = embedding / np.linalg.norm(embedding)
-        return embedding
+    embedding = landmarks_to_array(face).ravel().astype(np.float64)
+    embedding = embedding / np.linalg.norm(embedding)
+    return embedding
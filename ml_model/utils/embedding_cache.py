@@ -0,0 +1,183 @@
+"""
+Content-addressed cache of per-image embeddings for register.py.
+
+Entries are keyed by the SHA-1 of the image bytes plus a fingerprint of the
+extractor configuration, so a renamed photo is still a hit and changing the
+FaceMesh settings or embedding layout invalidates everything. Hashing every
+image on each run would defeat the purpose, so digests are memoized by
+(path, size, mtime) and a file is only re-read when it changes.
+
+The cache also remembers which images each person's mean was built from,
+letting a re-run skip people whose photos are unchanged.
+
+Layout of the cache directory:
+
+    entries/<ab>/<key>.npy   one embedding per image (empty array: no face)
+    stat_memo.json           {path: [size, mtime_ns, sha1]}
+    persons.json             {person: signature of the images used}
+
+Least recently used entries are evicted once there are more than
+``max_entries``.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 100000
+HASH_CHUNK_SIZE = 1 << 20
+
+# Stored for images without a detectable face, so they are not retried
+NO_FACE = np.zeros(0, dtype=np.float32)
+
+
+def config_fingerprint(config):
+    """Short hash of the extractor settings an embedding depends on"""
+    encoded = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+def file_digest(path):
+    """SHA-1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache file {path}: {e}")
+        return {}
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingCache:
+    """Per-image embeddings keyed by image content and extractor config"""
+
+    def __init__(self, directory, config, max_entries=DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.fingerprint = config_fingerprint(config)
+        self.max_entries = max_entries
+        self.entries_dir = os.path.join(directory, 'entries')
+        self.memo_path = os.path.join(directory, 'stat_memo.json')
+        self.persons_path = os.path.join(directory, 'persons.json')
+        os.makedirs(self.entries_dir, exist_ok=True)
+
+        self._memo = _load_json(self.memo_path)
+        self._persons = _load_json(self.persons_path)
+        self._seen_paths = set()
+        self.hits = 0
+        self.misses = 0
+
+    # Keys
+
+    def key_for(self, path):
+        """Cache key for an image, hashing it only if it changed since last seen"""
+        st = os.stat(path)
+        memo = self._memo.get(path)
+        if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            digest = memo[2]
+        else:
+            digest = file_digest(path)
+            self._memo[path] = [st.st_size, st.st_mtime_ns, digest]
+        self._seen_paths.add(path)
+        return f"{self.fingerprint}-{digest}"
+
+    def _entry_path(self, key):
+        digest = key.rsplit('-', 1)[-1]
+        return os.path.join(self.entries_dir, digest[:2], key + '.npy')
+
+    # Entries
+
+    def get(self, key):
+        """Cached embedding, NO_FACE, or None on a miss"""
+        path = self._entry_path(key)
+        try:
+            emb = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return emb
+
+    def put(self, key, emb):
+        """Store an embedding (None records that the image has no face)"""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        value = NO_FACE if emb is None else np.asarray(emb, dtype=np.float32)
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, value)
+        os.replace(tmp_path, path)
+
+    # People
+
+    @staticmethod
+    def signature(keys):
+        """Identity of the set of images a person's mean is built from"""
+        return hashlib.sha1('\n'.join(sorted(keys)).encode('utf-8')).hexdigest()
+
+    def person_changed(self, person, keys):
+        """True unless ``person`` was last enrolled from exactly these images"""
+        return self._persons.get(person) != self.signature(keys)
+
+    def set_person(self, person, keys):
+        self._persons[person] = self.signature(keys)
+
+    def forget_person(self, person):
+        self._persons.pop(person, None)
+
+    # Persistence
+
+    def save(self, persons=None):
+        """Write the memo and person signatures, then evict old entries.
+
+        Memo entries for images not seen in this run are dropped, as are
+        signatures of people not in ``persons`` when it is given.
+        """
+        self._memo = {p: m for p, m in self._memo.items() if p in self._seen_paths}
+        if persons is not None:
+            self._persons = {p: s for p, s in self._persons.items() if p in persons}
+        _write_json(self.memo_path, self._memo)
+        _write_json(self.persons_path, self._persons)
+        return self.evict()
+
+    def evict(self):
+        """Remove least recently used entries beyond max_entries, returning how many"""
+        entries = []
+        for root, _, files in os.walk(self.entries_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.stat(path).st_mtime_ns, path))
+                except OSError:
+                    continue
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return 0
+
+        entries.sort()
+        for _, path in entries[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return excess
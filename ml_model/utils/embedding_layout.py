@@ -0,0 +1,86 @@
+"""
+Layout of the face embedding vector.
+
+Shared by utils/extract_embedding.get_embedding, the gallery matcher and
+extractEmbedding in web_app/script.js:
+
+    [x0, y0, z0, ..., x477, y477, z477]   raw refined FaceMesh landmarks, L2-normalized
+    [d0, ..., d6]                          keypoint distances, L2-normalized separately
+"""
+
+import itertools
+import operator
+import numpy as np
+
+NUM_LANDMARKS = 478
+RAW_DIM = NUM_LANDMARKS * 3
+
+# FaceMesh landmark indices used for the derived distance features
+KEYPOINTS = {
+    "leftEye": 33,
+    "rightEye": 263,
+    "nose": 1,
+    "chin": 152,
+    "leftMouth": 61,
+    "rightMouth": 291
+}
+
+# Order of the derived distances - must match script.js
+DERIVED_PAIRS = [
+    ("leftEye", "rightEye"),
+    ("leftEye", "nose"),
+    ("rightEye", "nose"),
+    ("nose", "chin"),
+    ("leftMouth", "rightMouth"),
+    ("leftEye", "chin"),
+    ("rightEye", "chin")
+]
+
+DERIVED_DIM = len(DERIVED_PAIRS)
+EMBEDDING_DIM = RAW_DIM + DERIVED_DIM
+
+# Landmark index pairs of the derived distances, as arrays for fancy indexing
+_PAIR_A = np.array([KEYPOINTS[a] for a, _ in DERIVED_PAIRS], dtype=np.intp)
+_PAIR_B = np.array([KEYPOINTS[b] for _, b in DERIVED_PAIRS], dtype=np.intp)
+_XYZ = operator.attrgetter('x', 'y', 'z')
+
+
+def landmarks_to_array(landmarks):
+    """(N, 3) float32 array of FaceMesh landmarks.
+
+    Accepts a NormalizedLandmarkList message, its ``.landmark`` sequence,
+    or an (N, 3) array.
+    """
+    if isinstance(landmarks, np.ndarray):
+        return np.asarray(landmarks, dtype=np.float32).reshape(-1, 3)
+    landmarks = getattr(landmarks, 'landmark', landmarks)
+    coords = np.fromiter(
+        itertools.chain.from_iterable(map(_XYZ, landmarks)),
+        dtype=np.float32, count=3 * len(landmarks)
+    )
+    return coords.reshape(-1, 3)
+
+
+def landmarks_to_embedding(landmarks, out=None):
+    """Embedding for one face, written into ``out`` (EMBEDDING_DIM float32) if given.
+
+    ``landmarks`` is anything landmarks_to_array accepts.
+    """
+    points = landmarks_to_array(landmarks)
+    if points.shape != (NUM_LANDMARKS, 3):
+        raise ValueError(f"expected {NUM_LANDMARKS} landmarks, got {len(points)}")
+    if out is None:
+        out = np.empty(EMBEDDING_DIM, dtype=np.float32)
+
+    raw = out[:RAW_DIM]
+    derived = out[RAW_DIM:]
+    raw[:] = points.ravel()
+    diff = points[_PAIR_A] - points[_PAIR_B]
+    np.sqrt(np.einsum('ij,ij->i', diff, diff), out=derived)
+
+    # Normalize each part independently, as in script.js
+    for part in (raw, derived):
+        norm = np.linalg.norm(part)
+        if norm > 0:
+            part /= norm
+    return out
@@ -0,0 +1,452 @@
+"""
+Binary, memory-mapped embedding gallery.
+
+The gallery lives in a directory holding two files:
+
+    embeddings-<n>.f32   float32 matrix, one unit-length row per enrolled vector
+    index.json           {"dim", "matrix", "capacity", "used", "version",
+                          "entries": {name: {"row", "count", "saved_at"}},
+                          "changes": [[version, op, name], ...], "changes_since"}
+
+A person occupies ``count`` consecutive rows starting at ``row``: one per
+template (``count`` is omitted when it is 1).
+
+The matrix is memory-mapped, so opening the store costs the same no matter
+how many people are enrolled and the gallery matcher scores the mapped rows
+directly without copying them. Updates overwrite a person's rows in place
+when the number of templates is unchanged and move them to the end otherwise.
+New people are appended at the end and deleted people leave a hole that is
+never handed to someone else, so a Gallery built from an earlier snapshot
+can never attribute a new person's vector to an old name. Holes are
+reclaimed by compact(), which writes a new matrix file; replacing
+index.json to point at it is the single commit point.
+
+Every save and delete bumps ``version`` and records ``[version, op, name]``
+in a change log kept in the same index (put_many() saves many people under
+one version and one index write, which bulk imports rely on), so clients holding an older
+version can fetch only what changed (changes()). The log keeps the last
+CHANGE_LOG_SIZE changes; ``changes_since`` is the oldest version it can
+still bring up to date.
+
+Writers in different processes are serialized with a lock file and every
+process reloads the index when another one has changed it.
+
+Usage:
+    python -m utils.embedding_store ../data/gallery import output/ ../web_app/embeddings/
+    python -m utils.embedding_store ../data/gallery list
+"""
+
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+from utils.embedding_layout import EMBEDDING_DIM
+from utils.file_lock import FileLock, file_id
+from utils import metrics
+
+MATRIX_FILE = 'embeddings-{}.f32'
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'gallery.lock'
+
+MIN_CAPACITY = 64
+# Compact once holes make up this share of the used rows
+COMPACT_HOLE_RATIO = 0.5
+
+# Changes kept for delta sync; older clients are sent a full snapshot
+CHANGE_LOG_SIZE = 1024
+
+# People saved per index write by bulk imports (import_json_dir, register.py)
+PUT_BATCH_SIZE = 1024
+
+EMBEDDING_SUFFIX = '_embedding.json'
+
+
+def _rows(entry):
+    """Row indices of a person's templates"""
+    return range(entry['row'], entry['row'] + entry.get('count', 1))
+
+
+class EmbeddingStore:
+    """Named embeddings in a memory-mapped float32 matrix"""
+
+    def __init__(self, directory, dim=EMBEDDING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.matrix_path = os.path.join(directory, MATRIX_FILE.format(0))
+        self.index_path = os.path.join(directory, INDEX_FILE)
+
+        self.version = 0
+        self._capacity = 0
+        self._used = 0
+        # Rows held by enrolled people (the rest of ``_used`` are holes)
+        self._live = 0
+        self._entries = {}
+        self._changes = []
+        self._changes_since = 0
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._index_id = None
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(directory, LOCK_FILE))
+
+        with self._file_lock:
+            if not os.path.exists(self.index_path):
+                self._resize(MIN_CAPACITY)
+                self._write_index()
+            self._load()
+
+    # Loading
+
+    def _load(self):
+        with metrics.timed('gallery_index_load'), open(self.index_path, 'r') as f:
+            self._index_id = file_id(f)
+            index = json.load(f)
+
+        if index['dim'] != self.dim:
+            raise ValueError(f"gallery in {self.directory} holds {index['dim']}-value embeddings, "
+                             f"expected {self.dim}")
+
+        self.version = index['version']
+        self._used = index['used']
+        self._entries = index['entries']
+        self._live = sum(entry.get('count', 1) for entry in self._entries.values())
+        self._changes = index.get('changes', [])
+        # Indexes written before the change log existed cannot say what changed
+        self._changes_since = index.get('changes_since', index['version'])
+        # Remap after another process grew or compacted the matrix
+        matrix_path = os.path.join(self.directory, index['matrix'])
+        if matrix_path != self.matrix_path or index['capacity'] != self._capacity:
+            self.matrix_path = matrix_path
+            self._map(index['capacity'])
+
+    def _map(self, capacity):
+        self._capacity = capacity
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+',
+                                 shape=(capacity, self.dim))
+
+    def _refresh(self):
+        try:
+            current = file_id(self.index_path)
+        except FileNotFoundError:
+            return
+        if current != self._index_id:
+            self._load()
+
+    def refresh(self):
+        """Pick up changes made by other processes"""
+        with self._lock:
+            self._refresh()
+
+    # Reads
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._entries)
+
+    def __contains__(self, name):
+        with self._lock:
+            self._refresh()
+            return name in self._entries
+
+    def names(self):
+        """Return enrolled names, sorted"""
+        with self._lock:
+            self._refresh()
+            return sorted(self._entries)
+
+    def entry(self, name):
+        """Return {'row', 'saved_at'} (and 'count' for several templates) for a name, or None"""
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    def get(self, name):
+        """Return a copy of a person's (unit-length) embedding, or None.
+
+        People with several templates get a (templates, dim) matrix.
+        """
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if 'count' in entry:
+                return np.array(self._matrix[_rows(entry)])
+            return np.array(self._matrix[entry['row']])
+
+    def snapshot(self):
+        """Return (version, row_names, matrix) for the gallery matcher.
+
+        ``matrix`` is a view of the mapped rows, not a copy. ``row_names``
+        has one entry per row, repeated over a person's consecutive template
+        rows, and None for holes left by deleted people.
+        """
+        with self._lock:
+            self._refresh()
+            row_names = [None] * self._used
+            for name, entry in self._entries.items():
+                for row in _rows(entry):
+                    row_names[row] = name
+            return self.version, row_names, self._matrix[:self._used]
+
+    def matrix_file(self):
+        """Name of the matrix file; it only changes when compaction renumbers the rows"""
+        with self._lock:
+            self._refresh()
+            return os.path.basename(self.matrix_path)
+
+    def vectors(self):
+        """Return (version, names, matrix): a copy of every row, sorted by name.
+
+        A name is repeated once per template, on consecutive rows.
+        """
+        with self._lock:
+            self._refresh()
+            names, matrix = self._copy_rows(sorted(self._entries))
+            return self.version, names, matrix
+
+    def _copy_rows(self, people):
+        """(row names, copied rows) for people, one row per template"""
+        names, rows = [], []
+        for name in people:
+            for row in _rows(self._entries[name]):
+                names.append(name)
+                rows.append(row)
+        return names, self._matrix[rows] if rows else np.zeros((0, self.dim), np.float32)
+
+    def changes(self, since):
+        """Return (version, delta) bringing a client at version ``since`` up to date.
+
+        ``delta`` is None when the change log no longer reaches back to
+        ``since`` (or ``since`` is from the future) and the client needs a
+        full snapshot. Otherwise it is a dict with the ``added``,
+        ``updated`` and ``removed`` names, and ``names``/``matrix`` holding
+        the current rows of the added and updated people (as in vectors()).
+        """
+        with self._lock:
+            self._refresh()
+            if since < self._changes_since or since > self.version:
+                return self.version, None
+
+            # Only a name's first and last change matter
+            first, last = {}, {}
+            for version, op, name in self._changes:
+                if version > since:
+                    first.setdefault(name, op)
+                    last[name] = op
+
+            added, updated, removed = [], [], []
+            for name in sorted(last):
+                existed = first[name] != 'add'
+                if last[name] == 'delete':
+                    if existed:
+                        removed.append(name)
+                elif existed:
+                    updated.append(name)
+                else:
+                    added.append(name)
+
+            names, matrix = self._copy_rows(added + updated)
+            return self.version, {'added': added, 'updated': updated, 'removed': removed,
+                                  'names': names, 'matrix': matrix}
+
+    # Writes
+
+    def put(self, name, embedding, saved_at=None):
+        """Add or replace a person's embedding, or their (templates, dim) matrix of templates"""
+        self.put_many([(name, embedding, saved_at)])
+
+    def put_many(self, items):
+        """Add or replace several people with one version bump and one index write.
+
+        ``items`` are (name, embedding, saved_at) tuples as for put(); every
+        embedding is validated before anything is written.
+        """
+        prepared = [(name, self._unit_rows(embedding), saved_at) for name, embedding, saved_at in items]
+        if not prepared:
+            return
+
+        with self._lock, self._file_lock:
+            self._refresh()
+            changes = [self._place(name, vectors, saved_at) for name, vectors, saved_at in prepared]
+            self._matrix.flush()
+            self._commit(changes)
+            self._maybe_compact()
+
+    def _unit_rows(self, embedding):
+        vectors = np.array(embedding, dtype=np.float32, ndmin=2)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim or not len(vectors):
+            raise ValueError(f"expected embeddings of {self.dim} values, got shape {np.shape(embedding)}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def _place(self, name, vectors, saved_at):
+        """Write a person's rows and entry; returns the (op, name) change"""
+        count = len(vectors)
+        entry = self._entries.get(name)
+        op = 'update' if entry else 'add'
+        if entry is None or entry.get('count', 1) != count:
+            # New rows at the end; a replaced block becomes a hole
+            if entry is not None:
+                self._live -= entry.get('count', 1)
+            while self._used + count > self._capacity:
+                self._resize(max(MIN_CAPACITY, self._capacity * 2))
+            entry = {'row': self._used}
+            if count > 1:
+                entry['count'] = count
+            self._used += count
+            self._live += count
+        self._matrix[_rows(entry)] = vectors
+        entry['saved_at'] = saved_at or datetime.utcnow().isoformat()
+        self._entries[name] = entry
+        return op, name
+
+    def delete(self, name):
+        """Remove a person, returning False if they are not enrolled"""
+        with self._lock, self._file_lock:
+            self._refresh()
+            entry = self._entries.pop(name, None)
+            if entry is None:
+                return False
+            self._live -= entry.get('count', 1)
+            self._commit([('delete', name)])
+            self._maybe_compact()
+            return True
+
+    def compact(self):
+        """Rewrite the matrix without holes left by deleted people"""
+        with self._lock, self._file_lock:
+            self._refresh()
+            self._compact()
+
+    def _maybe_compact(self):
+        if self._used - self._live >= max(MIN_CAPACITY, self._used * COMPACT_HOLE_RATIO):
+            self._compact()
+
+    def _compact(self):
+        names = sorted(self._entries, key=lambda n: self._entries[n]['row'])
+        used = sum(self._entries[name].get('count', 1) for name in names)
+        capacity = max(MIN_CAPACITY, used)
+        old_path = self.matrix_path
+        new_path = os.path.join(self.directory, MATRIX_FILE.format(self.version + 1))
+
+        rows = np.memmap(new_path, dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+        new_row = 0
+        for name in names:
+            entry = self._entries[name]
+            block = _rows(entry)
+            rows[new_row:new_row + len(block)] = self._matrix[block.start:block.stop]
+            entry['row'] = new_row
+            new_row += len(block)
+        rows.flush()
+        del rows
+
+        self.matrix_path = new_path
+        self._used = self._live = used
+        self._map(capacity)
+        self._commit()
+        # Processes still mapping the old file keep their view of it (POSIX)
+        try:
+            os.remove(old_path)
+        except OSError as e:
+            print(f"Could not remove old gallery matrix {old_path}: {e}")
+
+    def _resize(self, capacity):
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._map(capacity)
+
+    def _commit(self, changes=()):
+        self.version += 1
+        if changes:
+            self._changes.extend([self.version, *change] for change in changes)
+            if len(self._changes) > CHANGE_LOG_SIZE:
+                dropped = self._changes[:-CHANGE_LOG_SIZE]
+                self._changes = self._changes[-CHANGE_LOG_SIZE:]
+                self._changes_since = dropped[-1][0]
+        self._write_index()
+
+    def _write_index(self):
+        index = {
+            'dim': self.dim,
+            'matrix': os.path.basename(self.matrix_path),
+            'capacity': self._capacity,
+            'used': self._used,
+            'version': self.version,
+            'entries': self._entries,
+            'changes': self._changes,
+            'changes_since': self._changes_since
+        }
+        tmp_path = self.index_path + '.tmp'
+        with metrics.timed('gallery_index_save'), open(tmp_path, 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self._index_id = file_id(self.index_path)
+
+    # Import
+
+    def import_json_dir(self, directory, overwrite=False):
+        """Import ``<name>_embedding.json`` files, returning how many were added.
+
+        Files written by ``register.py --templates`` contribute their templates.
+        """
+        imported = 0
+        batch = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(EMBEDDING_SUFFIX):
+                continue
+            name = filename[:-len(EMBEDDING_SUFFIX)]
+            if name in self and not overwrite:
+                continue
+            try:
+                with open(os.path.join(directory, filename), 'r') as f:
+                    data = json.load(f)
+                vectors = self._unit_rows(data.get('templates') or data['embedding'])
+            except Exception as e:
+                print(f"Skipping {filename}: {e}")
+                continue
+            batch.append((name, vectors, data.get('saved_at')))
+            if len(batch) >= PUT_BATCH_SIZE:
+                self.put_many(batch)
+                imported += len(batch)
+                batch = []
+        self.put_many(batch)
+        return imported + len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the binary embedding gallery')
+    parser.add_argument('gallery_dir')
+    sub = parser.add_subparsers(dest='command', required=True)
+    import_cmd = sub.add_parser('import', help='import *_embedding.json files')
+    import_cmd.add_argument('dirs', nargs='+')
+    import_cmd.add_argument('--overwrite', action='store_true')
+    sub.add_parser('list', help='list enrolled people')
+    sub.add_parser('compact', help='reclaim rows of deleted people')
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.gallery_dir)
+    if args.command == 'import':
+        for directory in args.dirs:
+            count = store.import_json_dir(directory, overwrite=args.overwrite)
+            print(f"✔ Imported {count} embeddings from {directory}")
+    elif args.command == 'list':
+        for name in store.names():
+            print(name)
+    else:
+        store.compact()
+        print(f"✔ Compacted {args.gallery_dir}")
+
+
+if __name__ == '__main__':
+    main()
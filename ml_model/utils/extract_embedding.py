@@ -1,73 +1,103 @@
-import cv2
-import mediapipe as mp
 import numpy as np
+from utils.embedding_layout import EMBEDDING_DIM, landmarks_to_array, landmarks_to_embedding
+from utils.face_quality import FaceRejected, default_gate
+from utils.session_pool import SessionPool
+from utils import metrics
 
-mp_mesh = mp.solutions.face_mesh
+# cv2 and mediapipe take most of a second to import, so they are loaded on
+# first use: importing this module for EXTRACTOR_CONFIG or the pool is cheap
 
-def get_embedding(image_path):
-    img = cv2.imread(image_path)
-    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+# Settings for still images, shared by enrollment and server-side extraction
+STILL_IMAGE_OPTIONS = {
+    "static_image_mode": True,
+    "refine_landmarks": True,
+    "max_num_faces": 1,
+    "min_detection_confidence": 0.5
+}
 
-    with mp_mesh.FaceMesh(
-        static_image_mode=True,
-        refine_landmarks=True,
-        max_num_faces=1,
-        min_detection_confidence=0.5
-    ) as face_mesh:
+# Faces failing this gate are not embedded (None disables it)
+quality_gate = default_gate()
+
+# Everything an image's embedding depends on besides its pixels; cached
+# embeddings (utils/embedding_cache) are invalidated when this changes
+EXTRACTOR_CONFIG = {
+    "face_mesh": STILL_IMAGE_OPTIONS,
+    "embedding_dim": EMBEDDING_DIM,
+    "quality_gate": quality_gate.settings() if quality_gate else None,
+    "version": 1
+}
+
+def create_face_mesh(**options):
+    """New FaceMesh graph; prefer get_face_mesh, which reuses one per thread"""
+    import mediapipe as mp
+
+    return mp.solutions.face_mesh.FaceMesh(**(options or STILL_IMAGE_OPTIONS))
+
+face_mesh_pool = SessionPool(create_face_mesh)
+
+def get_face_mesh(**options):
+    """This thread's long-lived FaceMesh for ``options`` (default: still images)"""
+    return face_mesh_pool.get(**(options or STILL_IMAGE_OPTIONS))
+
+def close_face_meshes():
+    """Release every FaceMesh graph created in this process"""
+    face_mesh_pool.close_all()
+
+def decode_image(data):
+    """BGR image decoded in memory from encoded (JPEG, PNG, ...) bytes"""
+    import cv2
+
+    with metrics.timed('decode'):
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("not a readable image")
+    return img
+
+def embedding_from_image(img, face_mesh=None, gate=quality_gate):
+    """Embedding of the first face in a BGR image, or None if there is no face.
+
+    Raises FaceRejected if the face fails ``gate``.
+    """
+    import cv2
+
+    if face_mesh is None:
+        face_mesh = get_face_mesh()
+
+    with metrics.timed('extraction'):
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
         results = face_mesh.process(rgb)
 
         if not results.multi_face_landmarks:
             return None
 
-        face = results.multi_face_landmarks[0]
-        landmarks = face.landmark
-
-        # 1. Raw Coordinates
-        raw = []
-        for lm in landmarks:
-            raw.extend([lm.x, lm.y, lm.z])
-        
-        raw = np.array(raw, dtype=np.float32)
-        
-        # 2. Derived Features (Distances) - Must match script.js
-        # Keypoints
-        KP = {
-            "leftEye": 33,
-            "rightEye": 263,
-            "nose": 1,
-            "chin": 152,
-            "leftMouth": 61,
-            "rightMouth": 291
-        }
-
-        def dist(i1, i2):
-            p1 = landmarks[i1]
-            p2 = landmarks[i2]
-            return np.sqrt((p1.x - p2.x)**2 + (p1.y - p2.y)**2 + (p1.z - p2.z)**2)
-
-        derived = [
-            dist(KP["leftEye"], KP["rightEye"]),
-            dist(KP["leftEye"], KP["nose"]),
-            dist(KP["rightEye"], KP["nose"]),
-            dist(KP["nose"], KP["chin"]),
-            dist(KP["leftMouth"], KP["rightMouth"]),
-            dist(KP["leftEye"], KP["chin"]),
-            dist(KP["rightEye"], KP["chin"])
-        ]
-        
-        derived = np.array(derived, dtype=np.float32)
-
-        # 3. Normalization (independently, as in script.js)
-        raw_norm = np.linalg.norm(raw)
-        if raw_norm > 0:
-            raw = raw / raw_norm
-            
-        der_norm = np.linalg.norm(derived)
-        if der_norm > 0:
-            derived = derived / der_norm
-
-        # 4. Concatenate
-        final_emb = np.concatenate((raw, derived))
-        
-        return final_emb
+        points = landmarks_to_array(results.multi_face_landmarks[0])
+    if gate is not None:
+        gate.require(rgb, points, order='rgb')
+    return landmarks_to_embedding(points)
+
+def get_embedding(image_path, face_mesh=None):
+    """Embedding of the first face in an image file, or None (also for faces failing the quality gate).
+
+    Uses this thread's pooled FaceMesh unless one is passed in, so the graph
+    is built once rather than per image.
+    """
+    import cv2
+
+    with metrics.timed('decode'):
+        img = cv2.imread(image_path)
+    if img is None:
+        return None
+    try:
+        return embedding_from_image(img, face_mesh)
+    except FaceRejected as e:
+        print(f"Skipping {image_path}: {e}")
+        return None
+
+def get_embedding_from_bytes(data, face_mesh=None):
+    """Embedding of the first face in an encoded image held in memory, or None.
+
+    Raises ValueError if the bytes are not an image, and FaceRejected (a
+    ValueError) if the face fails the quality gate.
+    """
+    return embedding_from_image(decode_image(data), face_mesh)
@@ -0,0 +1,174 @@
+"""
+Face quality gate applied between landmark detection and embedding.
+
+Blurry, tiny, badly lit or strongly turned faces give embeddings that match
+nobody reliably (or the wrong person), so they are dropped before the
+embedding, drift and matching work. Checks run cheapest first and stop at
+the first failure:
+
+    too_small    shorter side of the landmark box, in pixels
+    off_pose     yaw, pitch or roll estimated from keypoints 33, 263 and 152
+    too_dark     mean gray level of the face crop
+    too_bright
+    blurry       variance of the Laplacian of the face crop, resized to a
+                 fixed width so the threshold does not depend on face size
+
+Only the face crop is converted and filtered, never the whole frame.
+Every result is counted in the ``face_quality_checks_total`` metric.
+Thresholds default to the QUALITY_* settings in config.py.
+"""
+
+import math
+import numpy as np
+from config import (
+    QUALITY_GATE_ENABLED, QUALITY_MIN_FACE_SIZE, QUALITY_MAX_YAW, QUALITY_MAX_PITCH, QUALITY_MAX_ROLL,
+    QUALITY_MIN_BRIGHTNESS, QUALITY_MAX_BRIGHTNESS, QUALITY_MIN_SHARPNESS
+)
+from utils.embedding_layout import KEYPOINTS
+from utils import metrics
+
+REASONS = ('too_small', 'off_pose', 'too_dark', 'too_bright', 'blurry')
+
+# Width the face crop is scaled to before measuring sharpness
+SHARPNESS_WIDTH = 128
+
+checks = metrics.registry.counter(
+    'face_quality_checks_total', 'Faces checked by the quality gate, by result (ok or a rejection reason)',
+    labels=('result',))
+
+
+class FaceRejected(ValueError):
+    """Raised for a face that fails the quality gate; ``reason`` is one of REASONS"""
+
+    def __init__(self, reason):
+        super().__init__(f"face rejected: {reason.replace('_', ' ')}")
+        self.reason = reason
+
+
+def _pixels(points, width, height):
+    """Landmarks in pixels; FaceMesh scales z like x"""
+    return np.asarray(points, dtype=np.float32)[:, :3] * np.array([width, height, width], dtype=np.float32)
+
+
+def face_box(points, width, height):
+    """(x0, y0, x1, y1) integer pixel box around the landmarks, clipped to the image"""
+    xy = _pixels(points, width, height)[:, :2]
+    x0, y0 = np.floor(xy.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(xy.max(axis=0)).astype(int)
+    return max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+
+
+def head_pose(points, width=1, height=1):
+    """Approximate (yaw, pitch, roll) in degrees; all zero for a face looking at the camera.
+
+    Roll is the tilt of the line through the outer eye corners. Yaw and pitch
+    come from the normal of the plane through both eye corners and the chin.
+    """
+    p = _pixels(points, width, height)
+    left, right, chin = p[KEYPOINTS['leftEye']], p[KEYPOINTS['rightEye']], p[KEYPOINTS['chin']]
+    across = right - left
+    up = (left + right) / 2 - chin
+    normal = np.cross(across, up)
+    length = np.linalg.norm(normal)
+    if not length:
+        return 90.0, 90.0, 0.0
+    nx, ny, nz = normal / length
+    # Image y points down and z away from the camera; a frontal normal is (0, 0, -1)
+    yaw = math.degrees(math.atan2(nx, -nz))
+    pitch = math.degrees(math.atan2(ny, -nz))
+    roll = math.degrees(math.atan2(across[1], across[0]))
+    return yaw, pitch, roll
+
+
+class QualityGate:
+    """Rejects faces unfit for embedding; thresholds of None disable a check"""
+
+    def __init__(self, min_face_size=QUALITY_MIN_FACE_SIZE, max_yaw=QUALITY_MAX_YAW,
+                 max_pitch=QUALITY_MAX_PITCH, max_roll=QUALITY_MAX_ROLL,
+                 min_brightness=QUALITY_MIN_BRIGHTNESS, max_brightness=QUALITY_MAX_BRIGHTNESS,
+                 min_sharpness=QUALITY_MIN_SHARPNESS):
+        self.min_face_size = min_face_size
+        self.max_yaw = max_yaw
+        self.max_pitch = max_pitch
+        self.max_roll = max_roll
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_sharpness = min_sharpness
+
+    def settings(self):
+        """Thresholds as a dict (part of the extractor configuration cached embeddings depend on)"""
+        return dict(vars(self))
+
+    def _crop(self, image, box, order):
+        import cv2
+
+        x0, y0, x1, y1 = box
+        crop = image[y0:y1, x0:x1]
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY if order == 'rgb' else cv2.COLOR_BGR2GRAY)
+        return crop
+
+    def _sharpness(self, gray):
+        import cv2
+
+        height, width = gray.shape
+        scaled = cv2.resize(gray, (SHARPNESS_WIDTH, max(1, round(height * SHARPNESS_WIDTH / width))),
+                            interpolation=cv2.INTER_AREA)
+        return float(cv2.Laplacian(scaled, cv2.CV_64F).var())
+
+    def measure(self, image, points, order='bgr'):
+        """Every quality measure of one face (slower than check, which stops early)"""
+        height, width = image.shape[:2]
+        box = face_box(points, width, height)
+        yaw, pitch, roll = head_pose(points, width, height)
+        size = min(box[2] - box[0], box[3] - box[1])
+        result = {'size': size, 'yaw': yaw, 'pitch': pitch, 'roll': roll,
+                  'brightness': None, 'sharpness': None}
+        if size > 0:
+            gray = self._crop(image, box, order)
+            result['brightness'] = float(gray.mean())
+            result['sharpness'] = self._sharpness(gray)
+        return result
+
+    def check(self, image, points, order='bgr'):
+        """Return the reason a face (landmarks on image) is rejected, or None if it passes.
+
+        ``order`` is the channel order of a color image, 'bgr' or 'rgb'.
+        """
+        with metrics.timed('quality'):
+            reason = self._reason(image, points, order)
+        checks.inc(reason or 'ok')
+        return reason
+
+    def _reason(self, image, points, order):
+        height, width = image.shape[:2]
+        box = face_box(points, width, height)
+        size = min(box[2] - box[0], box[3] - box[1])
+        if size <= 0 or (self.min_face_size is not None and size < self.min_face_size):
+            return 'too_small'
+
+        yaw, pitch, roll = head_pose(points, width, height)
+        for value, limit in ((yaw, self.max_yaw), (pitch, self.max_pitch), (roll, self.max_roll)):
+            if limit is not None and abs(value) > limit:
+                return 'off_pose'
+
+        gray = self._crop(image, box, order)
+        brightness = float(gray.mean())
+        if self.min_brightness is not None and brightness < self.min_brightness:
+            return 'too_dark'
+        if self.max_brightness is not None and brightness > self.max_brightness:
+            return 'too_bright'
+        if self.min_sharpness is not None and self._sharpness(gray) < self.min_sharpness:
+            return 'blurry'
+        return None
+
+    def require(self, image, points, order='bgr'):
+        """Raise FaceRejected unless the face passes"""
+        reason = self.check(image, points, order)
+        if reason is not None:
+            raise FaceRejected(reason)
+
+
+def default_gate():
+    """A QualityGate with the configured thresholds, or None if QUALITY_GATE_ENABLED is off"""
+    return QualityGate() if QUALITY_GATE_ENABLED else None
@@ -0,0 +1,68 @@
+"""
+Exclusive file lock shared between processes.
+
+Used to serialize writers when several API worker processes share the same
+data files. Uses ``fcntl.flock`` on POSIX and ``msvcrt.locking`` on Windows.
+"""
+
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Blocking exclusive lock on ``path`` (created if missing)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+
+    def acquire(self):
+        fh = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            else:
+                fh.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.001)
+        except BaseException:
+            fh.close()
+            raise
+        self._fh = fh
+
+    def release(self):
+        fh, self._fh = self._fh, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            fh.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def file_id(fh_or_path):
+    """Identity of the file behind a handle or path, changes when it is replaced"""
+    if isinstance(fh_or_path, (str, os.PathLike)):
+        st = os.stat(fh_or_path)
+    else:
+        st = os.fstat(fh_or_path.fileno())
+    return (st.st_dev, st.st_ino)
@@ -0,0 +1,378 @@
+"""
+Server-side gallery matcher.
+
+All enrolled embeddings are held as one contiguous, row-normalized float32
+matrix, so scoring a query against every person is a single matrix-vector
+product instead of one cosine_similarity call per person. Batches of
+queries are scored with one matrix-matrix product.
+
+A person may have several templates (e.g. different lighting or pose) on
+consecutive rows under the same name. Their row scores are reduced to one
+score per person with a segmented reduction (np.maximum.reduceat) over the
+same score matrix, so K templates per person cost one larger matrix product
+rather than K lookups. With ``template_top`` > 1 a person scores the mean of
+their best ``template_top`` templates instead of the best one.
+
+For very large galleries an approximate index (utils/ann_index.IVFIndex)
+can be attached; the brute-force matrix product stays the exact fallback.
+
+Clients download the gallery with encode_gallery's binary layout:
+
+    uint32 (little-endian)  length of the JSON header, a multiple of 4
+    JSON header             {"version", "dim", "names", ...}, space padded
+    float32 rows            one little-endian row per entry of names, in order
+"""
+
+import json
+import os
+import struct
+import threading
+import numpy as np
+from utils.embedding_layout import EMBEDDING_DIM
+from utils import metrics
+
+EMBEDDING_SUFFIX = '_embedding.json'
+
+# Queries scored per matrix product; bounds the (queries x gallery) score buffer
+QUERY_CHUNK_SIZE = 1024
+
+
+def normalize_rows(matrix):
+    """Return float32 rows scaled to unit length (zero rows stay zero)"""
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2, order='C')
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def cluster_templates(embeddings, k):
+    """Up to ``k`` unit-length templates: spherical k-means centroids of a person's embeddings"""
+    from utils.ann_index import spherical_kmeans
+
+    rows = normalize_rows(embeddings)
+    if len(rows) <= k:
+        return rows
+    return spherical_kmeans(rows, k, rng=np.random.default_rng(0))
+
+
+def encode_gallery(version, names, matrix, **fields):
+    """Pack a gallery snapshot (or delta) into the binary download layout.
+
+    Extra keyword fields are added to the JSON header.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype='<f4')
+    header = dict(fields, version=version, dim=matrix.shape[1], names=list(names))
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad so the rows start 4-byte aligned and can be viewed as float32 directly
+    header += b' ' * (-len(header) % 4)
+    return struct.pack('<I', len(header)) + header + matrix.tobytes()
+
+
+def decode_gallery(data):
+    """Inverse of encode_gallery: returns (header, matrix) with a row per header['names']"""
+    (size,) = struct.unpack_from('<I', data)
+    header = json.loads(data[4:4 + size])
+    matrix = np.frombuffer(data, dtype='<f4', offset=4 + size).reshape(-1, header['dim'])
+    if len(matrix) != len(header['names']):
+        raise ValueError(f"gallery holds {len(matrix)} rows for {len(header['names'])} names")
+    return header, matrix
+
+
+class Gallery:
+    """Enrolled people and their embeddings as one matrix"""
+
+    def __init__(self, names, matrix, dim=EMBEDDING_DIM, normalized=False, template_top=1):
+        self.names = list(names)
+        self.dim = dim
+        self.version = None
+        self.template_top = template_top
+        # Optional approximate index with a search(queries, k) method
+        self.index = None
+        if not self.names:
+            self.matrix = np.zeros((0, dim), dtype=np.float32)
+        elif normalized:
+            # Already unit-length float32 rows (e.g. a memory-mapped store): no copy
+            self.matrix = matrix
+        else:
+            self.matrix = normalize_rows(matrix)
+
+        if self.matrix.shape != (len(self.names), dim):
+            raise ValueError(f"expected a {len(self.names)}x{dim} matrix, got {self.matrix.shape}")
+
+        # Rows without a name are holes left by deleted people and never match
+        self._holes = np.array([i for i, n in enumerate(self.names) if n is None], dtype=np.int64)
+
+        # One segment of consecutive rows per person; labels name the segments
+        starts = [i for i, n in enumerate(self.names) if i == 0 or n != self.names[i - 1]]
+        self.labels = [self.names[i] for i in starts]
+        people = [n for n in self.labels if n is not None]
+        if len(set(people)) != len(people):
+            raise ValueError("a person's templates must be on consecutive rows")
+        self.size = len(people)
+        if len(starts) == len(self.names):
+            self._starts = None
+        else:
+            self._starts = np.array(starts, dtype=np.int64)
+            self._segment_of_row = np.repeat(np.arange(len(starts)),
+                                             np.diff(np.append(self._starts, len(self.names))))
+
+    @classmethod
+    def from_dir(cls, directory, dim=EMBEDDING_DIM):
+        """Load every ``<name>_embedding.json`` file in a directory"""
+        names = []
+        rows = []
+
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if not filename.endswith(EMBEDDING_SUFFIX):
+                    continue
+                try:
+                    with open(os.path.join(directory, filename), 'r') as f:
+                        data = json.load(f)
+                    embedding = data['embedding']
+                except Exception as e:
+                    print(f"Skipping unreadable embedding {filename}: {e}")
+                    continue
+
+                if len(embedding) != dim:
+                    print(f"Skipping {filename}: expected {dim} values, got {len(embedding)}")
+                    continue
+
+                names.append(filename[:-len(EMBEDDING_SUFFIX)])
+                rows.append(embedding)
+
+        return cls(names, rows, dim=dim)
+
+    @classmethod
+    def from_store(cls, store, template_top=1):
+        """Build a gallery over an EmbeddingStore snapshot without copying rows"""
+        version, row_names, matrix = store.snapshot()
+        gallery = cls(row_names, matrix, dim=store.dim, normalized=True, template_top=template_top)
+        gallery.version = version
+        return gallery
+
+    def __len__(self):
+        return self.size
+
+    def identify(self, embedding, k=1):
+        """Return up to ``k`` (name, score) pairs, best first"""
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape != (self.dim,):
+            raise ValueError(f"expected an embedding of {self.dim} values, got {query.size}")
+        return self.identify_batch(query[np.newaxis, :], k=k)[0]
+
+    def identify_batch(self, embeddings, k=1):
+        """Return, for each query row, up to ``k`` (name, score) pairs, best first"""
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dim:
+            raise ValueError(f"expected embeddings of {self.dim} values, got shape {queries.shape}")
+
+        k = min(k, self.size)
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        labels = self.labels
+        results = []
+        with metrics.timed('matching'):
+            for start in range(0, len(queries), QUERY_CHUNK_SIZE):
+                chunk = queries[start:start + QUERY_CHUNK_SIZE]
+                if self.index is not None:
+                    rows = self.index.search(chunk, self._index_k(k))
+                    if self._starts is not None:
+                        rows = [self._best_per_person(*row, k) for row in rows]
+                else:
+                    rows = zip(*self.top_k(chunk, k))
+                # Approximate indexes may return holes; exact scores rank them last
+                results.extend(
+                    [(labels[i], s) for i, s in zip(row_top.tolist(), row_scores.tolist())
+                     if labels[i] is not None]
+                    for row_top, row_scores in rows
+                )
+        return results
+
+    def _index_k(self, k):
+        """Rows to ask the index for so that k distinct people are likely among them"""
+        if self._starts is None:
+            return k
+        return min(len(self.names), k * int(np.diff(np.append(self._starts, len(self.names))).max()))
+
+    def _best_per_person(self, ids, scores, k):
+        """Collapse index hits (rows, best first) to each person's best template"""
+        segments = self._segment_of_row[ids]
+        _, first = np.unique(segments, return_index=True)
+        first = np.sort(first)[:k]
+        return segments[first], scores[first]
+
+    def scores(self, queries):
+        """(queries x labels) similarity of each query to each person"""
+        scores = normalize_rows(queries) @ self.matrix.T
+        if len(self._holes):
+            scores[:, self._holes] = -np.inf
+        if self._starts is None:
+            return scores
+        if self.template_top <= 1:
+            return np.maximum.reduceat(scores, self._starts, axis=1)
+        return self._top_mean(scores)
+
+    def _top_mean(self, scores):
+        """Mean of each person's best template_top row scores"""
+        lengths = np.diff(np.append(self._starts, scores.shape[1]))
+        width = int(lengths.max())
+        # (segments x width) row indices, padded by repeating the segment's first row
+        offsets = np.arange(width)
+        pad = offsets >= lengths[:, np.newaxis]
+        rows = self._starts[:, np.newaxis] + np.where(pad, 0, offsets)
+
+        grouped = scores[:, rows]
+        grouped[:, pad] = -np.inf
+        grouped.sort(axis=2)
+        top = grouped[:, :, -self.template_top:]
+        finite = np.isfinite(top)
+        count = finite.sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(finite, top, 0).sum(axis=2) / count
+        mean[count == 0] = -np.inf
+        return mean.astype(np.float32)
+
+    def top_k(self, queries, k):
+        """Exact (indices into labels, scores) arrays of shape (len(queries), k), best first"""
+        scores = self.scores(queries)
+
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class LiveGallery:
+    """Gallery over an EmbeddingStore, rebuilt whenever the store changes.
+
+    Galleries with at least ``ann_min_size`` people get an IVF index. After
+    an enrollment or deletion the index is brought up to date from the
+    store's change log: changed rows are assigned to their nearest existing
+    cluster and holes dropped, which costs about as much as the change.
+    Training new clusters (at startup without a usable ``index_file``,
+    after compaction renumbers the rows, or once the index has grown by
+    ``recluster_growth`` since it was trained) runs in a background thread
+    while the previous index, or exact search, keeps serving. Trained
+    indexes are persisted to ``index_file`` with the store version they
+    match, so restarts load them instead of retraining.
+    """
+
+    def __init__(self, store, index_file=None, ann_min_size=None, nprobe=8, template_top=1,
+                 recluster_growth=0.5):
+        self.store = store
+        self.template_top = template_top
+        self.index_file = index_file
+        self.ann_min_size = ann_min_size
+        self.nprobe = nprobe
+        self.recluster_growth = recluster_growth
+        self._gallery = None
+        self._lock = threading.Lock()
+        # The index, the store version and matrix file it reflects, and its size when trained
+        self._index = None
+        self._index_version = None
+        self._index_matrix = None
+        self._trained_size = 0
+        self._loaded_file = False
+        self._training = None
+
+    def current(self):
+        """Return the gallery for the store's current version"""
+        self.store.refresh()
+        with self._lock:
+            gallery = self._gallery
+            if gallery is None or gallery.version != self.store.version:
+                with metrics.timed('gallery_load'):
+                    gallery = Gallery.from_store(self.store, template_top=self.template_top)
+                    if self.ann_min_size is not None and len(gallery) >= self.ann_min_size:
+                        gallery.index = self._index_for(gallery)
+                self._gallery = gallery
+            return gallery
+
+    def wait_for_index(self, timeout=None):
+        """Block until background training (if any) has finished"""
+        training = self._training
+        if training is not None:
+            training.join(timeout)
+
+    def _index_for(self, gallery):
+        """The index brought up to ``gallery``'s version, or None while one is trained; lock held"""
+        # Read after the snapshot: a compaction in between is then seen as one
+        matrix_file = self.store.matrix_file()
+        if self._index is None and not self._loaded_file:
+            self._loaded_file = True
+            self._load_file()
+
+        index = self._index
+        if index is None or self._index_matrix != matrix_file:
+            self._train()
+            return None
+        if self._index_version != gallery.version:
+            _, delta = self.store.changes(self._index_version)
+            if delta is None:
+                self._train()
+                return None
+            changed = set(delta['added']) | set(delta['updated'])
+            rows = np.array([i for i, name in enumerate(gallery.names) if name in changed], dtype=np.int64)
+            index = index.update(gallery.matrix, remove=gallery._holes, add=rows)
+            self._index, self._index_version = index, gallery.version
+        if len(index) > self._trained_size * (1 + self.recluster_growth):
+            self._train()
+        return index
+
+    def _load_file(self):
+        if not self.index_file or not os.path.exists(self.index_file):
+            return
+        from utils.ann_index import IVFIndex
+
+        try:
+            index, metadata = IVFIndex.load(self.index_file)
+        except Exception as e:
+            print(f"Ignoring unreadable ANN index {self.index_file}: {e}")
+            return
+        if 'version' not in metadata or 'matrix_file' not in metadata:
+            return
+        index.nprobe = min(self.nprobe, index.nlist)
+        self._index = index
+        self._index_version = int(metadata['version'])
+        self._index_matrix = str(metadata['matrix_file'])
+        self._trained_size = int(metadata.get('trained_size', len(index)))
+
+    def _train(self):
+        """Start training a new index in the background unless one is already training"""
+        if self._training is not None:
+            return
+        self._training = threading.Thread(target=self._run_training, name='ann-training', daemon=True)
+        self._training.start()
+
+    def _run_training(self):
+        from utils.ann_index import IVFIndex
+
+        index = None
+        try:
+            # Read before the snapshot: a compaction in between then triggers another training
+            matrix_file = self.store.matrix_file()
+            gallery = Gallery.from_store(self.store)
+            index = IVFIndex.build(gallery.matrix, nprobe=self.nprobe)
+            index = index.update(gallery.matrix, remove=gallery._holes)
+            if self.index_file:
+                index.save(self.index_file, version=np.int64(gallery.version),
+                           matrix_file=np.array(matrix_file), trained_size=np.int64(len(index)))
+        except Exception as e:
+            print(f"Error training ANN index: {e}")
+
+        with self._lock:
+            self._training = None
+            if index is None:
+                return
+            self._index, self._index_version = index, gallery.version
+            self._index_matrix, self._trained_size = matrix_file, len(index)
+            # Serve it right away, caught up with changes made while it trained
+            current = self._gallery
+            if current is not None and current.version is not None and len(current) >= self.ann_min_size:
+                current.index = self._index_for(current)
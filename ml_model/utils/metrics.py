@@ -0,0 +1,279 @@
+"""
+In-process metrics in the Prometheus text format, and a sampling profiler.
+
+Hot paths time themselves with ``timed``:
+
+    with metrics.timed('matching'):
+        scores = gallery @ query
+
+Each observation is two perf_counter() calls, a bisect over the bucket
+bounds and an uncontended lock, so instrumentation stays on in production.
+Values that are cheap to read but costly to track (gallery size, log file
+size) are gauges computed by a callback when /metrics is scraped.
+
+The sampling profiler is off by default. While running, a background
+thread records every other thread's Python stack every ``interval``
+seconds; profiled code pays nothing per call. Stacks are reported in the
+collapsed format read by flamegraph.pl and speedscope:
+
+    app.py:identify;gallery.py:identify_batch;gallery.py:scores 42
+"""
+
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from 100us to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """Observations counted into cumulative ``le`` buckets per combination of label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe the duration of the with-block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self._series.items())
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labels + ('le',), label_values + (_format_value(bound),)),
+                       cumulative)
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Gauge:
+    """Value read from a callback at scrape time; None or an error omits it"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return
+        if value is not None:
+            yield self.name, '', value
+
+
+class Registry:
+    """Named metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering (e.g. a module reloaded by tests) keeps the first metric
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read):
+        """Register (or replace) a gauge whose value comes from ``read()``"""
+        with self._lock:
+            self._metrics[name] = Gauge(name, help, read)
+            return self._metrics[name]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    'face_stage_duration_seconds', 'Time spent in instrumented hot-path stages', labels=('stage',))
+
+
+def timed(stage):
+    """Context manager that records the with-block's duration under ``stage``"""
+    return stage_seconds.time(stage)
+
+
+def file_size(path):
+    """Size of path in bytes, or None if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+class SamplingProfiler:
+    """Counts the Python stacks of every thread, sampled from a background thread"""
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.started_at = None
+        self._stacks = _Tally()
+        self._lock = threading.Lock()
+        # Held while starting or stopping; never taken by the sampling thread
+        self._control = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """Start sampling (restarting with the new interval if already running)"""
+        with self._control:
+            if interval is not None:
+                self.interval = interval
+            if self._thread is not None:
+                self._stop.set()
+                self._thread.join()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                            name='sampling-profiler', daemon=True)
+            self.started_at = time.time()
+            self._thread.start()
+
+    def stop(self):
+        with self._control:
+            if self._thread is None:
+                return
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self, stop):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            del frames
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        """``stack count`` lines, most frequent first"""
+        with self._lock:
+            top = self._stacks.most_common(limit)
+        return ''.join(f'{stack} {count}\n' for stack, count in top)
+
+
+profiler = SamplingProfiler()
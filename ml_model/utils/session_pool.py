@@ -0,0 +1,67 @@
+"""
+Per-thread pool of expensive, non-thread-safe sessions.
+
+Building a MediaPipe FaceMesh graph costs far more than running it on one
+image, so sessions are created once per thread (and per configuration) and
+reused. Each thread gets its own session because a graph must not be used
+by two threads at once. Sessions created before a fork are never reused in
+the child, and every session is closed on interpreter exit or close_all().
+"""
+
+import atexit
+import os
+import threading
+
+
+class SessionPool:
+    """Lazily created sessions, one per (thread, options)"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = []
+        self._pid = os.getpid()
+        atexit.register(self.close_all)
+
+    def get(self, **options):
+        """Return this thread's session for ``options``, creating it on first use"""
+        self._check_fork()
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+
+        key = tuple(sorted(options.items()))
+        session = sessions.get(key)
+        if session is None:
+            session = self.factory(**options)
+            sessions[key] = session
+            with self._lock:
+                self._open.append(session)
+        return session
+
+    def __len__(self):
+        with self._lock:
+            return len(self._open)
+
+    def close_all(self):
+        """Close every session created in this process"""
+        self._check_fork()
+        with self._lock:
+            sessions, self._open = self._open, []
+            # Threads holding a closed session build a fresh one next time
+            self._local = threading.local()
+
+        for session in sessions:
+            try:
+                session.close()
+            except Exception as e:
+                print(f"Error closing session: {e}")
+
+    def _check_fork(self):
+        # Sessions inherited from the parent process belong to the parent
+        if self._pid != os.getpid():
+            with self._lock:
+                self._pid = os.getpid()
+                self._open = []
+                self._local = threading.local()
@@ -0,0 +1,475 @@
+"""
+Headless recognition pipeline for video files, cameras and RTSP streams.
+
+Frames flow through five stages, each in its own thread and connected by
+bounded queues, so decoding, FaceMesh inference and matching overlap:
+
+    decode -> detect -> embed -> match -> log
+
+detect runs FaceMesh in streaming mode (static_image_mode=False), drops
+faces that fail the quality gate (utils/face_quality) and an IoU tracker
+assigns a track id to every remaining face. embed computes embeddings
+for all tracked faces (cheap), but match only runs for tracks that are new,
+whose embedding drifted away from the one last identified, or that are
+still unknown after STREAM_UNKNOWN_RETRY seconds. log writes attendance
+for identified tracks, at most once per ATTENDANCE_LOG_INTERVAL per person.
+
+Files are read as fast as the pipeline can go without dropping frames.
+Live sources never wait: when detection falls behind, the oldest queued
+frame is dropped so latency stays bounded.
+
+Usage:
+    python -m utils.stream_pipeline video.mp4 --gallery-dir ../data/gallery
+    python -m utils.stream_pipeline rtsp://camera/stream --attendance-file ../data/attendance.json
+"""
+
+import argparse
+import queue
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from config import (
+    SIMILARITY_THRESHOLD, ATTENDANCE_LOG_INTERVAL, MAX_NUM_FACES,
+    FACE_DETECTION_CONFIDENCE, FACE_TRACKING_CONFIDENCE,
+    STREAM_QUEUE_SIZE, STREAM_IOU_THRESHOLD, STREAM_MAX_MISSED,
+    STREAM_DRIFT_SIMILARITY, STREAM_UNKNOWN_RETRY, TEMPLATE_SCORE_TOP
+)
+from utils.embedding_layout import EMBEDDING_DIM, landmarks_to_array, landmarks_to_embedding
+
+LIVE_PREFIXES = ('rtsp://', 'rtmp://', 'http://', 'https://')
+
+
+def bounding_boxes(faces):
+    """(n, 4) array of normalized [x0, y0, x1, y1] boxes around landmark arrays"""
+    if not len(faces):
+        return np.zeros((0, 4), dtype=np.float32)
+    points = np.stack(faces)[:, :, :2]
+    return np.concatenate((points.min(axis=1), points.max(axis=1)), axis=1)
+
+
+def iou_matrix(a, b):
+    """Pairwise intersection-over-union of two sets of boxes"""
+    x0 = np.maximum(a[:, np.newaxis, 0], b[np.newaxis, :, 0])
+    y0 = np.maximum(a[:, np.newaxis, 1], b[np.newaxis, :, 1])
+    x1 = np.minimum(a[:, np.newaxis, 2], b[np.newaxis, :, 2])
+    y1 = np.minimum(a[:, np.newaxis, 3], b[np.newaxis, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, np.newaxis] + area_b[np.newaxis, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, box, timestamp):
+        self.id = track_id
+        self.box = box
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.missed = 0
+        # Unit-length embedding last sent to the match stage and when
+        self.reference = None
+        self.identified_at = None
+        # Identity, set by the match stage
+        self.name = None
+        self.confidence = 0.0
+
+    @property
+    def label(self):
+        return self.name or 'Unknown'
+
+
+class IoUTracker:
+    """Greedy IoU association of detections to existing tracks"""
+
+    def __init__(self, iou_threshold=STREAM_IOU_THRESHOLD, max_missed=STREAM_MAX_MISSED):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, boxes, timestamp):
+        """Return the track for each box, creating tracks for new faces"""
+        assigned = [None] * len(boxes)
+        seen = set()
+        if self.tracks and len(boxes):
+            overlap = iou_matrix(np.array([t.box for t in self.tracks]), boxes)
+            # Best overlaps first; each track and box is used once
+            for flat in np.argsort(-overlap, axis=None):
+                ti, bi = divmod(int(flat), len(boxes))
+                if overlap[ti, bi] < self.iou_threshold:
+                    break
+                if assigned[bi] is None and ti not in seen:
+                    track = self.tracks[ti]
+                    assigned[bi] = track
+                    seen.add(ti)
+                    track.box = boxes[bi]
+                    track.last_seen = timestamp
+                    track.missed = 0
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in seen:
+                track.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        for bi, track in enumerate(assigned):
+            if track is None:
+                track = Track(self._next_id, boxes[bi], timestamp)
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned[bi] = track
+        return assigned
+
+
+class FaceMeshDetector:
+    """Streaming-mode FaceMesh returning one (478, 3) landmark array per face"""
+
+    def __init__(self, max_num_faces=MAX_NUM_FACES,
+                 min_detection_confidence=FACE_DETECTION_CONFIDENCE,
+                 min_tracking_confidence=FACE_TRACKING_CONFIDENCE):
+        from utils.extract_embedding import create_face_mesh
+
+        # Streaming FaceMesh keeps tracking state, so each stream owns one
+        self.face_mesh = create_face_mesh(
+            static_image_mode=False,
+            refine_landmarks=True,
+            max_num_faces=max_num_faces,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence
+        )
+
+    def __call__(self, rgb):
+        results = self.face_mesh.process(rgb)
+        return [landmarks_to_array(face) for face in results.multi_face_landmarks or []]
+
+    def close(self):
+        self.face_mesh.close()
+
+
+class AttendanceLogger:
+    """Calls ``log(name, confidence, timestamp)`` at most once per interval per person.
+
+    Loggers given the same ``last`` dict share one rate limit.
+    """
+
+    def __init__(self, log, interval=ATTENDANCE_LOG_INTERVAL, last=None):
+        self.log = log
+        self.interval = interval
+        self._last = {} if last is None else last
+
+    def __call__(self, name, confidence, timestamp):
+        last = self._last.get(name)
+        if last is not None and timestamp - last < self.interval:
+            return False
+        self._last[name] = timestamp
+        self.log(name, confidence, timestamp)
+        return True
+
+
+def store_logger(aggregator):
+    """Attendance callback folding sightings into visits through an AttendanceAggregator"""
+    def log(name, confidence, timestamp):
+        aggregator.sighting(name, round(float(confidence), 4), datetime.utcfromtimestamp(timestamp))
+    return log
+
+
+class FrameJob:
+    """A frame and everything the stages learn about it"""
+
+    def __init__(self, index, timestamp, frame):
+        self.index = index
+        self.timestamp = timestamp
+        self.frame = frame
+        self.faces = []
+        self.tracks = []
+        self.embeddings = None
+        self.to_match = []
+
+
+def open_source(source):
+    """(capture, is_live) for a file path, camera index or stream URL"""
+    import cv2
+
+    live = isinstance(source, int) or str(source).isdigit() or str(source).startswith(LIVE_PREFIXES)
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"could not open video source {source!r}")
+    return capture, live
+
+
+class StreamPipeline:
+    """Decode -> detect -> embed -> match -> log over one video source.
+
+    ``source`` is a file path, camera index, stream URL or an iterable of
+    BGR frames. ``gallery`` is a Gallery or a callable returning the current
+    one (e.g. LiveGallery.current), and ``on_attendance(name, confidence,
+    timestamp)`` receives identified people, rate-limited per person.
+    Faces failing ``quality_gate`` (a QualityGate, or None for no gate) are
+    neither tracked nor embedded. Without a ``detector`` each run opens (and
+    closes) a FaceMeshDetector for up to ``max_num_faces`` faces.
+    """
+
+    def __init__(self, source, gallery, detector=None, on_attendance=None, live=None,
+                 threshold=SIMILARITY_THRESHOLD, drift_similarity=STREAM_DRIFT_SIMILARITY,
+                 unknown_retry=STREAM_UNKNOWN_RETRY, log_interval=ATTENDANCE_LOG_INTERVAL,
+                 queue_size=STREAM_QUEUE_SIZE, frame_stride=1, start_time=None, tracker=None,
+                 quality_gate=None, max_num_faces=MAX_NUM_FACES):
+        self.source = source
+        self.gallery = gallery if callable(gallery) else (lambda: gallery)
+        self.detector = detector
+        self.max_num_faces = max_num_faces
+        self.live = live
+        self.threshold = threshold
+        self.drift_similarity = drift_similarity
+        self.unknown_retry = unknown_retry
+        self.frame_stride = max(1, frame_stride)
+        self.start_time = start_time
+        self.tracker = tracker or IoUTracker()
+        self.quality_gate = quality_gate
+        self.attendance = AttendanceLogger(on_attendance, log_interval) if on_attendance else None
+        self.queue_size = queue_size
+
+        self.stats = {'frames_read': 0, 'frames_dropped': 0, 'frames_processed': 0,
+                      'faces': 0, 'rejected': 0, 'identifications': 0, 'logged': 0}
+        self.error = None
+        self._stop = threading.Event()
+
+    # Stages
+
+    def detect(self, job):
+        import cv2
+
+        rgb = cv2.cvtColor(job.frame, cv2.COLOR_BGR2RGB)
+        job.frame = None
+        job.faces = self.detector(rgb)
+        if self.quality_gate is not None and job.faces:
+            passed = [f for f in job.faces if self.quality_gate.check(rgb, f, order='rgb') is None]
+            self.stats['rejected'] += len(job.faces) - len(passed)
+            job.faces = passed
+        job.tracks = self.tracker.update(bounding_boxes(job.faces), job.timestamp)
+
+    def embed(self, job):
+        job.embeddings = np.empty((len(job.faces), EMBEDDING_DIM), dtype=np.float32)
+        for i, (points, track) in enumerate(zip(job.faces, job.tracks)):
+            emb = landmarks_to_embedding(points, out=job.embeddings[i])
+            # Embeddings are two unit-length parts, so normalize for a cosine
+            unit = emb / (np.linalg.norm(emb) or 1.0)
+            if track.reference is None:
+                due = True
+            elif float(unit @ track.reference) < self.drift_similarity:
+                due = True
+            else:
+                due = track.name is None and job.timestamp - track.identified_at >= self.unknown_retry
+            if due:
+                # Set here rather than in match so frames already in flight
+                # do not queue the same track again
+                track.reference = unit
+                track.identified_at = job.timestamp
+                job.to_match.append(i)
+
+    def match(self, job):
+        if not job.to_match:
+            return
+        self.apply_matches(job, self.gallery().identify_batch(job.embeddings[job.to_match], k=1))
+
+    def apply_matches(self, job, results):
+        """Label the job's tracks from identify_batch results for job.to_match"""
+        for i, matches in zip(job.to_match, results):
+            track = job.tracks[i]
+            name, score = matches[0] if matches else (None, 0.0)
+            track.name = name if score >= self.threshold else None
+            track.confidence = score
+        self.stats['identifications'] += len(job.to_match)
+
+    def log(self, job):
+        self.stats['frames_processed'] += 1
+        self.stats['faces'] += len(job.tracks)
+        if self.attendance is None:
+            return
+        for track in job.tracks:
+            if track.name is not None and self.attendance(track.name, track.confidence, job.timestamp):
+                self.stats['logged'] += 1
+
+    def process_frame(self, frame, timestamp):
+        """Run every stage on one frame in the calling thread; returns its tracks"""
+        job = FrameJob(self.stats['frames_read'], timestamp, frame)
+        self.stats['frames_read'] += 1
+        for stage in (self.detect, self.embed, self.match, self.log):
+            stage(job)
+        return job.tracks
+
+    # Threads
+
+    def frames(self):
+        """Yield (timestamp, frame) from the source, honouring frame_stride"""
+        if isinstance(self.source, (str, int)):
+            capture, live = open_source(self.source)
+            if self.live is None:
+                self.live = live
+            start = self.start_time or time.time()
+            try:
+                index = 0
+                while not self._stop.is_set():
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    if index % self.frame_stride == 0:
+                        if self.live:
+                            timestamp = time.time()
+                        else:
+                            import cv2
+                            timestamp = start + capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                        yield timestamp, frame
+                    index += 1
+            finally:
+                capture.release()
+        else:
+            for index, frame in enumerate(self.source):
+                if self._stop.is_set():
+                    break
+                if index % self.frame_stride == 0:
+                    yield time.time(), frame
+
+    def _decode(self, out):
+        index = 0
+        try:
+            for timestamp, frame in self.frames():
+                job = FrameJob(index, timestamp, frame)
+                index += 1
+                self.stats['frames_read'] += 1
+                if not self.live:
+                    out.put(job)
+                    continue
+                # Live: never block the camera; replace the oldest queued frame
+                while True:
+                    try:
+                        out.put_nowait(job)
+                        break
+                    except queue.Full:
+                        try:
+                            out.get_nowait()
+                            self.stats['frames_dropped'] += 1
+                        except queue.Empty:
+                            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            out.put(None)
+
+    def _stage(self, fn, inbox, out):
+        failed = False
+        while True:
+            job = inbox.get()
+            if job is None:
+                break
+            # After a failure keep draining so upstream stages never block
+            if failed or self._stop.is_set():
+                continue
+            try:
+                fn(job)
+            except Exception as e:
+                self._fail(e)
+                failed = True
+                continue
+            if out is not None:
+                out.put(job)
+        if out is not None:
+            out.put(None)
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self._stop.set()
+
+    def stop(self):
+        """Ask a running pipeline to finish after the frames already read"""
+        self._stop.set()
+
+    def run(self):
+        """Process the whole source with one thread per stage; returns stats"""
+        owns_detector = self.detector is None
+        if owns_detector:
+            self.detector = FaceMeshDetector(max_num_faces=self.max_num_faces)
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(4)]
+        stages = [(self.detect, queues[0], queues[1]), (self.embed, queues[1], queues[2]),
+                  (self.match, queues[2], queues[3]), (self.log, queues[3], None)]
+        threads = [threading.Thread(target=self._decode, args=(queues[0],), daemon=True)]
+        threads += [threading.Thread(target=self._stage, args=stage, daemon=True) for stage in stages]
+
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if owns_detector:
+                self.detector.close()
+                self.detector = None
+
+        elapsed = time.perf_counter() - start
+        self.stats['seconds'] = elapsed
+        self.stats['fps'] = self.stats['frames_processed'] / elapsed if elapsed > 0 else 0.0
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recognize faces in a video file, camera or stream')
+    parser.add_argument('source', help='video file, camera index or rtsp:// URL')
+    parser.add_argument('--gallery-dir', default='../data/gallery')
+    parser.add_argument('--attendance-file', default=None,
+                        help='log attendance to this file (e.g. ../data/attendance.json)')
+    parser.add_argument('--stride', type=int, default=1, help='process every Nth frame')
+    parser.add_argument('--max-faces', type=int, default=MAX_NUM_FACES)
+    parser.add_argument('--no-quality-gate', action='store_true',
+                        help='track and match every detected face, however small, blurry or turned')
+    args = parser.parse_args()
+
+    from utils.embedding_store import EmbeddingStore
+    from utils.face_quality import default_gate
+    from utils.gallery import LiveGallery
+
+    gallery = LiveGallery(EmbeddingStore(args.gallery_dir), template_top=TEMPLATE_SCORE_TOP)
+    on_attendance = None
+    store = None
+    if args.attendance_file:
+        from utils.attendance_aggregator import AttendanceAggregator
+        from utils.attendance_store import AttendanceStore, log_path_for
+        store = AttendanceStore(log_path_for(args.attendance_file), legacy_path=args.attendance_file)
+        aggregator = AttendanceAggregator(store)
+        on_attendance = store_logger(aggregator)
+
+    def report(name, confidence, timestamp):
+        print(f"✔ {name} ({confidence:.3f}) at {datetime.fromtimestamp(timestamp).isoformat()}")
+        if on_attendance:
+            on_attendance(name, confidence, timestamp)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    pipeline = StreamPipeline(source, gallery.current, on_attendance=report,
+                              max_num_faces=args.max_faces,
+                              frame_stride=args.stride,
+                              quality_gate=None if args.no_quality_gate else default_gate())
+    try:
+        stats = pipeline.run()
+    except KeyboardInterrupt:
+        pipeline.stop()
+        stats = pipeline.stats
+    finally:
+        if store is not None:
+            aggregator.close()
+            store.close()
+
+    print(f"Processed {stats['frames_processed']} frames ({stats['frames_dropped']} dropped), "
+          f"{stats['rejected']} faces rejected on quality, "
+          f"{stats['identifications']} identifications, {stats['logged']} attendance records, "
+          f"{stats.get('fps', 0):.1f} fps")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 const API_BASE = 'http://localhost:5000';
+const PAGE_SIZE = 500;
 let allRecords = [];
+let nextCursor = null;
 
 // DOM Elements
 const tableBody = document.getElementById('tableBody');
@@ -21,15 +23,29 @@ filterBtn.addEventListener('click', applyFilters);
 resetBtn.addEventListener('click', resetFilters);
 exportBtn.addEventListener('click', exportToCSV);
 
-async function loadAttendanceRecords() {
+function buildQuery(cursor) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    const name = filterNameInput.value.trim();
+    const date = filterDateInput.value;
+    
+    if (name) params.set('name', name);
+    if (date) params.set('date', date);
+    if (cursor) params.set('cursor', cursor);
+    
+    return params.toString();
+}
+
+async function loadAttendanceRecords(append = false) {
     try {
-        const response = await fetch(`${API_BASE}/api/attendance`);
+        const response = await fetch(`${API_BASE}/api/attendance?${buildQuery(append ? nextCursor : null)}`);
         
         if (!response.ok) {
             throw new Error('Failed to fetch attendance records');
         }
         
-        allRecords = await response.json();
+        const page = await response.json();
+        allRecords = append ? allRecords.concat(page) : page;
+        nextCursor = response.headers.get('X-Next-Cursor');
         displayRecords(allRecords);
         updateRecordCount(allRecords.length);
     } catch (error) {
@@ -67,37 +83,27 @@ function displayRecords(records) {
             </td>
         </tr>
     `).join('');
-}
-
-function applyFilters() {
-    const name = filterNameInput.value.trim();
-    const date = filterDateInput.value;
-    
-    let filtered = allRecords;
     
-    if (name) {
-        filtered = filtered.filter(record => 
-            record.name.toLowerCase().includes(name.toLowerCase())
-        );
-    }
-    
-    if (date) {
-        filtered = filtered.filter(record => {
-            const recordDate = record.timestamp.split('T')[0];
-            return recordDate === date;
-        });
+    if (nextCursor) {
+        tableBody.innerHTML += `
+            <tr>
+                <td colspan="4" class="empty-state">
+                    <button onclick="loadAttendanceRecords(true)">Load more</button>
+                </td>
+            </tr>
+        `;
     }
-    
-    displayRecords(filtered);
-    updateRecordCount(filtered.length);
-    showStatus(`Showing ${filtered.length} record(s)`, 'success');
 }
 
-function resetFilters() {
+async function applyFilters() {
+    await loadAttendanceRecords();
+    showStatus(`Showing ${allRecords.length}${nextCursor ? '+' : ''} record(s)`, 'success');
+}
+
+async function resetFilters() {
     filterNameInput.value = '';
     filterDateInput.value = '';
-    displayRecords(allRecords);
-    updateRecordCount(allRecords.length);
+    await loadAttendanceRecords();
     showStatus('Filters reset', 'success');
 }
 
@@ -124,34 +130,23 @@ async function deleteRecord(recordId) {
 }
 
 function exportToCSV() {
-    if (allRecords.length === 0) {
-        showStatus('No records to export', 'error');
-        return;
-    }
-    
-    const headers = ['Person Name', 'Timestamp', 'Confidence (%)'];
-    const rows = allRecords.map(record => [
-        record.name,
-        formatDateTime(record.timestamp),
-        (record.confidence * 100).toFixed(2)
-    ]);
+    // The server streams every matching record (not just the loaded pages),
+    // so large exports neither hold the history in memory nor block the page
+    const params = new URLSearchParams({ format: 'csv' });
+    const name = filterNameInput.value.trim();
+    const date = filterDateInput.value;
     
-    let csv = headers.join(',') + '\n';
-    rows.forEach(row => {
-        csv += row.map(cell => `"${cell}"`).join(',') + '\n';
-    });
+    if (name) params.set('name', name);
+    if (date) params.set('date', date);
     
-    const blob = new Blob([csv], { type: 'text/csv' });
-    const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
-    a.href = url;
+    a.href = `${API_BASE}/api/attendance/export?${params.toString()}`;
     a.download = `attendance_${new Date().toISOString().split('T')[0]}.csv`;
     document.body.appendChild(a);
     a.click();
     document.body.removeChild(a);
-    URL.revokeObjectURL(url);
     
-    showStatus('Attendance data exported successfully', 'success');
+    showStatus('Attendance export started', 'success');
 }
 
 function formatDateTime(isoString) {
@@ -17,6 +17,14 @@ let faceLabels = []; // Stores { box: [x,y,w,h], label: "Name", color: "green" }
 // Attendance tracking
 let lastAttendanceLog = {}; // { personName: timestamp }
 
+// Quality gate: faces that are too small or turned away are not matched
+// (same limits as QUALITY_* in ml_model/config.py)
+const QUALITY_MIN_FACE_SIZE = 64; // pixels
+const QUALITY_MAX_YAW = 35; // degrees
+const QUALITY_MAX_PITCH = 30;
+const QUALITY_MAX_ROLL = 30;
+const QUALITY_LABELS = { too_small: "Move closer", off_pose: "Face the camera" };
+
 // Resize canvas to full screen
 function resizeCanvas() {
   CANVAS.width = window.innerWidth;
@@ -25,27 +33,45 @@ function resizeCanvas() {
 window.addEventListener('resize', resizeCanvas);
 resizeCanvas();
 
+// Gallery sync state: one full download, then only what changed since galleryVersion
+const GALLERY_POLL_INTERVAL = 30000; // 30 seconds
+let galleryVersion = null;
+
+// Unpack the f32 gallery layout: uint32 header length, JSON header, float32 rows.
+// A name repeats once per template, so each person maps to a list of rows.
+function decodeGallery(buffer) {
+  const headerLength = new DataView(buffer).getUint32(0, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+  const rows = new Float32Array(buffer, 4 + headerLength);
+  const gallery = {};
+  header.names.forEach((name, i) => {
+    (gallery[name] = gallery[name] || []).push(rows.subarray(i * header.dim, (i + 1) * header.dim));
+  });
+  return { header, gallery };
+}
+
 // Load embeddings from API
 async function loadEmbeddings() {
   try {
-    const res = await fetch(`${API_BASE}/api/embeddings`);
+    const url = galleryVersion === null
+      ? `${API_BASE}/api/gallery?format=f32`
+      : `${API_BASE}/api/gallery/changes?since=${galleryVersion}&format=f32`;
+    const res = await fetch(url);
     if (res.ok) {
-      const embeddingsList = await res.json();
-      
-      for (let item of embeddingsList) {
-        try {
-          const embRes = await fetch(`embeddings/${item.path.split('/')[1]}`);
-          if (embRes.ok) {
-            const data = await embRes.json();
-            embeddings[item.name] = new Float32Array(data.embedding);
-            console.log(`Loaded embedding for ${item.name}`);
-          }
-        } catch (e) {
-          console.warn(`Could not load embedding for ${item.name}`);
-        }
+      const { header, gallery } = decodeGallery(await res.arrayBuffer());
+      if (galleryVersion === null || header.snapshot) {
+        embeddings = gallery;
+      } else {
+        for (let name of header.removed) delete embeddings[name];
+        Object.assign(embeddings, gallery);
+      }
+      if (header.version !== galleryVersion) {
+        console.log(`Gallery at version ${header.version}: ${Object.keys(embeddings).length} embeddings`);
       }
+      galleryVersion = header.version;
     }
   } catch (e) {
+    if (galleryVersion !== null) return; // Keep the gallery we have until the server is back
     console.warn('Could not load embeddings from API, trying fallback...');
     // Fallback to local embeddings
     const persons = ["Aditya"];
@@ -54,7 +80,7 @@ async function loadEmbeddings() {
         const res = await fetch(`embeddings/${p}_embedding.json`);
         if (res.ok) {
           const data = await res.json();
-          embeddings[p] = new Float32Array(data.embedding);
+          embeddings[p] = [new Float32Array(data.embedding)];
           console.log(`Loaded embedding for ${p}`);
         }
       } catch (e) {
@@ -64,6 +90,7 @@ async function loadEmbeddings() {
   }
 }
 loadEmbeddings();
+setInterval(loadEmbeddings, GALLERY_POLL_INTERVAL);
 
 function cosine(a, b) {
   let dot = 0, na = 0, nb = 0;
@@ -102,8 +129,11 @@ function extractEmbedding(landmarks) {
   let raw = new Float32Array(arr);
   let der = new Float32Array(derived);
 
-  raw = raw.map(v => v / (Math.sqrt(raw.reduce((a, b) => a + b * b, 0)) || 1));
-  der = der.map(v => v / (Math.sqrt(der.reduce((a, b) => a + b * b, 0)) || 1));
+  // Norms computed once per part, not once per element
+  const rawNorm = Math.sqrt(raw.reduce((a, b) => a + b * b, 0)) || 1;
+  const derNorm = Math.sqrt(der.reduce((a, b) => a + b * b, 0)) || 1;
+  raw = raw.map(v => v / rawNorm);
+  der = der.map(v => v / derNorm);
 
   let final = new Float32Array(raw.length + der.length);
   final.set(raw);
@@ -111,6 +141,28 @@ function extractEmbedding(landmarks) {
   return final;
 }
 
+// Reason a face should not be matched ("too_small", "off_pose"), or null
+function faceQualityIssue(landmarks, w, h) {
+  if (Math.min(w, h) < QUALITY_MIN_FACE_SIZE) return "too_small";
+
+  // Normal of the plane through both outer eye corners and the chin, in pixels
+  const W = CANVAS.width, H = CANVAS.height;
+  const p = i => [landmarks[i].x * W, landmarks[i].y * H, landmarks[i].z * W];
+  const l = p(33), r = p(263), c = p(152);
+  const across = [r[0] - l[0], r[1] - l[1], r[2] - l[2]];
+  const up = [(l[0] + r[0]) / 2 - c[0], (l[1] + r[1]) / 2 - c[1], (l[2] + r[2]) / 2 - c[2]];
+  const nx = across[1] * up[2] - across[2] * up[1];
+  const ny = across[2] * up[0] - across[0] * up[2];
+  const nz = across[0] * up[1] - across[1] * up[0];
+  const deg = Math.PI / 180;
+  const yaw = Math.atan2(nx, -nz) / deg;
+  const pitch = Math.atan2(ny, -nz) / deg;
+  const roll = Math.atan2(across[1], across[0]) / deg;
+  if (Math.abs(yaw) > QUALITY_MAX_YAW || Math.abs(pitch) > QUALITY_MAX_PITCH ||
+      Math.abs(roll) > QUALITY_MAX_ROLL) return "off_pose";
+  return null;
+}
+
 function identifyFace(landmarks) {
   if (!Object.keys(embeddings).length) return { name: "Loading...", color: "yellow", confidence: 0 };
 
@@ -118,11 +170,14 @@ function identifyFace(landmarks) {
   let bestPerson = "unknown";
   let bestSim = -1;
 
+  // A person scores their best-matching template
   for (let p in embeddings) {
-    let sim = cosine(emb, embeddings[p]);
-    if (sim > bestSim) {
-      bestSim = sim;
-      bestPerson = p;
+    for (let template of embeddings[p]) {
+      let sim = cosine(emb, template);
+      if (sim > bestSim) {
+        bestSim = sim;
+        bestPerson = p;
+      }
     }
   }
 
@@ -169,7 +224,12 @@ function drawResults(results) {
     // But to keep it simple and responsive:
 
     let labelData;
-    if (shouldVerify) {
+    const issue = faceQualityIssue(landmarks, w, h);
+    if (issue) {
+      // Not worth an embedding; also keeps cached labels aligned with face indexes
+      labelData = { name: QUALITY_LABELS[issue], color: "orange", confidence: 0 };
+      if (shouldVerify) faceLabels.push(labelData);
+    } else if (shouldVerify) {
       labelData = identifyFace(landmarks);
       faceLabels.push(labelData); // Cache it (simple cache, assumes order stays same for 200ms)
       